@@ -0,0 +1,227 @@
+"""
+Semantic cache of chat answers, per lecture.
+
+Students of the same lecture ask the same things in different words ("what
+is the main point?", "what's the main point of the lecture"). Answers to
+questions that stand on their own are kept in the state store (shared by
+all workers, and by every upload of the same lecture), one entry per
+lecture cache key and normalised question, so concurrent answers never
+overwrite each other. A new question is answered from the cache when, after
+normalisation, it is the same question or its local embedding (hashed
+unigrams and bigrams without stopwords) is at least ANSWER_CACHE_SIMILARITY
+cosine-similar to a cached one, mentions the same numbers (so "summarize
+chapter 2" never gets chapter 3's answer) and has the words the two share in
+the same order (so "is merge sort faster than quick sort" never gets the
+answer to "is quick sort faster than merge sort").
+
+Questions that refer back to the conversation ("why is that?", "give another
+example") bypass the cache once the session has earlier turns.
+"""
+import logging
+import math
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+import metrics
+from state_store import get_state_store
+from telemetry import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+# Minimum cosine similarity between questions to reuse an answer (above 1 disables matching)
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.85'))
+# Cached answers expire after this long
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv('ANSWER_CACHE_TTL_SECONDS', 7 * 24 * 60 * 60))
+# Answers kept per lecture; the oldest are dropped first (the limit may be
+# briefly exceeded by concurrent stores)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '200'))
+
+NAMESPACE = 'answers'
+# Chat histories start with the transcript context and the summary (see summarize.chat_context)
+CONTEXT_TURNS = 2
+N_FEATURES = 1 << 20
+# Words of a question; keeps "+" and "#" so "c++" and "c#" are not "c"
+QUESTION_TOKEN_REGEX = re.compile(r"[a-z0-9']+[+#]*")
+
+STOPWORDS = frozenset("""
+a an the is are was were be been being am do does did of in on at to for from by with about as into
+and or but so what what's whats which who whom how can could would should will shall may might must
+please me my i you your us we our tell explain give show describe let lets let's there here
+lecture video class talk
+""".split())
+NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+    'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5, 'sixth': 6, 'seventh': 7, 'eighth': 8,
+    'ninth': 9, 'tenth': 10, 'last': -1,
+}
+# Words that point back at earlier turns of the conversation
+FOLLOW_UP_REGEX = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|their|he|she|him|her|above|previous|previously|earlier|"
+    r"again|more|else|another|further|also|same|said|mentioned|elaborate|continue|why)\b"
+)
+# Follow-ups are often just a word or two ("and then?", "example?")
+MIN_STANDALONE_WORDS = 3
+
+ANSWER_CACHE_BYPASS = metrics.counter(
+    "answer_cache_bypass_total",
+    "Chat questions that skipped the answer cache because they may refer to earlier turns",
+)
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase a question and reduce it to its words."""
+    return " ".join(QUESTION_TOKEN_REGEX.findall(question.lower()))
+
+
+def _stem(word: str) -> str:
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def _number(word: str) -> Optional[int]:
+    """The number a word stands for, as digits or in words ("2", "2nd", "two", "second")."""
+    digits = re.match(r"\d+", word)
+    if digits:
+        return int(digits.group())
+    return NUMBER_WORDS.get(word)
+
+
+def _terms(normalized: str) -> List[str]:
+    terms = []
+    for word in normalized.split():
+        number = _number(word)
+        if number is not None:
+            terms.append(str(number))
+        elif word not in STOPWORDS:
+            terms.append(_stem(word))
+    return terms
+
+
+def _numbers(normalized: str) -> List[int]:
+    """Numbers mentioned in a question."""
+    return sorted({number for number in map(_number, normalized.split()) if number is not None})
+
+
+def embed_question(normalized: str) -> Dict[int, float]:
+    """
+    Embed a normalised question as an L2-normalised sparse vector of hashed
+    unigrams and bigrams of its non-stopword (lightly stemmed) words.
+    """
+    terms = _terms(normalized)
+    features = terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+    vector: Dict[int, float] = {}
+    for feature in features:
+        col = zlib.crc32(feature.encode()) % N_FEATURES
+        vector[col] = vector.get(col, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {col: v / norm for col, v in vector.items()}
+
+
+def _similarity(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(col, 0.0) for col, v in a.items())
+
+
+def _same_order(a: List[str], b: List[str]) -> bool:
+    """Whether the terms two questions share appear in the same order in both."""
+    shared = set(a) & set(b)
+    return [t for t in a if t in shared] == [t for t in b if t in shared]
+
+
+def depends_on_history(question: str, history: List[Dict[str, Any]]) -> bool:
+    """
+    Whether a question may refer to earlier turns of the chat, so its answer
+    must not come from (or go to) the cache.
+
+    Args:
+        question: The user's message
+        history: The session's serialized history before this question
+    """
+    if len(history) <= CONTEXT_TURNS:
+        return False
+    normalized = normalize_question(question)
+    return len(normalized.split()) < MIN_STANDALONE_WORDS or FOLLOW_UP_REGEX.search(normalized) is not None
+
+
+def _entry_key(lecture_key: str, normalized: str) -> str:
+    return f"{lecture_key}/{normalized}"
+
+
+def _entries(lecture_key: str) -> Dict[str, Dict[str, Any]]:
+    """A lecture's cached answers that have not expired, by state store key."""
+    return get_state_store().scan(NAMESPACE, f"{lecture_key}/")
+
+
+def lookup(lecture_key: str, question: str, history: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Find a cached answer to a question about a lecture.
+
+    Args:
+        lecture_key: The lecture's cache key
+        question: The user's message
+        history: The session's serialized history before this question
+
+    Returns:
+        The cached answer, or None
+    """
+    if depends_on_history(question, history):
+        ANSWER_CACHE_BYPASS.inc()
+        return None
+
+    normalized = normalize_question(question)
+    vector = embed_question(normalized)
+    numbers = _numbers(normalized)
+    terms = _terms(normalized)
+    best, best_similarity = None, ANSWER_CACHE_SIMILARITY
+    for entry in _entries(lecture_key).values():
+        if entry['normalized'] == normalized:
+            best, best_similarity = entry, 1.0
+            break
+        if entry['numbers'] != numbers:
+            continue
+        similarity = _similarity(vector, {col: v for col, v in entry['vector']})
+        if similarity >= best_similarity and _same_order(terms, _terms(entry['normalized'])):
+            best, best_similarity = entry, similarity
+
+    record_cache_lookup('chat_answer', hits=int(best is not None), misses=int(best is None))
+    if best is None:
+        return None
+    logger.info("Answering %r from the cached answer to %r (similarity %.2f)",
+                question, best['question'], best_similarity)
+    return best['answer']
+
+
+def store(lecture_key: str, question: str, history: List[Dict[str, Any]], answer: str) -> None:
+    """
+    Cache the answer to a question about a lecture, unless the question
+    depends on earlier turns.
+
+    Args:
+        lecture_key: The lecture's cache key
+        question: The user's message
+        history: The session's serialized history before this question
+        answer: The model's answer
+    """
+    if not answer.strip() or depends_on_history(question, history):
+        return
+    store = get_state_store()
+    normalized = normalize_question(question)
+    store.set(NAMESPACE, _entry_key(lecture_key, normalized), {
+        'question': question,
+        'normalized': normalized,
+        'vector': [[col, v] for col, v in embed_question(normalized).items()],
+        'numbers': _numbers(normalized),
+        'answer': answer,
+        'created_at': time.time(),
+    }, ttl=ANSWER_CACHE_TTL_SECONDS)
+
+    entries = _entries(lecture_key)
+    if len(entries) > ANSWER_CACHE_MAX_ENTRIES:
+        oldest = sorted(entries, key=lambda key: entries[key]['created_at'])
+        for key in oldest[:len(entries) - ANSWER_CACHE_MAX_ENTRIES]:
+            store.delete(NAMESPACE, key)
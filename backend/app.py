@@ -1,27 +1,69 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 import os
 import uuid
 import hashlib
 import json
+import time
+import gzip
+import logging
+from datetime import datetime, timezone
+from functools import lru_cache
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import is_resource_modified
 from werkzeug.utils import secure_filename
 
 # Import our refactored modules
-from video2transcript import transcribe_video, save_transcript
+from video2transcript import load_audio, transcribe_video, reuse_transcript, save_transcript
+from fingerprint import fingerprint_audio, get_fingerprint_index
+from transcription_queue import estimate_duration, get_transcription_scheduler
 from chapterize import generate_chapters, save_chapters_to_file
-from summarize import initialize_chat, generate_summary, send_chat_message
+from summarize import chat_context, summarize_lecture, send_chat_message, stream_chat_message, serialize_history, restore_chat
+from inflight import single_flight
+from state_store import get_state_store
+from cache import (
+    CACHE_FOLDER, get_cache_key, get_content_hash, find_cache_key,
+    save_to_cache, load_from_cache, get_cache_dir, get_video_cache_key, record_video
+)
+import metrics
+from telemetry import configure_logging, stage, record_cache_lookup
+from resilience import deadline
+from ingest import PIPELINED_INGEST, IngestRequest, PipelinedIngest
+import resumable
+import answer_cache
+from routes.flashcard import flashcard_bp, schedule_flashcards
+from routes.profiles import profiles_bp
+from routes.search import search_bp
 from flask_cors import CORS
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
 # Initialize Flask app
 app = Flask(__name__, template_folder='templates')
+# Lets /api/upload hand the video to a PipelinedIngest as it arrives
+app.request_class = IngestRequest
 CORS(app)
+app.register_blueprint(flashcard_bp)
+app.register_blueprint(profiles_bp)
+app.register_blueprint(search_bp)
 
 # Configuration
 UPLOAD_FOLDER = 'data/videos'
 TRANSCRIPT_FOLDER = 'data/transcripts'
 CHAPTERS_FOLDER = 'data/chapters'
-CACHE_FOLDER = 'data/cache'
-CACHE_INDEX_FILE = os.path.join(CACHE_FOLDER, 'cache_index.json')
+INFLIGHT_FOLDER = os.path.join(CACHE_FOLDER, 'inflight')
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv'}
+# Time budget for the LLM steps of processing an upload (chapters, summary),
+# counted from the end of transcription; steps fall back to local results
+# once it runs out
+UPLOAD_DEADLINE_SECONDS = float(os.getenv('UPLOAD_DEADLINE_SECONDS', 20 * 60))
+# Chat sessions expire this long after their last message
+CHAT_SESSION_TTL_SECONDS = float(os.getenv('CHAT_SESSION_TTL_SECONDS', 7 * 24 * 60 * 60))
 
 # Create necessary directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -29,134 +71,317 @@ os.makedirs(TRANSCRIPT_FOLDER, exist_ok=True)
 os.makedirs(CHAPTERS_FOLDER, exist_ok=True)
 os.makedirs(CACHE_FOLDER, exist_ok=True)
 
-# In-memory chat sessions storage
-chat_sessions = {}
+# Chat sessions and job status live in a shared state store so any worker
+# process can serve any session (see STATE_BACKEND in state_store.py).
+# A session ('chats') refers to its lecture by cache key; its turns are
+# appended to a list ('chat_turns') so concurrent messages never drop each other
+state_store = get_state_store()
+
+# Metrics
+CHAT_TTFT = metrics.histogram(
+    'chat_time_to_first_token_seconds',
+    'Time from receiving a streaming chat request to sending the first token'
+)
+CHAT_STREAM_DURATION = metrics.histogram(
+    'chat_stream_duration_seconds',
+    'Total time to stream a chat response'
+)
+CHAT_STREAM_ERRORS = metrics.counter(
+    'chat_stream_errors_total',
+    'Streaming chat responses that failed part-way through'
+)
+ACTIVE_SESSIONS = metrics.gauge(
+    'chat_sessions_active',
+    'Chat sessions in the shared state store that have not expired'
+)
+ACTIVE_SESSIONS.set_function(lambda: state_store.count('chats'))
+TRANSCRIPTION_QUEUE_WAIT = metrics.histogram(
+    'transcription_queue_wait_seconds',
+    'Time uploads wait for a transcription slot'
+)
+TRANSCRIPTION_QUEUE_LENGTH = metrics.gauge(
+    'transcription_queue_waiting',
+    'Uploads waiting for a transcription slot on this host'
+)
+TRANSCRIPTION_QUEUE_LENGTH.set_function(lambda: get_transcription_scheduler().counts()['waiting'])
+UPLOADS_IN_PROGRESS = metrics.gauge(
+    'upload_jobs_in_progress',
+    'Uploads this worker is currently processing'
+)
+
+# Transcript pagination
+DEFAULT_TRANSCRIPT_PAGE_SIZE = 200
+MAX_TRANSCRIPT_PAGE_SIZE = 1000
+MIN_COMPRESS_BYTES = 1024
+
+VIDEO_MIMETYPES = {'mp4': 'video/mp4', 'mov': 'video/quicktime', 'avi': 'video/x-msvideo', 'mkv': 'video/x-matroska'}
+# A video_id's file never changes, so players may cache it this long
+VIDEO_MAX_AGE_SECONDS = 365 * 24 * 60 * 60
+VIDEO_BUFFER_BYTES = 256 * 1024
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 
 
+def get_client_id():
+    """Identify who sent the current request: the X-Client-Id header, else the client address."""
+    return request.headers.get('X-Client-Id') or request.remote_addr or 'anonymous'
+
+
 def allowed_file(filename):
     """Check if the file extension is allowed."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def get_cache_key(filename):
-    """Generate MD5 hash from filename for cache directory name."""
-    return hashlib.md5(filename.encode()).hexdigest()
+def respond_from_cache(video_id, original_filename, cache_key):
+    """
+    Build the upload response from cached data and start a new chat session.
 
+    Returns:
+        Response data dict, or None if the cache could not be loaded
+    """
+    with stage('cache_load'):
+        transcript_data, chapters, summary = load_from_cache(cache_key)
+    
+    if not (transcript_data and chapters and summary):
+        logger.warning("Failed to load %s from cache, processing normally", cache_key)
+        return None
+    
+    # Initialize new chat session with cached transcript and summary
+    with stage('chat_init'):
+        start_chat_session(video_id, cache_key)
+        record_video(video_id, cache_key, original_filename)
+    logger.info("Chat session %s initialized from cache", video_id)
+    
+    # Generate flashcards in the background if this lecture has no deck yet
+    schedule_flashcards(video_id)
+    
+    return {
+        'video_id': video_id,
+        'filename': original_filename,
+        'transcript_url': f"/api/videos/{video_id}/transcript",
+        'stream_url': f"/api/videos/{video_id}/stream",
+        'segment_count': len(transcript_data['segments']),
+        'chapters': chapters,
+        'summary': summary,
+        'chat_ready': True,
+        'cached': True
+    }
 
-def get_cache_index():
-    """Load the cache index from file."""
-    if os.path.exists(CACHE_INDEX_FILE):
-        try:
-            with open(CACHE_INDEX_FILE, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading cache index: {e}")
-            return {}
-    return {}
 
+def find_audio_match(audio_fingerprint):
+    """
+    Look for a cached lecture with the same audio as an upload.
 
-def update_cache_index(filename, cache_key):
-    """Update the cache index with a new entry."""
-    cache_index = get_cache_index()
-    cache_index[filename] = cache_key
+    Returns:
+        (AudioMatch, the matched lecture's cached segments), or (None, None)
+    """
     try:
-        with open(CACHE_INDEX_FILE, 'w') as f:
-            json.dump(cache_index, f, indent=2)
-    except Exception as e:
-        print(f"Error updating cache index: {e}")
+        match = get_fingerprint_index().find_match(audio_fingerprint)
+    except Exception:
+        logger.exception("Error searching the audio fingerprint index")
+        match = None
+    
+    cached_segments = None
+    if match:
+        transcript_data, _, _ = load_from_cache(match.cache_key)
+        cached_segments = transcript_data['segments'] if transcript_data else None
+    
+    if cached_segments is None:
+        record_cache_lookup('audio_fingerprint', misses=1)
+        return None, None
+    
+    logger.info("Audio matches cached lecture %s (offset %.2fs, %.0f%% covered, %d hashes)",
+                match.cache_key, match.offset, match.coverage * 100, match.votes)
+    record_cache_lookup('audio_fingerprint', hits=1)
+    return match, cached_segments
+
+
+def transcribe_upload(video_id, video_path, client_id):
+    """
+    Steps 1-2 of the pipeline: wait for a transcription slot, then
+    transcribe the video, reusing a cached transcript of the same audio.
+
+    Returns:
+        Tuple of (transcript data, audio fingerprint)
+    """
+    # Step 1: Wait for a transcription slot; shorter recordings go first
+    with stage('probe'):
+        duration = estimate_duration(video_path)
+    update_job(video_id, 'queued', duration=round(duration, 2))
+    with get_transcription_scheduler().slot(video_id, client_id, duration) as queue_wait:
+        TRANSCRIPTION_QUEUE_WAIT.observe(queue_wait)
+        update_job(video_id, 'processing', queue_wait_seconds=round(queue_wait, 2))
+        
+        # Step 2: Transcribe the video. If its audio matches a cached lecture
+        # (e.g. the same recording re-encoded or trimmed), reuse that
+        # transcript and only transcribe the parts that differ
+        with stage('fingerprint'):
+            audio = load_audio(video_path)
+            audio_fingerprint = fingerprint_audio(audio)
+            match, cached_segments = find_audio_match(audio_fingerprint)
+        with stage('transcribe'):
+            if match:
+                transcript_data = reuse_transcript(audio, cached_segments, match)
+            else:
+                transcript_data = transcribe_video(video_path, audio=audio)
+    return transcript_data, audio_fingerprint
 
 
-def cache_exists(filename):
-    """Check if cached data exists for a given filename."""
-    cache_key = get_cache_key(filename)
-    cache_dir = os.path.join(CACHE_FOLDER, cache_key)
+def process_video(video_id, video_path, original_filename, content_hash, client_id='anonymous', ingest=None):
+    """
+    Run the full pipeline for a video that is not cached yet:
+    transcribe with Whisper (reusing a cached transcript of the same audio),
+    generate chapters, generate summary, and cache the results.
+
+    The LLM steps run under a deadline of UPLOAD_DEADLINE_SECONDS that
+    starts once the transcript is ready, so a long wait for a slot or a
+    slow transcription on CPU does not leave them without time.
+
+    Transcription waits for a slot from the host-wide transcription queue,
+    where client_id is used for fairness between clients. If the video was
+    transcribed while it uploaded (ingest, see ingest.py), it already holds
+    its slot and only its last window is left to wait for; if ingest gave
+    up (e.g. its audio matches a cached lecture), the saved file goes
+    through the normal steps.
+
+    Returns:
+        Response data dict
+    """
+    transcript_data = None
+    if ingest is not None:
+        with stage('transcribe'):
+            transcript_data, audio_fingerprint = ingest.result()
+        if transcript_data is not None:
+            TRANSCRIPTION_QUEUE_WAIT.observe(ingest.queue_wait)
+    if transcript_data is None:
+        transcript_data, audio_fingerprint = transcribe_upload(video_id, video_path, client_id)
+    save_transcript(transcript_data, video_id, TRANSCRIPT_FOLDER)
+    logger.info("Transcribed %s: %d segments, %d chars",
+                video_id, len(transcript_data['segments']), len(transcript_data.get('full_text', '')))
+    logger.debug("Transcript preview: %s", transcript_data.get('full_text', '')[:200])
     
-    # Check if cache directory exists and contains all required files
-    required_files = [
-        'transcript_segments.json',
-        'transcript_text.txt',
-        'chapters.json',
-        'summary.txt'
-    ]
+    with deadline(UPLOAD_DEADLINE_SECONDS) as budget:
+        # Step 3: Generate chapters
+        with stage('chapterize'):
+            chapters = generate_chapters(transcript_data['segments'])
     
-    if not os.path.exists(cache_dir):
-        return False
+        # Step 4: Summarize each chapter in parallel, then combine them into the
+        # lecture summary; chapter summaries become the chapter descriptions
+        with stage('summarize'):
+            chapters, summary = summarize_lecture(transcript_data['segments'], chapters)
+        if budget.fallbacks and budget.remaining() <= 0:
+            logger.warning("Upload %s ran out of its %.0fs LLM budget; %s fell back to local results "
+                           "(see UPLOAD_DEADLINE_SECONDS)", video_id, UPLOAD_DEADLINE_SECONDS,
+                           ", ".join(budget.fallbacks))
+        chapters_path = os.path.join(CHAPTERS_FOLDER, f"{video_id}.json")
+        save_chapters_to_file(chapters, chapters_path)
     
-    for file in required_files:
-        if not os.path.exists(os.path.join(cache_dir, file)):
-            return False
+        # Save to cache
+        cache_key = get_cache_key(original_filename)
+        with stage('cache_save'):
+            cached = save_to_cache(original_filename, transcript_data, chapters, summary, content_hash)
+            try:
+                get_fingerprint_index().add(cache_key, audio_fingerprint)
+            except Exception:
+                logger.exception("Error indexing the audio fingerprint of %s", original_filename)
+        
+        # Step 5: Initialize chat session with the cached transcript and summary
+        with stage('chat_init'):
+            if cached:
+                start_chat_session(video_id, cache_key)
+            else:
+                # Nothing cached to refer to, so the session carries its context
+                start_chat_session(video_id, history=chat_context(transcript_data['full_text'], summary))
+        record_video(video_id, cache_key, original_filename)
+        logger.info("Processed %s (%s)", video_id, original_filename)
+    
+        # Chapters and transcript are cached; generate flashcards in the background
+        schedule_flashcards(video_id)
     
-    return True
+        return {
+            'video_id': video_id,
+            'filename': original_filename,
+            'transcript_url': f"/api/videos/{video_id}/transcript",
+            'stream_url': f"/api/videos/{video_id}/stream",
+            'segment_count': len(transcript_data['segments']),
+            'chapters': chapters,
+            'summary': summary,
+            'chat_ready': True,
+            'cached': False,
+            # Steps answered by local fallbacks because Gemini was slow or down
+            'degraded': budget.fallbacks
+        }
+
+
+def start_chat_session(video_id, cache_key=None, history=None):
+    """
+    Start the chat session of an upload, about the lecture cached under
+    cache_key, or with its own context history if the lecture is not cached.
+    """
+    # Sessions are started far less often than they are used; a good time
+    # to drop expired ones (and their turns)
+    state_store.cleanup()
+    session = {'cache_key': cache_key} if cache_key else history
+    state_store.set('chats', video_id, session, ttl=CHAT_SESSION_TTL_SECONDS)
 
 
-def save_to_cache(filename, transcript_data, chapters, summary):
-    """Save processed data to cache."""
-    cache_key = get_cache_key(filename)
-    cache_dir = os.path.join(CACHE_FOLDER, cache_key)
-    os.makedirs(cache_dir, exist_ok=True)
+@lru_cache(maxsize=16)
+def load_chat_context(cache_key, mtime_ns):
+    """
+    Transcript text and summary of a cached lecture, for chat context.
     
-    try:
-        # Save transcript segments
-        with open(os.path.join(cache_dir, 'transcript_segments.json'), 'w') as f:
-            json.dump(transcript_data['segments'], f, indent=2)
-        
-        # Save transcript text
-        with open(os.path.join(cache_dir, 'transcript_text.txt'), 'w', encoding='utf-8') as f:
-            f.write(transcript_data['full_text'])
-        
-        # Save chapters
-        with open(os.path.join(cache_dir, 'chapters.json'), 'w') as f:
-            json.dump(chapters, f, indent=2)
-        
-        # Save summary
-        with open(os.path.join(cache_dir, 'summary.txt'), 'w', encoding='utf-8') as f:
-            f.write(summary)
-        
-        # Update cache index
-        update_cache_index(filename, cache_key)
-        
-        print(f"Data cached successfully for {filename}")
-        return True
-    except Exception as e:
-        print(f"Error saving to cache: {e}")
-        return False
+    Memoized on the transcript's modification time, so every message of
+    every session about the lecture shares one copy.
+    """
+    cache_dir = get_cache_dir(cache_key)
+    with open(os.path.join(cache_dir, 'transcript_text.txt'), 'r', encoding='utf-8') as f:
+        transcript_text = f.read()
+    with open(os.path.join(cache_dir, 'summary.txt'), 'r', encoding='utf-8') as f:
+        summary = f.read()
+    return transcript_text, summary
 
 
-def load_from_cache(filename):
-    """Load cached data for a given filename."""
-    cache_key = get_cache_key(filename)
-    cache_dir = os.path.join(CACHE_FOLDER, cache_key)
+def load_chat_history(video_id):
+    """
+    A chat session's serialized history: the lecture's context turns
+    followed by the session's own turns.
     
-    try:
-        # Load transcript segments
-        with open(os.path.join(cache_dir, 'transcript_segments.json'), 'r') as f:
-            segments = json.load(f)
-        
-        # Load transcript text
-        with open(os.path.join(cache_dir, 'transcript_text.txt'), 'r', encoding='utf-8') as f:
-            full_text = f.read()
-        
-        # Load chapters
-        with open(os.path.join(cache_dir, 'chapters.json'), 'r') as f:
-            chapters = json.load(f)
-        
-        # Load summary
-        with open(os.path.join(cache_dir, 'summary.txt'), 'r', encoding='utf-8') as f:
-            summary = f.read()
-        
-        transcript_data = {
-            'segments': segments,
-            'full_text': full_text
-        }
-        
-        print(f"Data loaded from cache for {filename}")
-        return transcript_data, chapters, summary
-    except Exception as e:
-        print(f"Error loading from cache: {e}")
-        return None, None, None
+    Returns:
+        The history, or None if the session does not exist or has expired
+    """
+    session = state_store.get('chats', video_id)
+    if session is None:
+        return None
+    if isinstance(session, list):
+        # The session carries its own context: its lecture could not be
+        # cached, or it was stored before sessions referred to lectures
+        history = session
+    else:
+        try:
+            transcript_path = os.path.join(get_cache_dir(session['cache_key']), 'transcript_text.txt')
+            history = chat_context(*load_chat_context(session['cache_key'], os.stat(transcript_path).st_mtime_ns))
+        except OSError:
+            logger.warning("Cached lecture %s of chat session %s is gone", session['cache_key'], video_id)
+            return None
+    return history + state_store.get_list('chat_turns', video_id)
+
+
+def append_chat_turns(video_id, turns):
+    """Add turns to a chat session and keep it alive for another CHAT_SESSION_TTL_SECONDS."""
+    state_store.append('chat_turns', video_id, turns, ttl=CHAT_SESSION_TTL_SECONDS)
+    session = state_store.get('chats', video_id)
+    if session is not None:
+        state_store.set('chats', video_id, session, ttl=CHAT_SESSION_TTL_SECONDS)
+
+
+def update_job(job_id, status, **fields):
+    """Record the status of an upload job in the shared state store."""
+    job = state_store.get('jobs', job_id, {})
+    job.update(fields)
+    job['status'] = status
+    job['updated_at'] = time.time()
+    state_store.set('jobs', job_id, job)
 
 
 @app.route('/', methods=['GET'])
@@ -169,13 +394,34 @@ def index():
 def upload_video():
     """
     Upload a video and process it through the full pipeline:
-    - Check cache for existing data
+    - Check cache for existing data (by filename, then by content hash)
     - If cached: load cached data and initialize new chat session
-    - If not cached: transcribe with Whisper, generate chapters, generate summary
+    - If the same content is already being processed: wait for it and reuse its result
+    - If not cached: transcribe with Whisper, generate chapters, summarize each chapter and the lecture
     - Initialize chat session
     
-    Returns all results in a single response.
+    Returns the video ID, chapters and summary. The transcript itself is
+    fetched separately, page by page, from /api/videos/<video_id>/transcript,
+    and the video is played back from /api/videos/<video_id>/stream.
     """
+    # Generate unique video ID (also used as the job ID)
+    video_id = str(uuid.uuid4())
+    video_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{video_id}.mp4")
+    
+    if PIPELINED_INGEST:
+        client_id = get_client_id()
+        
+        content_length = request.content_length
+        
+        def start_ingest(filename):
+            # Start transcribing while the rest of the video arrives, unless
+            # it is the wrong type or already cached under this filename
+            if allowed_file(filename) and not find_cache_key(filename):
+                return PipelinedIngest(video_path, video_id, client_id, content_length,
+                                       on_status=lambda status, **fields: update_job(video_id, status, **fields))
+            return None
+        request.ingest_factory = start_ingest
+    
     # Check if the post request has the file part
     if 'video' not in request.files:
         return jsonify({'error': 'No video file provided'}), 400
@@ -189,109 +435,223 @@ def upload_video():
     if not allowed_file(file.filename):
         return jsonify({'error': 'Invalid file type. Allowed types: mp4, mov, avi, mkv'}), 400
     
+    ingest = file.stream if isinstance(file.stream, PipelinedIngest) else None
+    
+    UPLOADS_IN_PROGRESS.inc()
     try:
-        # Generate unique video ID
-        video_id = str(uuid.uuid4())
         original_filename = file.filename
         
-        # Save the uploaded video
-        filename = f"{video_id}.mp4"
-        video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(video_path)
-        
-        print(f"Video saved to {video_path}")
-        print(f"Original filename: {original_filename}")
-        
-        # Check if cached data exists for this filename
-        if cache_exists(original_filename):
-            print(f"Cache hit! Loading cached data for {original_filename}")
-            
-            # Load from cache
-            transcript_data, chapters, summary = load_from_cache(original_filename)
-            
-            if transcript_data and chapters and summary:
-                print("Successfully loaded from cache")
-                
-                # Initialize new chat session with cached transcript
-                print("Initializing chat session with cached transcript...")
-                chat_session = initialize_chat(transcript_data['full_text'])
-                # Note: We don't call generate_summary() since we already have the cached summary
-                
-                # Store chat session in memory
-                chat_sessions[video_id] = chat_session
-                print("Chat session initialized!")
-                
-                # Return all results
-                response_data = {
-                    'video_id': video_id,
-                    'filename': original_filename,
-                    'transcript': {
-                        'segments': transcript_data['segments'],
-                        'full_text': transcript_data['full_text']
-                    },
-                    'chapters': chapters,
-                    'summary': summary,
-                    'chat_ready': True,
-                    'cached': True
-                }
-                
-                return jsonify(response_data), 200
-            else:
-                print("Failed to load from cache, processing normally")
-        
-        # Cache miss - process normally
-        print(f"Cache miss! Processing video {original_filename}")
+        if ingest is not None:
+            # Already written to video_path and hashed while it arrived
+            content_hash = ingest.finish_upload()
+        else:
+            # Save the uploaded video
+            with stage('upload_save'):
+                file.save(video_path)
+            with stage('hash'):
+                content_hash = get_content_hash(video_path)
         
-        # Step 1: Transcribe the video
-        print("Starting transcription...")
-        transcript_data = transcribe_video(video_path)
-        print(f"Transcription result keys: {transcript_data.keys()}")
-        print(f"Full text length: {len(transcript_data.get('full_text', ''))}")
-        print(f"Full text preview (first 200 chars): {transcript_data.get('full_text', '')[:200]}")
-        save_transcript(transcript_data, video_id, TRANSCRIPT_FOLDER)
-        print("Transcription complete!")
+        logger.info("Video %s saved to %s (original filename: %s)", video_id, video_path, original_filename)
         
-        # Step 2: Generate chapters
-        print("Generating chapters...")
-        chapters = generate_chapters(transcript_data['segments'])
-        chapters_path = os.path.join(CHAPTERS_FOLDER, f"{video_id}.json")
-        save_chapters_to_file(chapters, chapters_path)
-        print("Chapters generated!")
-        
-        # Step 3: Initialize chat session and generate summary
-        print("Initializing chat session and generating summary...")
-        chat_session = initialize_chat(transcript_data['full_text'])
-        summary = generate_summary(chat_session)
-        
-        # Store chat session in memory
-        chat_sessions[video_id] = chat_session
-        print("Chat session initialized!")
+        return process_upload(video_id, video_path, original_filename, content_hash, ingest)
+    except Exception as e:
+        logger.exception("Error saving video %s", video_id)
+        update_job(video_id, 'failed', error=str(e))
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if ingest is not None:
+            ingest.abort()
+        UPLOADS_IN_PROGRESS.dec()
+
+
+def process_upload(video_id, video_path, original_filename, content_hash, ingest=None):
+    """
+    Answer a saved upload from the cache, from a concurrent upload of the
+    same content, or by running the pipeline, recording the job's status.
+
+    ingest is the upload's PipelinedIngest if it was transcribed while it
+    arrived.
+
+    Returns:
+        Flask (response, status) tuple
+    """
+    try:
+        # An upload transcribed while it arrived may still be queued for its slot
+        update_job(video_id, ingest.status if ingest is not None else 'processing',
+                   filename=original_filename, content_hash=content_hash)
         
-        # Save to cache
-        print(f"Saving processed data to cache for {original_filename}...")
-        save_to_cache(original_filename, transcript_data, chapters, summary)
+        # Check if cached data exists for this filename or content
+        cache_key = find_cache_key(original_filename, content_hash)
+        record_cache_lookup('video', hits=int(bool(cache_key)), misses=int(not cache_key))
+        if cache_key:
+            logger.info("Cache hit, loading cached data for %s", original_filename)
+            response_data = respond_from_cache(video_id, original_filename, cache_key)
+            if response_data:
+                update_job(video_id, 'complete', cached=True)
+                return jsonify(response_data), 200
         
-        # Return all results
-        response_data = {
-            'video_id': video_id,
-            'filename': original_filename,
-            'transcript': {
-                'segments': transcript_data['segments'],
-                'full_text': transcript_data['full_text']
-            },
-            'chapters': chapters,
-            'summary': summary,
-            'chat_ready': True,
-            'cached': False
-        }
+        # Only one worker processes a given video at a time; concurrent
+        # uploads of the same content wait here (no longer transcribing
+        # while they wait) and then reuse its cache
+        on_wait = (lambda leader_id: ingest.abort()) if ingest is not None else None
+        with single_flight(content_hash, video_id, INFLIGHT_FOLDER, on_wait) as leader_id:
+            # Check again under the lock: a leader may have finished between
+            # the lookup above and taking the lock, without this upload waiting
+            cache_key = find_cache_key(original_filename, content_hash)
+            if cache_key:
+                logger.info("Another job cached %s while this one waited, loading its cached data", original_filename)
+                response_data = respond_from_cache(video_id, original_filename, cache_key)
+                if response_data:
+                    if leader_id:
+                        response_data['deduplicated_from'] = leader_id
+                        update_job(video_id, 'complete', cached=True, deduplicated_from=leader_id)
+                    else:
+                        update_job(video_id, 'complete', cached=True)
+                    return jsonify(response_data), 200
+            
+            # Cache miss - process normally
+            logger.info("Cache miss, processing video %s", original_filename)
+            response_data = process_video(video_id, video_path, original_filename, content_hash, get_client_id(), ingest)
         
+        update_job(video_id, 'complete', cached=False)
         return jsonify(response_data), 200
         
     except Exception as e:
-        print(f"Error processing video: {e}")
+        logger.exception("Error processing video %s", video_id)
+        update_job(video_id, 'failed', error=str(e))
         return jsonify({'error': str(e)}), 500
 
 
+def upload_error(e):
+    """Response for a rejected resumable upload request."""
+    return jsonify({'error': str(e)}), e.status
+
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """
+    Start a resumable upload, for large videos or unreliable connections.
+    
+    Body: JSON {"filename": ..., "size": <bytes>, "part_size": <bytes, optional>}
+    
+    The client then PUTs each part (in any order, in parallel) to
+    /api/uploads/<upload_id>/parts/<n>, checks progress with GET
+    /api/uploads/<upload_id> after an interruption, and POSTs
+    /api/uploads/<upload_id>/complete to assemble the video and process it
+    as /api/upload would.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or ''
+    if not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type. Allowed types: mp4, mov, avi, mkv'}), 400
+    try:
+        size = int(data.get('size', 0))
+        part_size = int(data['part_size']) if data.get('part_size') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size and part_size must be integers'}), 400
+    
+    try:
+        session = resumable.create_session(filename, size, part_size)
+    except resumable.UploadSessionError as e:
+        return upload_error(e)
+    return jsonify(session), 201
+
+
+@app.route('/api/uploads/<upload_id>/parts/<int:part>', methods=['PUT'])
+def upload_part(upload_id, part):
+    """
+    Receive one part of a resumable upload as the raw request body, with its
+    hex SHA-256 in the X-Part-SHA256 header. Resending a part replaces it.
+    """
+    try:
+        session = resumable.load_session(upload_id)
+        with stage('upload_part'):
+            stored = resumable.write_part(session, part, request.stream, request.headers.get('X-Part-SHA256'))
+    except resumable.UploadSessionError as e:
+        return upload_error(e)
+    return jsonify(stored), 200
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Progress of a resumable upload: received byte ranges and missing parts."""
+    try:
+        return jsonify(resumable.session_status(resumable.load_session(upload_id))), 200
+    except resumable.UploadSessionError as e:
+        return upload_error(e)
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    """Abort a resumable upload and delete its parts."""
+    try:
+        resumable.delete_session(upload_id)
+    except resumable.UploadSessionError as e:
+        return upload_error(e)
+    return '', 204
+
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """
+    Assemble a resumable upload once all its parts are in and process the
+    video. An optional JSON {"sha256": ...} verifies the whole file.
+    
+    Returns the same response as /api/upload.
+    """
+    data = request.get_json(silent=True) or {}
+    video_id = str(uuid.uuid4())
+    
+    UPLOADS_IN_PROGRESS.inc()
+    try:
+        session = resumable.load_session(upload_id)
+        video_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{video_id}.mp4")
+        # Hashing happens while the parts are joined, so the file is read once
+        with stage('upload_assemble'):
+            content_hash = resumable.assemble(session, video_path, data.get('sha256'))
+        logger.info("Video %s assembled from upload %s to %s (original filename: %s)",
+                    video_id, upload_id, video_path, session['filename'])
+        return process_upload(video_id, video_path, session['filename'], content_hash)
+    except resumable.UploadSessionError as e:
+        return upload_error(e)
+    except OSError as e:
+        # e.g. the disk filled up; the session is kept, so completing can be retried
+        logger.exception("Error assembling upload %s", upload_id)
+        return jsonify({'error': f'Could not assemble the upload: {e}'}), 500
+    finally:
+        UPLOADS_IN_PROGRESS.dec()
+
+
+def parse_chat_request():
+    """
+    Validate a chat request body.
+    
+    Returns:
+        (video_id, message, history, None) on success, or
+        (None, None, None, error_response) if the request is invalid
+    """
+    data = request.get_json()
+    
+    if not data:
+        return None, None, None, (jsonify({'error': 'No JSON data provided'}), 400)
+    
+    video_id = data.get('video_id')
+    message = data.get('message')
+    
+    if not video_id:
+        return None, None, None, (jsonify({'error': 'video_id is required'}), 400)
+    
+    if not message:
+        return None, None, None, (jsonify({'error': 'message is required'}), 400)
+    
+    # Check if chat session exists
+    history = load_chat_history(video_id)
+    if history is None:
+        return None, None, None, (jsonify({'error': 'Chat session not found. Please upload the video first.'}), 404)
+    
+    return video_id, message, history, None
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """
@@ -303,50 +663,355 @@ def chat():
         "message": "What was the main point?"
     }
     
-    Returns the AI response.
+    Returns the AI response. "cached" is true when it came from the
+    lecture's answer cache (see answer_cache.py) instead of Gemini.
     """
     try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'error': 'No JSON data provided'}), 400
-        
-        video_id = data.get('video_id')
-        message = data.get('message')
+        video_id, message, history, error = parse_chat_request()
+        if error:
+            return error
         
-        if not video_id:
-            return jsonify({'error': 'video_id is required'}), 400
+        # Questions other students already asked about this lecture are
+        # answered from the answer cache without a Gemini call
+        lecture_key = get_video_cache_key(video_id)
+        cached = answer_cache.lookup(lecture_key, message, history) if lecture_key else None
+        if cached is not None:
+            append_chat_turns(video_id, chat_turns(message, cached))
+            return jsonify({
+                'video_id': video_id,
+                'response': cached,
+                'cached': True
+            }), 200
         
-        if not message:
-            return jsonify({'error': 'message is required'}), 400
-        
-        # Check if chat session exists
-        if video_id not in chat_sessions:
-            return jsonify({'error': 'Chat session not found. Please upload the video first.'}), 404
-        
-        # Get chat session and send message
-        chat_session = chat_sessions[video_id]
+        # Rebuild chat session, send message, and persist the new turns
+        chat_session = restore_chat(history)
         response = send_chat_message(chat_session, message)
+        # The history only grows when Gemini answered (errors come back as text)
+        if len(chat_session.history) > len(history):
+            if lecture_key:
+                answer_cache.store(lecture_key, message, history, response)
+            append_chat_turns(video_id, serialize_history(chat_session)[len(history):])
         
         return jsonify({
             'video_id': video_id,
-            'response': response
+            'response': response,
+            'cached': False
         }), 200
         
     except Exception as e:
-        print(f"Error in chat: {e}")
+        logger.exception("Error in chat")
         return jsonify({'error': str(e)}), 500
 
 
+def chat_turns(message, answer):
+    """A question and its answer as serialized chat history entries."""
+    return [
+        {'role': 'user', 'parts': [message]},
+        {'role': 'model', 'parts': [answer]}
+    ]
+
+
+def sse_event(data, event=None):
+    """Format a server-sent event with a JSON payload."""
+    prefix = f"event: {event}\n" if event else ""
+    return prefix + f"data: {json.dumps(data)}\n\n"
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Send a chat message and stream the AI response as server-sent events.
+    
+    Request body is the same as /api/chat.
+    
+    Events:
+        data: {"token": "..."}                  one per chunk of generated text
+        event: done   data: {"response": "..."} the complete response
+        event: error  data: {"error": "..."}    generation failed part-way
+    
+    The complete response is appended to the session history once the
+    stream finishes.
+    """
+    start = time.perf_counter()
+    
+    try:
+        video_id, message, history, error = parse_chat_request()
+        if error:
+            return error
+    except Exception as e:
+        logger.exception("Error in chat")
+        return jsonify({'error': str(e)}), 500
+    
+    lecture_key = get_video_cache_key(video_id)
+    cached = answer_cache.lookup(lecture_key, message, history) if lecture_key else None
+    
+    def generate_cached():
+        append_chat_turns(video_id, chat_turns(message, cached))
+        CHAT_TTFT.observe(time.perf_counter() - start)
+        yield sse_event({'token': cached})
+        CHAT_STREAM_DURATION.observe(time.perf_counter() - start)
+        yield sse_event({'video_id': video_id, 'response': cached, 'cached': True}, event='done')
+    
+    def generate():
+        chat_session = restore_chat(history)
+        tokens = []
+        try:
+            for token in stream_chat_message(chat_session, message):
+                if not tokens:
+                    CHAT_TTFT.observe(time.perf_counter() - start)
+                tokens.append(token)
+                yield sse_event({'token': token})
+        except Exception as e:
+            logger.exception("Error in chat stream for %s", video_id)
+            CHAT_STREAM_ERRORS.inc()
+            yield sse_event({'error': str(e)}, event='error')
+            return
+        
+        if lecture_key:
+            answer_cache.store(lecture_key, message, history, ''.join(tokens))
+        append_chat_turns(video_id, serialize_history(chat_session)[len(history):])
+        CHAT_STREAM_DURATION.observe(time.perf_counter() - start)
+        yield sse_event({'video_id': video_id, 'response': ''.join(tokens), 'cached': False}, event='done')
+    
+    return Response(
+        stream_with_context(generate_cached() if cached is not None else generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # Stop reverse proxies (nginx) from buffering the stream
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Expose this worker's metrics in Prometheus text format."""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@lru_cache(maxsize=32)
+def load_cached_segments(segments_path, mtime_ns):
+    """
+    Load transcript segments from a cache file.
+    
+    Memoized on the file's modification time, so repeated page requests for
+    the same lecture don't re-parse the JSON.
+    """
+    with open(segments_path, 'r') as f:
+        return json.load(f)
+
+
+def accepted_encoding():
+    """The compression compress_response() would use for this request: 'br', 'gzip' or None."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """Compress a response body with brotli or gzip, as accepted by the client."""
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+    
+    encoding = accepted_encoding()
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    
+    return response
+
+
+@app.route('/api/videos/<video_id>/transcript', methods=['GET'])
+def get_transcript(video_id):
+    """
+    Get a page of a video's transcript segments.
+    
+    Query parameters:
+        start: Only include segments ending after this time (seconds)
+        end: Only include segments starting before this time (seconds)
+        page: Page number, starting at 1 (default 1)
+        page_size: Segments per page (default 200, max 1000)
+    
+    Responses carry an ETag; clients can revalidate with If-None-Match and
+    get a 304 when the transcript hasn't changed. Bodies are compressed with
+    brotli or gzip according to Accept-Encoding, and each encoding gets its
+    own ETag ("<hash>-br", "<hash>-gzip", or "<hash>" uncompressed).
+    """
+    video = state_store.get('videos', video_id)
+    if video is None:
+        return jsonify({'error': 'Video not found'}), 404
+    
+    try:
+        start = request.args.get('start', type=float)
+        end = request.args.get('end', type=float)
+        page = max(request.args.get('page', 1, type=int), 1)
+        page_size = request.args.get('page_size', DEFAULT_TRANSCRIPT_PAGE_SIZE, type=int)
+        page_size = min(max(page_size, 1), MAX_TRANSCRIPT_PAGE_SIZE)
+        
+        segments_path = os.path.join(CACHE_FOLDER, video['cache_key'], 'transcript_segments.json')
+        if not os.path.exists(segments_path):
+            return jsonify({'error': 'Transcript not available'}), 404
+        
+        # The ETag only depends on the cached file's version and the query,
+        # so a revalidation is answered without loading the transcript
+        stat = os.stat(segments_path)
+        etag_source = f"{video['cache_key']}:{stat.st_mtime_ns}:{stat.st_size}:{start}:{end}:{page}:{page_size}"
+        etag = hashlib.md5(etag_source.encode()).hexdigest()
+        # Small bodies go out uncompressed whatever the client accepts, so
+        # its cached copy may carry either tag
+        encoding = accepted_encoding()
+        candidates = [f"{etag}-{encoding}", etag] if encoding else [etag]
+        cached_etag = next((tag for tag in candidates if request.if_none_match.contains(tag)), None)
+        
+        if cached_etag is not None:
+            response = Response(status=304)
+            response.set_etag(cached_etag)
+        else:
+            segments = load_cached_segments(segments_path, stat.st_mtime_ns)
+            
+            if start is not None:
+                segments = [s for s in segments if s['end'] > start]
+            if end is not None:
+                segments = [s for s in segments if s['start'] < end]
+            
+            total_segments = len(segments)
+            offset = (page - 1) * page_size
+            
+            response = jsonify({
+                'video_id': video_id,
+                'segments': segments[offset:offset + page_size],
+                'page': page,
+                'page_size': page_size,
+                'total_segments': total_segments,
+                'total_pages': (total_segments + page_size - 1) // page_size
+            })
+            response = compress_response(response)
+            content_encoding = response.headers.get('Content-Encoding')
+            response.set_etag(f"{etag}-{content_encoding}" if content_encoding else etag)
+        
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+        
+    except Exception as e:
+        logger.exception("Error loading transcript for %s", video_id)
+        return jsonify({'error': str(e)}), 500
+
+
+def read_range(f, length):
+    """Yield length bytes of an open file from its current position, then close it."""
+    with f:
+        while length > 0:
+            chunk = f.read(min(VIDEO_BUFFER_BYTES, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@app.route('/api/videos/<video_id>/stream', methods=['GET'])
+def stream_video(video_id):
+    """
+    Serve an uploaded video for playback, with HTTP Range requests so the
+    player can seek to any chapter.
+    
+    A video_id's file never changes, so responses carry an ETag and
+    Last-Modified and may be cached for a year; If-None-Match and
+    If-Modified-Since get a 304 and If-Range is honoured. The file is handed
+    to the server's wsgi.file_wrapper positioned at the start of the range,
+    so gunicorn sends it with sendfile() instead of copying it through
+    Python.
+    """
+    video = state_store.get('videos', video_id)
+    video_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{video_id}.mp4")
+    if video is None or not os.path.exists(video_path):
+        return jsonify({'error': 'Video not found'}), 404
+    
+    stat = os.stat(video_path)
+    size = stat.st_size
+    etag = f"{video_id}-{stat.st_mtime_ns:x}-{size:x}"
+    last_modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+    extension = video['filename'].rsplit('.', 1)[-1].lower()
+    
+    response = Response(mimetype=VIDEO_MIMETYPES.get(extension, 'video/mp4'))
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = f'private, max-age={VIDEO_MAX_AGE_SECONDS}, immutable'
+    response.accept_ranges = 'bytes'
+    
+    if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+        response.status_code = 304
+        return response
+    
+    # A Range is only applied if If-Range (when sent) still matches; several
+    # ranges at once are not supported, so those get the whole file
+    start, end = 0, size
+    byte_range = request.range
+    if_range_matches = 'HTTP_IF_RANGE' not in request.environ or not is_resource_modified(
+        request.environ, etag, last_modified=last_modified, ignore_if_range=False)
+    if byte_range is not None and len(byte_range.ranges) == 1 and if_range_matches:
+        requested = byte_range.range_for_length(size)
+        if requested is None:
+            response.status_code = 416
+            response.content_range = ContentRange('bytes', None, None, size)
+            return response
+        start, end = requested
+        response.status_code = 206
+        response.content_range = ContentRange('bytes', start, end, size)
+    
+    response.content_length = end - start
+    if request.method == 'HEAD':
+        # Werkzeug discards a HEAD response's body without closing it, so
+        # don't open the file at all
+        return response
+    
+    f = open(video_path, 'rb')
+    f.seek(start)
+    # Servers implementing wsgi.file_wrapper with sendfile (gunicorn) send
+    # Content-Length bytes from the file's current position
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    response.response = file_wrapper(f, VIDEO_BUFFER_BYTES) if file_wrapper else read_range(f, end - start)
+    response.direct_passthrough = True
+    return response
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Get the status of an upload job (job IDs are the upload's video_id).
+
+    Queued jobs also report their place in the transcription queue and how
+    long they have waited; started jobs keep their final queue_wait_seconds.
+    """
+    job = state_store.get('jobs', job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job['status'] == 'queued':
+        job['queue_position'] = get_transcription_scheduler().position(job_id)
+        job['queue_wait_seconds'] = round(time.time() - job['updated_at'], 2)
+    
+    return jsonify({'job_id': job_id, **job}), 200
+
+
 @app.route('/api/health', methods=['GET'])
 def health():
     """Health check endpoint."""
     return jsonify({
         'status': 'healthy',
-        'active_sessions': len(chat_sessions)
+        'active_sessions': state_store.count('chats')
     }), 200
 
 
 if __name__ == '__main__':
-    # Run the Flask app
+    # Run the Flask development server (single process).
+    # For production, run multiple workers with: gunicorn -c gunicorn.conf.py wsgi:app
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,36 @@
+"""
+The backend app with Whisper and Gemini replaced by the fakes in
+benchmarks/fakes.py, for load tests.
+
+Latencies come from environment variables so every server worker (including
+gunicorn's) configures itself the same way:
+    FAKE_LLM_LATENCY         seconds per Gemini call (default 0.5)
+    FAKE_TOKEN_LATENCY       seconds between streamed chat chunks (default 0.02)
+    FAKE_TRANSCRIBE_LATENCY  seconds per transcription (default 2)
+    FAKE_SEGMENT_COUNT       segments per transcript (default 1000)
+
+Usage (from a scratch working directory, with the backend on PYTHONPATH):
+    python -m benchmarks.fake_server --port 5001
+    gunicorn -c <backend>/gunicorn.conf.py benchmarks.fake_server:app
+"""
+import argparse
+import os
+
+from benchmarks import fakes
+
+fakes.install(
+    llm_latency=float(os.getenv('FAKE_LLM_LATENCY', '0.5')),
+    token_latency=float(os.getenv('FAKE_TOKEN_LATENCY', '0.02')),
+    transcribe_latency=float(os.getenv('FAKE_TRANSCRIBE_LATENCY', '2')),
+    segment_count=int(os.getenv('FAKE_SEGMENT_COUNT', '1000'))
+)
+
+from app import app  # noqa: E402  (must be imported after the fakes are installed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,333 @@
+"""
+Deterministic stand-ins for Whisper and Gemini, and synthetic transcripts.
+
+The fakes implement just the calls the backend makes (see services.py), with
+configurable latencies, so the full pipeline can be benchmarked offline and
+its results compared run to run. Responses depend only on their input.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+
+import services
+
+# Topic vocabularies for synthetic lectures; consecutive topics share no words
+# so semantic chunking has real boundaries to find
+TOPICS = [
+    "gradient descent loss function learning rate optimizer convergence step weights",
+    "binary search tree node insertion deletion balance rotation height",
+    "hash table bucket collision probing load factor resize key",
+    "graph vertex edge traversal breadth depth queue stack visited",
+    "dynamic programming subproblem memoization table recurrence optimal overlap",
+    "operating system process thread scheduler context switch kernel",
+    "network packet protocol router latency bandwidth handshake socket",
+    "database index query transaction isolation commit rollback join",
+]
+FILLER = "so we see that this is the idea and now let us look at how it works in practice"
+
+
+def synthetic_segments(n: int, seed: int = 0, segment_seconds: float = 3.0,
+                       segments_per_topic: int = 200) -> List[Dict[str, Any]]:
+    """
+    Generate a Whisper-style transcript of n segments.
+
+    Args:
+        n: Number of segments
+        seed: Random seed; the same seed gives the same transcript
+        segment_seconds: Average segment length
+        segments_per_topic: Segments before the lecture moves to the next topic
+
+    Returns:
+        Segments with id, start, end and text
+    """
+    rng = random.Random(seed)
+    filler = FILLER.split()
+    segments = []
+    t = 0.0
+    for i in range(n):
+        topic = TOPICS[(i // segments_per_topic + seed) % len(TOPICS)].split()
+        words = rng.choices(topic, k=rng.randint(4, 8)) + rng.choices(filler, k=rng.randint(4, 8))
+        rng.shuffle(words)
+        duration = round(segment_seconds * rng.uniform(0.5, 1.5), 2)
+        segments.append({"id": i, "start": round(t, 2), "end": round(t + duration, 2), "text": " ".join(words) + "."})
+        t += duration
+    return segments
+
+
+def synthetic_audio(seconds: float, seed: int = 0, sample_rate: int = 16000) -> np.ndarray:
+    """
+    Generate speech-like 16 kHz audio: short bursts of a few random tones,
+    so audio fingerprints have peaks to find.
+    """
+    rng = np.random.default_rng(seed)
+    burst = int(0.2 * sample_rate)
+    t = np.arange(burst) / sample_rate
+    envelope = np.hanning(burst)
+    audio = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+    for start in range(0, len(audio) - burst + 1, burst):
+        freqs = rng.uniform(150, 3500, 3)
+        amps = rng.uniform(0.1, 1.0, 3)
+        audio[start:start + burst] = envelope * sum(a * np.sin(2 * np.pi * f * t) for a, f in zip(amps, freqs))
+    return audio
+
+
+class _Part:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Content:
+    def __init__(self, role: str, parts: List[Any]):
+        self.role = role
+        self.parts = [p if isinstance(p, _Part) else _Part(p) for p in parts]
+
+
+class _Usage:
+    def __init__(self, prompt: str, output: str):
+        self.prompt_token_count = len(prompt) // 4
+        self.candidates_token_count = len(output) // 4
+
+
+class _Response:
+    def __init__(self, prompt: str, text: str):
+        self.text = text
+        self.usage_metadata = _Usage(prompt, text)
+
+
+class _StreamResponse:
+    """Streaming response; iterating yields chunks, as in the SDK."""
+
+    def __init__(self, prompt: str, chunks: List[str], token_latency: float, on_done):
+        self._chunks = chunks
+        self._token_latency = token_latency
+        self._on_done = on_done
+        self.usage_metadata = _Usage(prompt, "".join(chunks))
+
+    def __iter__(self) -> Iterator[_Part]:
+        for chunk in self._chunks:
+            time.sleep(self._token_latency)
+            yield _Part(chunk)
+        self._on_done("".join(self._chunks))
+
+
+class FakeChatSession:
+    def __init__(self, model: "FakeModel", history: Optional[List[Dict[str, Any]]] = None):
+        self.model = model
+        self.history = [_Content(h["role"], h["parts"]) for h in history or []]
+
+    def send_message(self, message: str, stream: bool = False, request_options: Optional[Dict[str, Any]] = None):
+        time.sleep(self.model.genai.latency)
+        answer = self.model.genai.chat_answer(message)
+
+        def record(text):
+            self.history.append(_Content("user", [message]))
+            self.history.append(_Content("model", [text]))
+
+        if stream:
+            words = answer.split(" ")
+            chunks = [" ".join(words[i:i + 4]) + " " for i in range(0, len(words), 4)]
+            return _StreamResponse(message, chunks, self.model.genai.token_latency, record)
+
+        record(answer)
+        return _Response(message, answer)
+
+
+class FakeModel:
+    def __init__(self, genai: "FakeGenai", model_name: str):
+        self.genai = genai
+        self.model_name = model_name
+
+    def generate_content(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None,
+                         request_options: Optional[Dict[str, Any]] = None) -> _Response:
+        time.sleep(self.genai.latency)
+        schema = (generation_config or {}).get("response_schema")
+        if schema is not None:
+            return _Response(prompt, json.dumps(self.genai.chapters(prompt, schema)))
+        return _Response(prompt, self.genai.summary(prompt))
+
+    def start_chat(self, history: Optional[List[Dict[str, Any]]] = None) -> FakeChatSession:
+        return FakeChatSession(self, history)
+
+
+class FakeGenai:
+    """
+    Stand-in for the google.generativeai module.
+
+    Args:
+        latency: Seconds each generate_content/send_message call takes
+        token_latency: Seconds between streamed chunks
+        answer_words: Length of chat answers
+    """
+
+    def __init__(self, latency: float = 0.0, token_latency: float = 0.0, answer_words: int = 60):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.answer_words = answer_words
+
+    def configure(self, **kwargs) -> None:
+        pass
+
+    def GenerativeModel(self, model_name: str) -> FakeModel:
+        return FakeModel(self, model_name)
+
+    def chapters(self, prompt: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+        """Evenly spaced chapters over the transcript lines in a chapter prompt."""
+        labels = re.findall(r"^\s*\[(\d+(?:\.\d+)?)(?:-(\d+(?:\.\d+)?))?\]", prompt, re.M)
+        limit = re.search(r"DO NOT exceed (\d+) chapters", prompt)
+        max_chapters = int(limit.group(1)) if limit else 12
+        if not labels:
+            return {"chapters": []}
+
+        by_block = "start_block" in schema["properties"]["chapters"]["items"]["properties"]
+        count = max(1, min(max_chapters, len(labels) // 10 or 1))
+        step = len(labels) / count
+        chapters = []
+        for c in range(count):
+            first = labels[int(c * step)]
+            last = labels[max(int((c + 1) * step) - 1, int(c * step))]
+            if by_block:
+                chapters.append({"chapter_name": f"Part {c + 1}", "start_block": int(first[0]), "end_block": int(last[0])})
+            else:
+                chapters.append({"chapter_name": f"Part {c + 1}", "start_time": float(first[0]),
+                                 "end_time": float(last[1] or last[0])})
+        return {"chapters": chapters}
+
+    def summary(self, prompt: str) -> str:
+        words = re.findall(r"[a-z]+", prompt.lower()[-2000:])
+        return "This part covers " + " ".join(words[:25]) + "."
+
+    def chat_answer(self, message: str) -> str:
+        rng = random.Random(zlib.crc32(message.encode()))
+        return " ".join(rng.choices(FILLER.split(), k=self.answer_words))
+
+
+class FakeWhisperModel:
+    def __init__(self, whisper: "FakeWhisper"):
+        self.whisper = whisper
+
+    def transcribe(self, audio: Union[str, np.ndarray], verbose: bool = False) -> Dict[str, Any]:
+        if isinstance(audio, str):
+            seed = self.whisper.seed(audio)
+            count = self.whisper.segment_count
+        else:
+            # Clips of the decoded audio get proportionally fewer segments
+            seed = zlib.crc32(audio[:16000].tobytes())
+            count = max(1, round(self.whisper.segment_count * len(audio) / (self.whisper.audio_seconds * 16000)))
+            if self.whisper.speed:
+                time.sleep(len(audio) / 16000 / self.whisper.speed)
+        time.sleep(self.whisper.latency)
+        segments = synthetic_segments(count, seed=seed)
+        return {"segments": segments, "text": " ".join(s["text"] for s in segments)}
+
+
+class FakeWhisper:
+    """
+    Stand-in for the whisper module. Each file gets synthetic audio and a
+    synthetic transcript seeded from its content.
+
+    Args:
+        latency: Seconds each transcription takes
+        segment_count: Segments per audio_seconds of audio
+        audio_seconds: Length of each file's decoded audio
+        bytes_per_second: If set, files decode to one second of audio per
+            this many bytes instead of audio_seconds
+        speed: If set, decoded audio additionally takes 1 / speed seconds
+            per second of audio to transcribe
+    """
+
+    def __init__(self, latency: float = 0.0, segment_count: int = 1000, audio_seconds: float = 30.0,
+                 bytes_per_second: Optional[float] = None, speed: Optional[float] = None):
+        self.latency = latency
+        self.segment_count = segment_count
+        self.audio_seconds = audio_seconds
+        self.bytes_per_second = bytes_per_second
+        self.speed = speed
+
+    def seed(self, path: str) -> int:
+        with open(path, "rb") as f:
+            return zlib.crc32(f.read(1 << 16))
+
+    def load_model(self, name: str) -> FakeWhisperModel:
+        return FakeWhisperModel(self)
+
+    def load_audio(self, path: str) -> np.ndarray:
+        seconds = self.audio_seconds
+        if self.bytes_per_second:
+            seconds = os.path.getsize(path) / self.bytes_per_second
+        return synthetic_audio(seconds, seed=self.seed(path))
+
+
+class FakeDecoder:
+    """
+    Stand-in for the streaming ffmpeg decoder of ingest.py: turns every chunk
+    written to stdin into synthetic 16-bit PCM on stdout, at the rate of
+    whisper.bytes_per_second (or audio_seconds per 64 KiB).
+    """
+
+    def __init__(self, whisper: FakeWhisper):
+        self.whisper = whisper
+        self.returncode = None
+        self._killed = False
+        read_in, write_in = os.pipe()
+        read_out, write_out = os.pipe()
+        self.stdin = os.fdopen(write_in, 'wb')
+        self.stdout = os.fdopen(read_out, 'rb')
+        self._thread = threading.Thread(target=self._decode, args=(os.fdopen(read_in, 'rb'), os.fdopen(write_out, 'wb')),
+                                        daemon=True)
+        self._thread.start()
+
+    def _decode(self, source, sink) -> None:
+        bytes_per_second = self.whisper.bytes_per_second or (1 << 16) / self.whisper.audio_seconds
+        with source, sink:
+            try:
+                for chunk in iter(lambda: source.read1(1 << 16), b''):
+                    audio = synthetic_audio(len(chunk) / bytes_per_second, seed=zlib.crc32(chunk))
+                    sink.write((audio / 3 * 32767).astype(np.int16).tobytes())
+            except (BrokenPipeError, ValueError):
+                self._killed = True
+        self.returncode = -9 if self._killed else 0
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self) -> int:
+        self._thread.join()
+        return self.returncode
+
+    def kill(self) -> None:
+        self._killed = True
+        try:
+            self.stdin.close()
+        except OSError:
+            pass
+
+
+def install(llm_latency: float = 0.0, token_latency: float = 0.0, transcribe_latency: float = 0.0,
+            segment_count: int = 1000) -> None:
+    """
+    Route the backend's Whisper and Gemini calls (including the flashcard
+    REST calls) to the fakes. Call before importing app.
+    """
+    genai = FakeGenai(latency=llm_latency, token_latency=token_latency)
+    whisper = FakeWhisper(latency=transcribe_latency, segment_count=segment_count)
+    services.override(genai=genai, whisper=whisper)
+
+    import ingest
+    ingest.start_decoder = lambda: FakeDecoder(whisper)
+
+    from routes import flashcard
+
+    def post_gemini(prompt, schema):
+        time.sleep(genai.latency)
+        count = int(re.search(r"exactly (\d+) flashcards", prompt).group(1))
+        return json.dumps([{"question": f"Question {i + 1}?", "answer": genai.summary(prompt)} for i in range(count)])
+
+    flashcard.GEMINI_API_URL = flashcard.GEMINI_API_KEY = "fake"
+    flashcard._post_gemini = post_gemini
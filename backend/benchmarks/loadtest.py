@@ -0,0 +1,322 @@
+"""
+HTTP load test for the backend.
+
+Starts the server in a subprocess with stubbed Whisper and Gemini (see
+benchmarks/fake_server.py), then drives a weighted mix of requests at each
+requested concurrency level:
+    upload_hit   /api/upload of a video that is already cached
+    upload_miss  /api/upload of new content (fake transcription + LLM calls)
+    chat         /api/chat
+    chat_stream  /api/chat/stream, read to the end
+    health       /api/health
+
+For each level it reports throughput, p50/p95/p99/max latency and the error
+rate per scenario. Each run is appended to
+benchmarks/results/loadtest_history.jsonl.
+
+Usage (from the backend directory):
+    python -m benchmarks.loadtest [--concurrency 1 8 32] [--duration 20]
+        [--mix upload_hit=2,upload_miss=1,chat=6,health=1]
+        [--llm-latency 0.5] [--transcribe-latency 2] [--gunicorn --workers 4]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.startup import BACKEND_DIR, RESULTS_DIR, _free_port, _git_commit
+
+HISTORY_FILE = os.path.join(RESULTS_DIR, 'loadtest_history.jsonl')
+DEFAULT_MIX = 'upload_hit=2,upload_miss=1,chat=6,health=1'
+WARM_FILENAME = 'loadtest_warm.mp4'
+WARM_CONTENT = b'loadtest warm video' * 4096
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {sorted(unknown)} (choose from {sorted(SCENARIOS)})")
+    return weights
+
+
+class Client:
+    """Minimal HTTP client for the backend API (standard library only)."""
+
+    def __init__(self, base_url: str, timeout: float = 600):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: bytes = None, headers: Dict[str, str] = None) -> Tuple[int, bytes]:
+        req = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def post_json(self, path: str, data: Dict[str, Any]) -> Tuple[int, bytes]:
+        return self.request('POST', path, json.dumps(data).encode(), {'Content-Type': 'application/json'})
+
+    def upload(self, filename: str, content: bytes) -> Tuple[int, bytes]:
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="video"; filename="{filename}"\r\n'
+            'Content-Type: video/mp4\r\n\r\n'
+        ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+        return self.request('POST', '/api/upload', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+
+def _upload_hit(client: Client, state: Dict[str, Any]) -> int:
+    return client.upload(WARM_FILENAME, WARM_CONTENT)[0]
+
+
+def _upload_miss(client: Client, state: Dict[str, Any]) -> int:
+    unique = uuid.uuid4().hex
+    return client.upload(f"loadtest_{unique}.mp4", unique.encode() * 4096)[0]
+
+
+def _chat(client: Client, state: Dict[str, Any]) -> int:
+    return client.post_json('/api/chat', {'video_id': state['video_id'], 'message': 'What was the main point?'})[0]
+
+
+def _chat_stream(client: Client, state: Dict[str, Any]) -> int:
+    status, body = client.post_json('/api/chat/stream', {'video_id': state['video_id'], 'message': 'Summarize the first part'})
+    # Errors part-way through a stream still return 200
+    return 500 if b'event: error' in body else status
+
+
+def _health(client: Client, state: Dict[str, Any]) -> int:
+    return client.request('GET', '/api/health')[0]
+
+
+SCENARIOS: Dict[str, Callable[[Client, Dict[str, Any]], int]] = {
+    'upload_hit': _upload_hit,
+    'upload_miss': _upload_miss,
+    'chat': _chat,
+    'chat_stream': _chat_stream,
+    'health': _health,
+}
+
+
+class Server:
+    """The fake-model backend running in a subprocess, in a scratch directory."""
+
+    def __init__(self, env: Dict[str, str], gunicorn: bool = False, workers: int = 0, verbose: bool = False):
+        self.env = env
+        self.gunicorn = gunicorn
+        self.workers = workers
+        self.verbose = verbose
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.workdir = None
+        self.process = None
+
+    def __enter__(self) -> 'Server':
+        self.workdir = tempfile.mkdtemp(prefix='loadtest-')
+        shutil.copytree(os.path.join(BACKEND_DIR, 'templates'), os.path.join(self.workdir, 'templates'))
+
+        env = dict(os.environ, **self.env)
+        env['PYTHONPATH'] = BACKEND_DIR + os.pathsep + env.get('PYTHONPATH', '')
+        env['STATE_BACKEND'] = f"sqlite:///{os.path.join(self.workdir, 'state.db')}"
+        env.setdefault('LOG_LEVEL', 'WARNING')
+
+        if self.gunicorn:
+            cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+                   '--bind', f"127.0.0.1:{self.port}", 'benchmarks.fake_server:app']
+            if self.workers:
+                cmd += ['--workers', str(self.workers)]
+        else:
+            cmd = [sys.executable, '-m', 'benchmarks.fake_server', '--port', str(self.port)]
+
+        # The server's output goes to stderr with --verbose; stdout is reserved for the JSON result
+        output = sys.stderr if self.verbose else subprocess.DEVNULL
+        self.process = subprocess.Popen(cmd, cwd=self.workdir, env=env, stdout=output, stderr=output)
+        self._wait_healthy()
+        return self
+
+    def _wait_healthy(self, timeout: float = 60) -> None:
+        client = Client(self.base_url, timeout=1)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}")
+            try:
+                if client.request('GET', '/api/health')[0] == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.05)
+        raise TimeoutError(f"Server not healthy after {timeout}s")
+
+    def __exit__(self, *exc) -> None:
+        self.process.terminate()
+        self.process.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run_level(base_url: str, concurrency: int, duration: float, weights: Dict[str, float],
+              state: Dict[str, Any], seed: int = 0) -> Dict[str, Any]:
+    """
+    Drive the server with `concurrency` closed-loop clients for `duration` seconds.
+
+    Returns:
+        Overall throughput and per-scenario request counts, error rates and latency percentiles
+    """
+    names = list(weights)
+    samples: Dict[str, List[Tuple[float, bool]]] = {name: [] for name in names}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index: int) -> None:
+        rng = random.Random(seed * 1000 + index)
+        client = Client(base_url)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights=[weights[n] for n in names])[0]
+            start = time.perf_counter()
+            try:
+                ok = SCENARIOS[name](client, state) < 400
+            except OSError:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[name].append((elapsed, ok))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    scenarios = {}
+    total = errors = 0
+    for name, results in samples.items():
+        latencies = sorted(ms for ms, _ in results)
+        failed = sum(1 for _, ok in results if not ok)
+        total += len(results)
+        errors += failed
+        scenarios[name] = {
+            'requests': len(results),
+            'errors': failed,
+            'error_rate': failed / len(results) if results else 0.0,
+            'throughput_rps': len(results) / elapsed,
+            'p50_ms': _ms(percentile(latencies, 50)),
+            'p95_ms': _ms(percentile(latencies, 95)),
+            'p99_ms': _ms(percentile(latencies, 99)),
+            'max_ms': _ms(latencies[-1] if latencies else None),
+        }
+
+    return {
+        'concurrency': concurrency,
+        'duration_s': elapsed,
+        'requests': total,
+        'errors': errors,
+        'error_rate': errors / total if total else 0.0,
+        'throughput_rps': total / elapsed,
+        'scenarios': scenarios,
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else seconds * 1000
+
+
+def run(concurrency_levels: List[int], duration: float, mix: str, fake_env: Dict[str, str],
+        gunicorn: bool = False, workers: int = 0, verbose: bool = False) -> Dict[str, Any]:
+    """Start the server, run every concurrency level against it and return the results."""
+    weights = parse_mix(mix)
+    with Server(fake_env, gunicorn, workers, verbose) as server:
+        client = Client(server.base_url)
+        # One cached lecture to chat with and to re-upload for cache hits
+        status, body = client.upload(WARM_FILENAME, WARM_CONTENT)
+        if status != 200:
+            raise RuntimeError(f"Warm-up upload failed ({status}): {body[:500]!r}")
+        state = {'video_id': json.loads(body)['video_id']}
+
+        levels = [run_level(server.base_url, c, duration, weights, state, seed=i) for i, c in enumerate(concurrency_levels)]
+
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'server': f"gunicorn ({workers or 'default'} workers)" if gunicorn else 'flask threaded',
+        'mix': weights,
+        'fake_latencies': fake_env,
+        'levels': levels,
+    }
+
+
+def _print_report(result: Dict[str, Any]) -> None:
+    print(f"server: {result['server']}  mix: {result['mix']}", file=sys.stderr)
+    for level in result['levels']:
+        print(f"\nconcurrency {level['concurrency']}: {level['throughput_rps']:.1f} req/s, "
+              f"{level['error_rate']:.1%} errors", file=sys.stderr)
+        for name, s in level['scenarios'].items():
+            if not s['requests']:
+                continue
+            print(f"  {name:12s} {s['requests']:6d} req  {s['throughput_rps']:7.1f}/s  "
+                  f"p50 {s['p50_ms']:8.1f}  p95 {s['p95_ms']:8.1f}  p99 {s['p99_ms']:8.1f} ms  "
+                  f"errors {s['error_rate']:.1%}", file=sys.stderr)
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help='Concurrent clients per level')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds per concurrency level')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Scenario weights, e.g. chat=3,health=1')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds per fake Gemini call')
+    parser.add_argument('--token-latency', type=float, default=0.02, help='Seconds between fake streamed chunks')
+    parser.add_argument('--transcribe-latency', type=float, default=2, help='Seconds per fake transcription')
+    parser.add_argument('--segments', type=int, default=1000, help='Segments per fake transcript')
+    parser.add_argument('--gunicorn', action='store_true', help='Serve with gunicorn.conf.py instead of the Flask server')
+    parser.add_argument('--workers', type=int, default=0, help='Gunicorn workers (default: from gunicorn.conf.py)')
+    parser.add_argument('--output', help='Also write the result to this file')
+    parser.add_argument('--verbose', action='store_true', help="Show the server's log output")
+    args = parser.parse_args(argv)
+
+    fake_env = {
+        'FAKE_LLM_LATENCY': str(args.llm_latency),
+        'FAKE_TOKEN_LATENCY': str(args.token_latency),
+        'FAKE_TRANSCRIBE_LATENCY': str(args.transcribe_latency),
+        'FAKE_SEGMENT_COUNT': str(args.segments),
+    }
+    result = run(args.concurrency, args.duration, args.mix, fake_env, args.gunicorn, args.workers, args.verbose)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(HISTORY_FILE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + '\n')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+    _print_report(result)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""
+Offline benchmark of the processing pipeline.
+
+Times the chapter post-processing helpers, chunking and the cache on
+synthetic transcripts of increasing size, then the full /api/upload (cache
+miss and hit) and /api/chat flows through the Flask test client, with
+Whisper and Gemini replaced by the deterministic fakes in benchmarks/fakes.py.
+Nothing leaves the machine and no real models are loaded. The ingest section
+times upload-to-first-chapter over a throttled upload, with and without
+pipelined ingest (see ingest.py).
+
+Each run is written as JSON to stdout (or --output) and appended to
+benchmarks/results/pipeline_history.jsonl. Pass --baseline with an earlier
+result file to print the change in median time per benchmark.
+
+Usage (from the backend directory):
+    python -m benchmarks.pipeline [--sizes 100 1000 10000 50000] [--repeat 5]
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+
+from benchmarks import fakes
+from benchmarks.startup import BACKEND_DIR, RESULTS_DIR, _git_commit
+
+HISTORY_FILE = os.path.join(RESULTS_DIR, 'pipeline_history.jsonl')
+DEFAULT_SIZES = [100, 1000, 10000, 50000]
+
+
+def timeit(fn: Callable[[], Any], repeat: int, setup: Callable[[], Any] = None) -> Dict[str, float]:
+    """
+    Time fn over several runs.
+
+    Args:
+        fn: Function to time; receives setup()'s result if setup is given
+        repeat: Number of timed runs
+        setup: Untimed function run before each call, e.g. to copy inputs fn mutates
+
+    Returns:
+        Median, min and mean in milliseconds
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg) if setup else fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': statistics.median(times), 'min_ms': min(times), 'mean_ms': statistics.mean(times)}
+
+
+def synthetic_chapter_results(segments: List[Dict[str, Any]], calls: int = 3) -> List[Dict[str, Any]]:
+    """Overlapping chapter lists, as returned by several windowed chapter calls."""
+    end = segments[-1]['end']
+    results = []
+    for call in range(calls):
+        count = 12
+        offset = call * end / (count * calls)
+        results.append({'chapters': [
+            {
+                'chapter_name': f"Chapter {i + 1}",
+                'start_time': min(offset + i * end / count, end),
+                'end_time': min(offset + (i + 1) * end / count, end)
+            }
+            for i in range(count)
+        ]})
+    return results
+
+
+def bench_segment_helpers(size: int, repeat: int) -> Dict[str, Any]:
+    """Time the chapter post-processing helpers and chunking on a transcript of `size` segments."""
+    from chapterize import (
+        group_segments_for_processing, merge_chapter_results, align_time_to_segment,
+        ensure_full_coverage, encode_transcript_blocks
+    )
+    from routes.localChunker import chunk_segments
+
+    segments = fakes.synthetic_segments(size)
+    results = synthetic_chapter_results(segments)
+    chapters = [dict(c) for c in results[0]['chapters']]
+    end = segments[-1]['end']
+    probes = [end * i / 100 for i in range(100)]
+
+    return {
+        'group_segments_for_processing': timeit(lambda: group_segments_for_processing(segments), repeat),
+        'merge_chapter_results': timeit(
+            lambda rs: merge_chapter_results(rs, segments), repeat,
+            setup=lambda: [{'chapters': [dict(c) for c in r['chapters']]} for r in results]
+        ),
+        'align_time_to_segment_x100': timeit(lambda: [align_time_to_segment(t, segments) for t in probes], repeat),
+        'ensure_full_coverage': timeit(
+            lambda cs: ensure_full_coverage(cs, segments), repeat,
+            setup=lambda: [dict(c) for c in chapters]
+        ),
+        'encode_transcript_blocks': timeit(lambda: encode_transcript_blocks(segments), repeat),
+        'chunk_segments': timeit(lambda: chunk_segments(segments), repeat),
+    }
+
+
+def bench_cache(size: int, repeat: int) -> Dict[str, Any]:
+    """Time save_to_cache and load_from_cache for a transcript of `size` segments."""
+    from cache import save_to_cache, load_from_cache, get_cache_key
+
+    segments = fakes.synthetic_segments(size)
+    transcript = {'segments': segments, 'full_text': ' '.join(s['text'] for s in segments)}
+    chapters = synthetic_chapter_results(segments)[0]['chapters']
+    filename = f"bench_{size}.mp4"
+
+    save = timeit(lambda: save_to_cache(filename, transcript, chapters, 'summary'), repeat)
+    load = timeit(lambda: load_from_cache(get_cache_key(filename)), repeat)
+    return {'save_to_cache': save, 'load_from_cache': load}
+
+
+def bench_api(repeat: int, segment_count: int) -> Dict[str, Any]:
+    """Time /api/upload (miss and hit) and /api/chat through the Flask test client."""
+    from app import app
+
+    client = app.test_client()
+    counter = iter(range(1 << 30))
+
+    def upload(name=None, content=None):
+        n = next(counter)
+        data = {'video': (io.BytesIO(content or f"video {n}".encode() * 1024), name or f"lecture_{n}.mp4")}
+        response = client.post('/api/upload', data=data, content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f"Upload failed: {response.get_data(as_text=True)[:500]}")
+        return response.get_json()
+
+    video_id = upload('warm.mp4', b'warm' * 1024)['video_id']
+
+    def chat(message=None):
+        # Distinct questions by default, so they miss the answer cache
+        message = message or f"What was point number {next(counter)}?"
+        response = client.post('/api/chat', json={'video_id': video_id, 'message': message})
+        if response.status_code != 200:
+            raise RuntimeError(f"Chat failed: {response.get_data(as_text=True)[:500]}")
+
+    def chat_stream():
+        message = f"Explain topic number {next(counter)}"
+        response = client.post('/api/chat/stream', json={'video_id': video_id, 'message': message})
+        response.get_data()
+
+    return {
+        'segment_count': segment_count,
+        'upload_cache_miss': timeit(lambda: upload(), repeat),
+        'upload_cache_hit': timeit(lambda: upload('warm.mp4', b'warm' * 1024), repeat),
+        'chat': timeit(chat, repeat),
+        'chat_answer_cached': timeit(lambda: chat('What was the main point?'), repeat),
+        'chat_stream': timeit(chat_stream, repeat),
+    }
+
+
+class ThrottledStream(io.BytesIO):
+    """Request body that arrives at a steady rate, like an upload over a slow link."""
+
+    def __init__(self, data: bytes, seconds: float):
+        super().__init__(data)
+        self._bytes_per_second = len(data) / seconds
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = super().read(size if size and size > 0 else 64 * 1024)
+        time.sleep(len(chunk) / self._bytes_per_second)
+        return chunk
+
+    def readinto(self, buffer) -> int:
+        n = super().readinto(buffer)
+        time.sleep(n / self._bytes_per_second)
+        return n
+
+
+def bench_ingest(repeat: int, segment_count: int, size: int = 8 * 1024 * 1024, audio_seconds: float = 600.0,
+                 upload_seconds: float = 1.0, transcribe_seconds: float = 1.0) -> Dict[str, Any]:
+    """
+    Time upload-to-first-chapter (the /api/upload response carries the
+    chapters) for a lecture that takes upload_seconds to upload and
+    transcribe_seconds to transcribe, sequentially and with pipelined ingest.
+    """
+    import app as app_module
+    import ingest
+    import services
+
+    whisper = services.get_whisper()
+    saved = (whisper.audio_seconds, whisper.bytes_per_second, whisper.speed,
+             ingest.INGEST_WINDOW_SECONDS, app_module.PIPELINED_INGEST)
+    whisper.audio_seconds = audio_seconds
+    whisper.bytes_per_second = size / audio_seconds
+    whisper.speed = audio_seconds / transcribe_seconds
+    ingest.INGEST_WINDOW_SECONDS = audio_seconds / 10
+    client = app_module.app.test_client()
+    counter = iter(range(1 << 30))
+
+    def body():
+        video = FileStorage(io.BytesIO(os.urandom(size)), f"ingest_{next(counter)}.mp4")
+        return encode_multipart({'video': video})
+
+    def upload(form):
+        boundary, data = form
+        response = client.post('/api/upload', input_stream=ThrottledStream(data, upload_seconds),
+                               content_length=len(data), content_type=f'multipart/form-data; boundary={boundary}')
+        if response.status_code != 200 or not response.get_json()['chapters']:
+            raise RuntimeError(f"Upload failed: {response.get_data(as_text=True)[:500]}")
+
+    def sequential(form):
+        app_module.PIPELINED_INGEST = False
+        upload(form)
+
+    def pipelined(form):
+        app_module.PIPELINED_INGEST = True
+        upload(form)
+
+    try:
+        return {
+            'upload_seconds': upload_seconds,
+            'transcribe_seconds': transcribe_seconds,
+            'first_chapter_sequential': timeit(sequential, repeat, setup=body),
+            'first_chapter_pipelined': timeit(pipelined, repeat, setup=body),
+        }
+    finally:
+        (whisper.audio_seconds, whisper.bytes_per_second, whisper.speed,
+         ingest.INGEST_WINDOW_SECONDS, app_module.PIPELINED_INGEST) = saved
+
+
+def run(sizes: List[int], repeat: int, api_segments: int) -> Dict[str, Any]:
+    """Run all benchmarks in a scratch working directory and return the results."""
+    os.environ['STATE_BACKEND'] = 'memory://'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    fakes.install(segment_count=api_segments)
+
+    # The backend writes to data/ relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='pipeline-bench-')
+    shutil.copytree(os.path.join(BACKEND_DIR, 'templates'), os.path.join(workdir, 'templates'))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        result = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_commit': _git_commit(),
+            'python': sys.version.split()[0],
+            'repeat': repeat,
+            'segments': {str(size): bench_segment_helpers(size, repeat) for size in sizes},
+            'cache': {str(size): bench_cache(size, repeat) for size in sizes},
+            'api': bench_api(repeat, api_segments),
+            'ingest': bench_ingest(repeat, api_segments),
+        }
+        # Let background flashcard generation finish before the scratch directory goes
+        from routes.flashcard import _executor
+        _executor.shutdown(wait=True)
+        return result
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _flatten(result: Dict[str, Any], prefix: str = '') -> Dict[str, float]:
+    """Map "section/size/benchmark" names to median times."""
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            if 'median_ms' in value:
+                flat[prefix + key] = value['median_ms']
+            else:
+                flat.update(_flatten(value, f"{prefix}{key}/"))
+    return flat
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Compare median times against a baseline run.
+
+    Returns:
+        One entry per benchmark present in both runs, with both medians and their ratio
+    """
+    current = _flatten({k: result[k] for k in ('segments', 'cache', 'api', 'ingest')})
+    previous = _flatten({k: baseline[k] for k in ('segments', 'cache', 'api', 'ingest') if k in baseline})
+    return [
+        {'benchmark': name, 'baseline_ms': previous[name], 'current_ms': ms, 'ratio': ms / previous[name] if previous[name] else None}
+        for name, ms in current.items() if name in previous
+    ]
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Transcript sizes in segments')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark')
+    parser.add_argument('--api-segments', type=int, default=1000, help='Segments per fake transcription in the API benchmarks')
+    parser.add_argument('--output', help='Also write the result to this file')
+    parser.add_argument('--baseline', help='Earlier result file to compare against')
+    args = parser.parse_args(argv)
+
+    result = run(args.sizes, args.repeat, args.api_segments)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(HISTORY_FILE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + '\n')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            result['comparison'] = compare(result, json.load(f))
+        for row in result['comparison']:
+            print(f"{row['ratio']:6.2f}x  {row['current_ms']:10.2f} ms  (was {row['baseline_ms']:.2f})  {row['benchmark']}",
+                  file=sys.stderr)
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Start-up benchmark for the backend.
+
+Measures:
+- the `python -X importtime` breakdown of `import app`, and
+- the time from launching a server process to its first healthy
+  /api/health response.
+
+Each run is appended to benchmarks/results/startup_history.jsonl so start-up
+cost can be tracked over time.
+
+Usage (from the backend directory):
+    python -m benchmarks.startup [--runs 3] [--top 15]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+HISTORY_FILE = os.path.join(RESULTS_DIR, 'startup_history.jsonl')
+
+
+def _bench_env() -> Dict[str, str]:
+    """Environment for child processes: in-memory state so runs don't touch data/."""
+    env = dict(os.environ)
+    env['STATE_BACKEND'] = 'memory://'
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    return env
+
+
+def measure_import_time(top: int = 15) -> Dict[str, Any]:
+    """
+    Run `python -X importtime -c "import app"` and parse its report.
+    
+    Args:
+        top: Number of slowest modules (by cumulative time) to keep
+        
+    Returns:
+        Dictionary with total import time and the slowest modules, in milliseconds
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=BACKEND_DIR, env=_bench_env(), capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import app failed:\n{result.stderr[-2000:]}")
+    
+    # Lines look like: "import time:       self [us] |  cumulative | imported package"
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({
+            'module': name.rstrip(),
+            'self_ms': int(self_us) / 1000,
+            'cumulative_ms': int(cumulative_us) / 1000
+        })
+    
+    app_entry = next((m for m in modules if m['module'].strip() == 'app'), None)
+    slowest = sorted(modules, key=lambda m: m['cumulative_ms'], reverse=True)[:top]
+    
+    return {
+        'total_ms': app_entry['cumulative_ms'] if app_entry else None,
+        'module_count': len(modules),
+        'slowest': [{**m, 'module': m['module'].strip()} for m in slowest]
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_time_to_healthy(timeout: float = 60.0) -> float:
+    """
+    Launch the server and poll /api/health until it answers.
+    
+    Returns:
+        Seconds from process launch to the first 200 response
+    """
+    port = _free_port()
+    code = f"from app import app; app.run(host='127.0.0.1', port={port})"
+    
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c', code],
+        cwd=BACKEND_DIR, env=_bench_env(),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"Server not healthy after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run(runs: int = 3, top: int = 15) -> Dict[str, Any]:
+    """Run the start-up benchmark and append the result to the history file."""
+    import_runs = [measure_import_time(top) for _ in range(runs)]
+    healthy_runs = [measure_time_to_healthy() for _ in range(runs)]
+    
+    result = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'runs': runs,
+        'import_app_ms': {
+            'median': statistics.median(r['total_ms'] for r in import_runs),
+            'min': min(r['total_ms'] for r in import_runs)
+        },
+        'time_to_healthy_ms': {
+            'median': statistics.median(healthy_runs) * 1000,
+            'min': min(healthy_runs) * 1000
+        },
+        # Breakdown from the fastest run, which has the least noise
+        'slowest_imports': min(import_runs, key=lambda r: r['total_ms'])['slowest']
+    }
+    
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(HISTORY_FILE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + '\n')
+    
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=BACKEND_DIR, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return ''
+
+
+def _print_report(result: Dict[str, Any]) -> None:
+    print(f"import app:        {result['import_app_ms']['median']:.1f} ms (median of {result['runs']})")
+    print(f"time to healthy:   {result['time_to_healthy_ms']['median']:.1f} ms (median of {result['runs']})")
+    print("slowest imports (cumulative):")
+    for module in result['slowest_imports']:
+        print(f"  {module['cumulative_ms']:9.1f} ms  {module['module']}")
+    print(f"Appended to {HISTORY_FILE}")
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='Number of runs to take the median of')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to report')
+    args = parser.parse_args(argv)
+    
+    _print_report(run(args.runs, args.top))
+
+
+if __name__ == '__main__':
+    main()
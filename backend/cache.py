@@ -0,0 +1,232 @@
+import os
+import json
+import uuid
+import hashlib
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+from search_index import get_search_index
+from state_store import get_state_store
+
+logger = logging.getLogger(__name__)
+
+# Cache layout: data/cache/<cache_key>/ holds one processed lecture's artifacts
+CACHE_FOLDER = 'data/cache'
+CACHE_INDEX_FILE = os.path.join(CACHE_FOLDER, 'cache_index.json')
+# Held (with flock) across each read-modify-write of the index
+CACHE_INDEX_LOCK_FILE = CACHE_INDEX_FILE + '.lock'
+
+_index_lock = threading.Lock()
+
+
+def get_cache_key(filename):
+    """Generate MD5 hash from filename for cache directory name."""
+    return hashlib.md5(filename.encode()).hexdigest()
+
+
+def get_content_hash(file_path, chunk_size=1024 * 1024):
+    """Compute a SHA-256 hash of a file's contents, reading it in chunks."""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_cache_index():
+    """Load the cache index from file."""
+    if os.path.exists(CACHE_INDEX_FILE):
+        try:
+            with open(CACHE_INDEX_FILE, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error("Error loading cache index: %s", e)
+            return {}
+    return {}
+
+
+def update_cache_index(filename, cache_key, content_hash=None):
+    """
+    Update the cache index with a new entry.
+
+    When a content hash is given it is also recorded (as "sha256:<hash>") so
+    the same video uploaded under a different filename resolves to this entry.
+    """
+    try:
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        # Lock across the whole update so workers saving different lectures
+        # at once don't drop each other's entries
+        with _index_lock, open(CACHE_INDEX_LOCK_FILE, 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            cache_index = get_cache_index()
+            cache_index[filename] = cache_key
+            if content_hash:
+                cache_index[f"sha256:{content_hash}"] = cache_key
+
+            # Write to a temp file and swap it in so readers never see a
+            # half-written index
+            tmp_path = f"{CACHE_INDEX_FILE}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(cache_index, f, indent=2)
+            os.replace(tmp_path, CACHE_INDEX_FILE)
+    except Exception as e:
+        logger.error("Error updating cache index: %s", e)
+
+
+def cache_exists(cache_key):
+    """Check if cached data exists for a given cache key."""
+    cache_dir = os.path.join(CACHE_FOLDER, cache_key)
+    
+    # Check if cache directory exists and contains all required files
+    required_files = [
+        'transcript_segments.json',
+        'transcript_text.txt',
+        'chapters.json',
+        'summary.txt'
+    ]
+    
+    if not os.path.exists(cache_dir):
+        return False
+    
+    for file in required_files:
+        if not os.path.exists(os.path.join(cache_dir, file)):
+            return False
+    
+    return True
+
+
+def find_cache_key(filename, content_hash=None):
+    """
+    Find the cache key holding complete cached data for an upload.
+
+    Looks up the filename first, then falls back to the content hash.
+
+    Returns:
+        The cache key, or None on a cache miss
+    """
+    cache_key = get_cache_key(filename)
+    if cache_exists(cache_key):
+        return cache_key
+    
+    if content_hash:
+        cache_key = get_cache_index().get(f"sha256:{content_hash}")
+        if cache_key and cache_exists(cache_key):
+            return cache_key
+    
+    return None
+
+
+def save_to_cache(filename, transcript_data, chapters, summary, content_hash=None):
+    """Save processed data to cache."""
+    cache_key = get_cache_key(filename)
+    cache_dir = os.path.join(CACHE_FOLDER, cache_key)
+    os.makedirs(cache_dir, exist_ok=True)
+    
+    try:
+        # Save transcript segments
+        with open(os.path.join(cache_dir, 'transcript_segments.json'), 'w') as f:
+            json.dump(transcript_data['segments'], f, indent=2)
+        
+        # Save transcript text
+        with open(os.path.join(cache_dir, 'transcript_text.txt'), 'w', encoding='utf-8') as f:
+            f.write(transcript_data['full_text'])
+        
+        # Save chapters
+        with open(os.path.join(cache_dir, 'chapters.json'), 'w') as f:
+            json.dump(chapters, f, indent=2)
+        
+        # Save summary
+        with open(os.path.join(cache_dir, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write(summary)
+        
+        # Update cache index
+        update_cache_index(filename, cache_key, content_hash)
+        
+        # Make the transcript searchable; the cached files stay valid if this fails
+        try:
+            get_search_index().index_lecture(cache_key, filename, transcript_data['segments'])
+        except Exception:
+            logger.exception("Error indexing %s for search", filename)
+        
+        logger.info("Data cached successfully for %s", filename)
+        return True
+    except Exception as e:
+        logger.exception("Error saving %s to cache", filename)
+        return False
+
+
+def load_from_cache(cache_key):
+    """Load cached data for a given cache key."""
+    cache_dir = os.path.join(CACHE_FOLDER, cache_key)
+    
+    try:
+        # Load transcript segments
+        with open(os.path.join(cache_dir, 'transcript_segments.json'), 'r') as f:
+            segments = json.load(f)
+        
+        # Load transcript text
+        with open(os.path.join(cache_dir, 'transcript_text.txt'), 'r', encoding='utf-8') as f:
+            full_text = f.read()
+        
+        # Load chapters
+        with open(os.path.join(cache_dir, 'chapters.json'), 'r') as f:
+            chapters = json.load(f)
+        
+        # Load summary
+        with open(os.path.join(cache_dir, 'summary.txt'), 'r', encoding='utf-8') as f:
+            summary = f.read()
+        
+        transcript_data = {
+            'segments': segments,
+            'full_text': full_text
+        }
+        
+        logger.info("Data loaded from cache for %s", cache_key)
+        return transcript_data, chapters, summary
+    except Exception as e:
+        logger.exception("Error loading %s from cache", cache_key)
+        return None, None, None
+
+
+def get_cache_dir(cache_key):
+    """Get the cache directory for a cache key."""
+    return os.path.join(CACHE_FOLDER, cache_key)
+
+
+def get_video_cache_key(video_id):
+    """
+    Get the cache key of an uploaded video's processed artifacts.
+    
+    Returns:
+        The cache key, or None if the video is unknown
+    """
+    video = get_state_store().get('videos', video_id)
+    return video['cache_key'] if video else None
+
+
+def record_video(video_id, cache_key, filename):
+    """
+    Record which cached lecture an uploaded video is, and make it the
+    lecture's video for get_lecture_video_id().
+    """
+    store = get_state_store()
+    store.set('videos', video_id, {'cache_key': cache_key, 'filename': filename})
+    store.set('lecture_videos', cache_key, video_id)
+
+
+def get_lecture_video_id(cache_key):
+    """
+    Get the most recent uploaded video of a cached lecture, e.g. to play a
+    search hit.
+    
+    Returns:
+        The video_id, or None if no upload of the lecture is recorded
+    """
+    return get_state_store().get('lecture_videos', cache_key)
@@ -1,15 +1,45 @@
+import collections
 import json
+import logging
+import math
 import os
-import re
-from typing import List, Dict, Tuple, Any
-import google.generativeai as genai
-from dotenv import load_dotenv
+from typing import List, Dict, Tuple, Any, Optional
 
-# Load environment variables
-load_dotenv()
+from resilience import LLMUnavailableError, call_llm, record_fallback
+from routes.localVectors import TOKEN_REGEX, adjacent_cosine_distances, combine_sentences
+from services import get_genai
+from structured_output import generate_structured, StructuredOutputError
+from telemetry import configure_logging, llm_call
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+logger = logging.getLogger(__name__)
+
+# Prompt encoding for chaptering. Segments are coalesced into blocks of about
+# this many seconds (0 = one line per segment, with [start-end] timestamps)
+CHAPTER_BLOCK_SECONDS = float(os.getenv("CHAPTER_BLOCK_SECONDS", "30"))
+# Label blocks with sequential numbers instead of their start time in seconds
+CHAPTER_NUMBERED_BLOCKS = os.getenv("CHAPTER_NUMBERED_BLOCKS", "1") != "0"
+# Target chapter length for the local fallback used when Gemini is unavailable
+LOCAL_CHAPTER_SECONDS = 600
+
+# How each prompt format is described to the model: transcript line format,
+# JSON fields for a chapter's boundaries, and the boundary guideline
+PROMPT_FORMATS = {
+    "segments": {
+        "line_format": "The transcript format is [start_time-end_time] text.",
+        "fields": '"start_time": timestamp_in_seconds,\n                "end_time": timestamp_in_seconds',
+        "guideline": "Start and end times should align with the timestamps in the transcript",
+    },
+    "block_times": {
+        "line_format": "The transcript is split into blocks; each line is [start_time_in_seconds] text.",
+        "fields": '"start_time": start_time_of_first_block,\n                "end_time": start_time_of_last_block',
+        "guideline": "Start and end times must be block start times from the transcript",
+    },
+    "blocks": {
+        "line_format": "The transcript is split into numbered blocks; each line is [block_number] text.",
+        "fields": '"start_block": first_block_number,\n                "end_block": last_block_number',
+        "guideline": "start_block and end_block must be block numbers from the transcript (end_block is inclusive)",
+    },
+}
 
 def load_transcript_segments(file_path: str) -> List[Dict[str, Any]]:
     """
@@ -69,7 +99,112 @@ def create_transcript_text(segments: List[Dict[str, Any]]) -> str:
     
     return "\n".join(transcript_parts)
 
-def call_gemini_for_chapters(transcript_text: str, max_chapters: int = 12, model_name: str = "gemini-2.5-flash") -> Dict[str, Any]:
+def chapters_schema(prompt_format: str = "segments") -> Dict[str, Any]:
+    """
+    Response schema for call_gemini_for_chapters.
+    
+    Args:
+        prompt_format: Prompt format; "blocks" answers with block numbers,
+                       the others with times in seconds
+        
+    Returns:
+        Schema of {"chapters": [...]}
+    """
+    if prompt_format == "blocks":
+        boundaries = {"start_block": {"type": "INTEGER"}, "end_block": {"type": "INTEGER"}}
+    else:
+        boundaries = {"start_time": {"type": "NUMBER"}, "end_time": {"type": "NUMBER"}}
+    
+    return {
+        "type": "OBJECT",
+        "properties": {
+            "chapters": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {"chapter_name": {"type": "STRING"}, **boundaries},
+                    "required": ["chapter_name", *boundaries]
+                }
+            }
+        },
+        "required": ["chapters"]
+    }
+
+def encode_transcript_blocks(segments: List[Dict[str, Any]], block_seconds: float = 30, numbered: bool = True) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Coalesce segments into coarser time blocks to shrink the chapter prompt.
+    
+    Each block gets a single marker instead of a [start-end] pair per segment:
+    its number (e.g. "[12] ...") or its start time in whole seconds
+    (e.g. "[360] ...").
+    
+    Args:
+        segments: List of transcript segments
+        block_seconds: Approximate length of each block in seconds
+        numbered: Label blocks with numbers instead of start times
+        
+    Returns:
+        Tuple of (transcript text, blocks). Each block records its start, end,
+        and the indices of its first and last segment, so chapter boundaries
+        given in blocks can be mapped back to exact segment boundaries.
+    """
+    blocks = []
+    for i, segment in enumerate(segments):
+        if not blocks or segment["start"] - blocks[-1]["start"] >= block_seconds:
+            blocks.append({"start": segment["start"], "end": segment["end"], "first_segment": i, "last_segment": i, "texts": []})
+        block = blocks[-1]
+        block["end"] = segment["end"]
+        block["last_segment"] = i
+        block["texts"].append(segment["text"])
+    
+    lines = []
+    for number, block in enumerate(blocks):
+        label = number if numbered else int(block["start"])
+        lines.append(f"[{label}] {' '.join(block.pop('texts'))}")
+    
+    return "\n".join(lines), blocks
+
+def decode_block_chapters(chapters: List[Dict[str, Any]], blocks: List[Dict[str, Any]], numbered: bool = True) -> List[Dict[str, Any]]:
+    """
+    Map chapters returned for a block-encoded transcript back to segment boundaries.
+    
+    Args:
+        chapters: Chapters from the model, with start_block/end_block
+                  (numbered) or block start times in seconds
+        blocks: Blocks from encode_transcript_blocks()
+        numbered: Whether the blocks were numbered
+        
+    Returns:
+        Chapters with start_time at the start of their first block's first
+        segment and end_time at the end of their last block's last segment
+    """
+    block_starts = [block["start"] for block in blocks]
+    
+    def to_block(value):
+        if numbered:
+            return min(max(int(value), 0), len(blocks) - 1)
+        return min(range(len(blocks)), key=lambda i: abs(block_starts[i] - float(value)))
+    
+    decoded = []
+    for chapter in chapters:
+        start_key, end_key = ("start_block", "end_block") if numbered else ("start_time", "end_time")
+        if not chapter.get("chapter_name") or chapter.get(start_key) is None:
+            continue
+        start_block = to_block(chapter[start_key])
+        end_block = max(to_block(chapter.get(end_key, chapter[start_key])), start_block)
+        decoded.append({
+            "chapter_name": chapter["chapter_name"],
+            "start_time": blocks[start_block]["start"],
+            "end_time": blocks[end_block]["end"]
+        })
+    
+    return decoded
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English text (about 4 characters per token)."""
+    return len(text) // 4
+
+def call_gemini_for_chapters(transcript_text: str, max_chapters: int = 12, model_name: str = "gemini-2.5-flash", prompt_format: str = "segments") -> Dict[str, Any]:
     """
     Call Gemini API to identify chapters in the transcript.
     
@@ -77,25 +212,28 @@ def call_gemini_for_chapters(transcript_text: str, max_chapters: int = 12, model
         transcript_text: Transcript text with timestamps
         max_chapters: Maximum number of chapters to generate
         model_name: Name of the Gemini model to use
+        prompt_format: How transcript_text is encoded: "segments" (from
+                       create_transcript_text), or "blocks" / "block_times"
+                       (from encode_transcript_blocks, numbered or not)
         
     Returns:
         Dictionary containing chapter information
     """
-    model = genai.GenerativeModel(model_name)
+    model = get_genai().GenerativeModel(model_name)
+    prompt_spec = PROMPT_FORMATS[prompt_format]
     
     prompt = f"""
     Analyze the following video transcript and identify logical chapter breaks.
-    For each chapter, provide a short, descriptive name and the timestamp where it begins and ends.
+    For each chapter, provide a short, descriptive name and where it begins and ends.
     
-    The transcript format is [start_time-end_time] text.
+    {prompt_spec["line_format"]}
     
     Please respond ONLY with a valid JSON object in the following format:
     {{
         "chapters": [
             {{
                 "chapter_name": "Short descriptive name",
-                "start_time": timestamp_in_seconds,
-                "end_time": timestamp_in_seconds
+                {prompt_spec["fields"]}
             }},
             ...
         ]
@@ -104,7 +242,7 @@ def call_gemini_for_chapters(transcript_text: str, max_chapters: int = 12, model
     Guidelines:
     1. Chapters should represent distinct topics or sections of the video
     2. Chapter names should be concise (2-5 words) but descriptive
-    3. Start and end times should align with the timestamps in the transcript
+    3. {prompt_spec["guideline"]}
     4. Create a reasonable number of chapters based on natural topic changes (typically 5-10 for this length of content)
     5. DO NOT exceed {max_chapters} chapters maximum - this is a hard limit, not a target
     6. Make sure chapters flow logically and cover the ENTIRE content from beginning to end
@@ -117,39 +255,33 @@ def call_gemini_for_chapters(transcript_text: str, max_chapters: int = 12, model
     """
     
     try:
-        print(f"Sending transcript to Gemini (length: {len(transcript_text)} chars)...")
-        print(f"API Key configured: {bool(os.getenv('GEMINI_API_KEY'))}")
+        logger.info("Sending transcript to Gemini (length: %d chars, ~%d prompt tokens, format: %s)",
+                    len(transcript_text), estimate_tokens(prompt), prompt_format)
         
-        response = model.generate_content(prompt)
-        # Extract JSON from the response
-        response_text = response.text
-        print(f"Full Gemini response:\n{response_text}")
+        schema = chapters_schema(prompt_format)
+        generation_config = {"response_mime_type": "application/json", "response_schema": schema}
         
-        # Check if response contains the expected structure
-        if "chapters" not in response_text:
-            print("Warning: Response doesn't contain 'chapters' keyword")
+        def generate(request_prompt):
+            def attempt(timeout):
+                with llm_call("chapters") as call:
+                    response = model.generate_content(request_prompt, generation_config=generation_config,
+                                                      request_options={"timeout": timeout})
+                    call["usage"] = getattr(response, "usage_metadata", None)
+                return response.text
+            return call_llm("chapters", attempt)
         
-        # Try to extract JSON from the response
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group()
-            print(f"Extracted JSON string: {json_str}")
-            result = json.loads(json_str)
-            print(f"Successfully parsed JSON: {result}")
-            return result
-        else:
-            # If no JSON found, try to parse the entire response
-            print("No JSON pattern found, trying to parse entire response...")
-            result = json.loads(response_text)
-            print(f"Parsed entire response: {result}")
-            return result
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
-        print(f"Response text was: {response_text}")
+        result = generate_structured(generate, prompt, schema, call_site="chapters")
+        logger.debug("Parsed chapters: %s", result)
+        return result
+    except StructuredOutputError as e:
+        logger.warning("Could not get valid chapters JSON: %s", e)
+        logger.debug("Response text was: %s", e.text)
+        return {"chapters": []}
+    except LLMUnavailableError as e:
+        logger.warning("Gemini unavailable for chapters: %s", e)
         return {"chapters": []}
     except Exception as e:
-        print(f"Error calling Gemini API: {e}")
-        print(f"Exception type: {type(e).__name__}")
+        logger.exception("Error calling Gemini API for chapters")
         return {"chapters": []}
 
 def merge_chapter_results(all_chapters: List[Dict[str, Any]], segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -285,6 +417,68 @@ def ensure_full_coverage(chapters: List[Dict[str, Any]], segments: List[Dict[str
     
     return chapters
 
+def _chapter_title(counts: collections.Counter, df: collections.Counter, n_chapters: int, index: int) -> str:
+    """Name a chapter after its two most distinctive words (TF-IDF against the other chapters)."""
+    scored = sorted(
+        ((tf * math.log((1 + n_chapters) / (1 + df[word])), word) for word, tf in counts.items() if len(word) > 3),
+        reverse=True
+    )
+    words = [word for score, word in scored[:2] if score > 0]
+    return " ".join(words).title() if words else f"Part {index + 1}"
+
+def local_chapters(segments: List[Dict[str, Any]], max_chapters: int = 12,
+                   chapter_seconds: float = LOCAL_CHAPTER_SECONDS) -> List[Dict[str, Any]]:
+    """
+    Split a transcript into chapters without Gemini, as a degraded fallback.
+    
+    Chapters break at the largest topic shifts between neighbouring segments
+    (by local TF-IDF distance, as in the semantic chunker), keeping chapters
+    at least half the average length apart, and are named after their most
+    distinctive words.
+    
+    Args:
+        segments: List of transcript segments
+        max_chapters: Maximum number of chapters to generate
+        chapter_seconds: Target average chapter length
+        
+    Returns:
+        List of chapter dictionaries with chapter_name, start_time, end_time
+    """
+    if not segments:
+        return []
+    
+    duration = segments[-1]["end"] - segments[0]["start"]
+    count = max(1, min(max_chapters, math.ceil(duration / chapter_seconds), len(segments)))
+    
+    # Greedily take the biggest topic shifts that are not too close to one already taken
+    distances = adjacent_cosine_distances(combine_sentences([seg["text"] for seg in segments]))
+    min_gap = max(1, len(segments) // (2 * count))
+    breaks = []
+    for i in distances.argsort()[::-1].tolist():
+        if len(breaks) == count - 1:
+            break
+        if min_gap <= i + 1 <= len(segments) - min_gap and all(abs(i - b) >= min_gap for b in breaks):
+            breaks.append(i)
+    breaks.sort()
+    
+    groups = []
+    start_idx = 0
+    for end_idx in breaks + [len(segments) - 1]:
+        groups.append(segments[start_idx:end_idx + 1])
+        start_idx = end_idx + 1
+    
+    counts = [collections.Counter(TOKEN_REGEX.findall(" ".join(seg["text"] for seg in group).lower())) for group in groups]
+    df = collections.Counter(word for c in counts for word in c)
+    chapters = [
+        {
+            "chapter_name": _chapter_title(c, df, len(groups), i),
+            "start_time": group[0]["start"],
+            "end_time": groups[i + 1][0]["start"] if i + 1 < len(groups) else group[-1]["end"]
+        }
+        for i, (group, c) in enumerate(zip(groups, counts))
+    ]
+    return chapters
+
 def save_chapters_to_file(chapters: List[Dict[str, Any]], output_path: str) -> None:
     """
     Save chapters to a JSON file.
@@ -301,47 +495,70 @@ def save_chapters_to_file(chapters: List[Dict[str, Any]], output_path: str) -> N
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(output_data, f, indent=2, ensure_ascii=False)
     
-    print(f"Chapters saved to {output_path}")
-    print(f"Generated {len(chapters)} chapters:")
+    logger.info("Saved %d chapters to %s", len(chapters), output_path)
     for i, chapter in enumerate(chapters, 1):
-        print(f"  {i}. {chapter['chapter_name']} ({chapter['start_time']:.2f}s - {chapter['end_time']:.2f}s)")
+        logger.debug("  %d. %s (%.2fs - %.2fs)", i, chapter['chapter_name'], chapter['start_time'], chapter['end_time'])
 
-def generate_chapters(segments: List[Dict[str, Any]], max_chapters: int = 12) -> List[Dict[str, Any]]:
+def generate_chapters(segments: List[Dict[str, Any]], max_chapters: int = 12,
+                      block_seconds: Optional[float] = None, numbered: Optional[bool] = None) -> List[Dict[str, Any]]:
     """
     Generate chapters from transcript segments using Gemini API.
     
     Args:
         segments: List of transcript segments
         max_chapters: Maximum number of chapters to generate
+        block_seconds: Coalesce segments into blocks of this many seconds in the
+                       prompt (0 = one line per segment). Defaults to CHAPTER_BLOCK_SECONDS.
+        numbered: Label blocks with numbers rather than start times.
+                  Defaults to CHAPTER_NUMBERED_BLOCKS.
         
     Returns:
         List of chapter dictionaries with chapter_name, start_time, end_time
     """
+    if block_seconds is None:
+        block_seconds = CHAPTER_BLOCK_SECONDS
+    if numbered is None:
+        numbered = CHAPTER_NUMBERED_BLOCKS
+    if not segments:
+        return []
+    
     # Create transcript text from all segments
-    print("Creating transcript text from segments...")
-    transcript_text = create_transcript_text(segments)
-    print(f"Created transcript text of length: {len(transcript_text)}")
+    blocks = None
+    if block_seconds > 0:
+        transcript_text, blocks = encode_transcript_blocks(segments, block_seconds, numbered)
+        prompt_format = "blocks" if numbered else "block_times"
+    else:
+        transcript_text = create_transcript_text(segments)
+        prompt_format = "segments"
     
     # Process the entire transcript with Gemini API
-    print(f"Processing transcript with Gemini API (max {max_chapters} chapters)...")
-    chapters_response = call_gemini_for_chapters(transcript_text, max_chapters)
-    print(f"Received chapters: {chapters_response}")
+    chapters_response = call_gemini_for_chapters(transcript_text, max_chapters, prompt_format=prompt_format)
     
     # Extract chapters from the response
     final_chapters = []
     if chapters_response.get("chapters"):
-        print(f"Found {len(chapters_response['chapters'])} chapters")
+        logger.info("Found %d chapters", len(chapters_response["chapters"]))
         final_chapters = chapters_response["chapters"]
-        # Ensure chapters cover the entire video
-        final_chapters = ensure_full_coverage(final_chapters, segments)
-        # Align timestamps with segment boundaries
-        for chapter in final_chapters:
-            chapter["start_time"] = align_time_to_segment(chapter["start_time"], segments)
-            chapter["end_time"] = align_time_to_segment(chapter["end_time"], segments)
-    else:
-        print("No chapters found in the response")
-    
-    print(f"Final chapters after processing: {final_chapters}")
+        if blocks is not None:
+            # Block boundaries map exactly onto segment boundaries
+            final_chapters = decode_block_chapters(final_chapters, blocks, numbered)
+            final_chapters.sort(key=lambda x: x["start_time"])
+            final_chapters = ensure_full_coverage(final_chapters, segments)
+        else:
+            # Ensure chapters cover the entire video
+            final_chapters = ensure_full_coverage(final_chapters, segments)
+            # Align timestamps with segment boundaries
+            for chapter in final_chapters:
+                chapter["start_time"] = align_time_to_segment(chapter["start_time"], segments)
+                chapter["end_time"] = align_time_to_segment(chapter["end_time"], segments)
+    
+    # Also when no chapter in the response fit the transcript's blocks
+    if not final_chapters:
+        logger.warning("No usable chapters in the response, splitting the transcript locally")
+        final_chapters = local_chapters(segments, max_chapters)
+        record_fallback("chapters", "error")
+    
+    logger.debug("Final chapters after processing: %s", final_chapters)
     return final_chapters
 
 def main():
@@ -350,6 +567,8 @@ def main():
     """
     import sys
     
+    configure_logging()
+    
     # Default input and output paths
     default_input = "data/transcripts/transcription_segments.json"
     default_output = "data/chapters.json"
@@ -0,0 +1,352 @@
+"""
+Audio fingerprints, to recognise a lecture that was uploaded before as a
+different file (re-encoded, another bitrate, a trimmed intro or outro).
+
+A fingerprint is a set of hashes of pairs of spectral peaks ("landmarks")
+of the decoded 16 kHz audio, each with the time of its first peak. Peak
+frequencies and the time between them survive re-encoding, so two copies of
+the same recording share most hashes, and for the shared hashes the
+difference between their times is the copies' time offset.
+
+Fingerprints of cached lectures are kept in a SQLite index. find_match()
+looks up an upload's hashes, votes on (lecture, offset) pairs and reports
+which parts of the upload matched, so their cached transcript segments can
+be reused with shifted timestamps (see plan_reuse).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_INDEX_PATH = os.getenv('FINGERPRINT_INDEX_PATH', 'data/fingerprints/index.db')
+
+SAMPLE_RATE = 16000
+N_FFT = 1024
+HOP = 512
+FRAMES_PER_SECOND = SAMPLE_RATE / HOP
+# Spectrogram frames computed at once, to bound memory on long lectures
+BLOCK_FRAMES = 4096
+# Frequency bands (in FFT bins of 15.6 Hz, about 300 Hz - 4 kHz) each
+# contributing at most one peak per frame
+BANDS = [(20, 40), (40, 64), (64, 100), (100, 160), (160, 256)]
+# A band maximum is a peak if it is the largest within this many frames either side
+PEAK_NEIGHBOURHOOD = 15
+# Each peak is paired with this many following peaks...
+FAN_OUT = 4
+# ...at most this many frames (about 2 s) later
+MAX_PAIR_FRAMES = 63
+
+# A match needs this many hashes agreeing on one offset...
+MIN_MATCH_HASHES = 50
+# ...covering at least this fraction of the upload
+MIN_MATCH_COVERAGE = 0.2
+# Aligned hashes further apart than this start a new matched interval
+MAX_GAP_SECONDS = 10.0
+# Matched intervals shorter than this are ignored
+MIN_INTERVAL_SECONDS = 3.0
+# Unmatched regions shorter than this are not transcribed
+MIN_REGION_SECONDS = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lectures (
+    id INTEGER PRIMARY KEY,
+    cache_key TEXT NOT NULL UNIQUE,
+    duration REAL NOT NULL,
+    hash_count INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    hash INTEGER NOT NULL,
+    lecture INTEGER NOT NULL,
+    t INTEGER NOT NULL,
+    PRIMARY KEY (hash, lecture, t)
+) WITHOUT ROWID;
+"""
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+class Fingerprint(NamedTuple):
+    hashes: np.ndarray    # uint32 landmark hashes
+    times: np.ndarray     # int32 frame of each hash's anchor peak
+    duration: float       # seconds of audio
+
+
+class AudioMatch(NamedTuple):
+    cache_key: str
+    offset: float                          # cached time = upload time + offset
+    intervals: List[Tuple[float, float]]   # matched parts of the upload, in upload seconds
+    votes: int                             # hashes agreeing on the offset
+    coverage: float                        # fraction of the upload matched
+
+
+def spectral_peaks(audio: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the spectral peaks of 16 kHz mono audio.
+
+    Args:
+        audio: float32 samples
+
+    Returns:
+        Tuple of (frame, FFT bin) arrays of the peaks, ordered by frame
+    """
+    n_frames = 1 + (len(audio) - N_FFT) // HOP if len(audio) >= N_FFT else 0
+    band_max = np.empty((n_frames, len(BANDS)), dtype=np.float32)
+    band_bin = np.empty((n_frames, len(BANDS)), dtype=np.int32)
+    window = np.hanning(N_FFT).astype(np.float32)
+
+    for first in range(0, n_frames, BLOCK_FRAMES):
+        last = min(first + BLOCK_FRAMES, n_frames)
+        samples = audio[first * HOP:(last - 1) * HOP + N_FFT]
+        frames = sliding_window_view(samples, N_FFT)[::HOP]
+        spectrum = np.log1p(np.abs(np.fft.rfft(frames * window, axis=1)[:, :BANDS[-1][1]]))
+        rows = np.arange(last - first)
+        for b, (lo, hi) in enumerate(BANDS):
+            arg = spectrum[:, lo:hi].argmax(axis=1)
+            band_bin[first:last, b] = lo + arg
+            band_max[first:last, b] = spectrum[rows, lo + arg]
+
+    if n_frames == 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+    # Keep band maxima that dominate their time neighbourhood and rise above
+    # the band's typical level (which drops silence and steady noise)
+    padded = np.pad(band_max, ((PEAK_NEIGHBOURHOOD, PEAK_NEIGHBOURHOOD), (0, 0)), constant_values=-np.inf)
+    neighbourhood_max = sliding_window_view(padded, 2 * PEAK_NEIGHBOURHOOD + 1, axis=0).max(axis=-1)
+    is_peak = (band_max == neighbourhood_max) & (band_max > np.median(band_max, axis=0))
+    frames, bands = np.nonzero(is_peak)
+    return frames.astype(np.int32), band_bin[frames, bands]
+
+
+def fingerprint_audio(audio: np.ndarray) -> Fingerprint:
+    """
+    Fingerprint 16 kHz mono audio.
+
+    Each peak is paired with the next FAN_OUT peaks; a pair's hash packs both
+    frequencies and the frames between them (9 + 9 + 6 bits).
+
+    Args:
+        audio: float32 samples, e.g. from video2transcript.load_audio
+
+    Returns:
+        Fingerprint of the audio
+    """
+    frames, bins = spectral_peaks(audio)
+    hashes = []
+    times = []
+    for k in range(1, FAN_OUT + 1):
+        dt = frames[k:] - frames[:-k]
+        valid = dt <= MAX_PAIR_FRAMES
+        anchors = np.flatnonzero(valid)
+        hashes.append((bins[anchors].astype(np.uint32) << 15) | (bins[anchors + k].astype(np.uint32) << 6) | dt[valid].astype(np.uint32))
+        times.append(frames[anchors])
+    return Fingerprint(
+        hashes=np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint32),
+        times=np.concatenate(times) if times else np.empty(0, dtype=np.int32),
+        duration=len(audio) / SAMPLE_RATE
+    )
+
+
+def join_fingerprints(parts: List[Fingerprint]) -> Fingerprint:
+    """
+    Fingerprint of consecutive pieces of audio, e.g. windows transcribed
+    while an upload arrived, from the pieces' fingerprints. Only pairs of
+    peaks that straddle a boundary between pieces are missing.
+    """
+    offsets = np.cumsum([0.0] + [part.duration for part in parts[:-1]])
+    return Fingerprint(
+        hashes=np.concatenate([part.hashes for part in parts] or [np.empty(0, dtype=np.uint32)]),
+        times=np.concatenate([part.times + int(round(offset * FRAMES_PER_SECOND))
+                              for part, offset in zip(parts, offsets)] or [np.empty(0, dtype=np.int32)]),
+        duration=sum(part.duration for part in parts)
+    )
+
+
+def _matched_intervals(seconds: np.ndarray) -> List[Tuple[float, float]]:
+    """Group sorted times of aligned hashes into intervals of continuous matching."""
+    intervals = []
+    if len(seconds) == 0:
+        return intervals
+    pair_seconds = MAX_PAIR_FRAMES / FRAMES_PER_SECOND
+    breaks = np.flatnonzero(np.diff(seconds) > MAX_GAP_SECONDS)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(seconds) - 1]])
+    for s, e in zip(starts, ends):
+        start, end = float(seconds[s]), float(seconds[e]) + pair_seconds
+        if end - start >= MIN_INTERVAL_SECONDS:
+            intervals.append((start, end))
+    return intervals
+
+
+class FingerprintIndex:
+    """
+    Fingerprints of cached lectures in a local SQLite database (WAL mode),
+    shared by all worker processes on the same host.
+    """
+
+    def __init__(self, path: str = FINGERPRINT_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS query_hashes (hash INTEGER NOT NULL, t INTEGER NOT NULL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, cache_key: str, fingerprint: Fingerprint) -> None:
+        """Index a cached lecture's fingerprint, replacing any earlier one."""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT id FROM lectures WHERE cache_key = ?', (cache_key,)).fetchone()
+            if row:
+                conn.execute('DELETE FROM fingerprints WHERE lecture = ?', (row[0],))
+                conn.execute('DELETE FROM lectures WHERE id = ?', (row[0],))
+            lecture = conn.execute(
+                'INSERT INTO lectures (cache_key, duration, hash_count, indexed_at) VALUES (?, ?, ?, ?)',
+                (cache_key, fingerprint.duration, len(fingerprint.hashes), time.time())
+            ).lastrowid
+            conn.executemany(
+                'INSERT OR IGNORE INTO fingerprints (hash, lecture, t) VALUES (?, ?, ?)',
+                zip(fingerprint.hashes.tolist(), [lecture] * len(fingerprint.hashes), fingerprint.times.tolist())
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def find_match(self, fingerprint: Fingerprint, exclude: Optional[str] = None) -> Optional[AudioMatch]:
+        """
+        Find the indexed lecture that an upload is a copy (or partial copy) of.
+
+        Args:
+            fingerprint: Fingerprint of the upload
+            exclude: Cache key to ignore, e.g. the upload's own
+
+        Returns:
+            The best match, or None if no lecture shares enough aligned audio
+        """
+        if len(fingerprint.hashes) == 0:
+            return None
+
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            conn.execute('DELETE FROM query_hashes')
+            conn.executemany('INSERT INTO query_hashes (hash, t) VALUES (?, ?)',
+                             zip(fingerprint.hashes.tolist(), fingerprint.times.tolist()))
+            rows = conn.execute(
+                """
+                SELECT f.lecture, f.t - q.t, q.t
+                FROM query_hashes q JOIN fingerprints f ON f.hash = q.hash
+                """
+            ).fetchall()
+            lectures = dict(conn.execute('SELECT id, cache_key FROM lectures').fetchall())
+        finally:
+            conn.execute('ROLLBACK')
+
+        if not rows:
+            return None
+        matches = np.asarray(rows, dtype=np.int64)
+
+        # Vote for (lecture, offset) pairs; neighbouring offsets share votes
+        # since re-encoding can shift peaks by a frame
+        best = None
+        for lecture in np.unique(matches[:, 0]):
+            if lectures.get(int(lecture)) in (None, exclude):
+                continue
+            offsets = matches[matches[:, 0] == lecture, 1]
+            shift = offsets.min()
+            counts = np.bincount(offsets - shift)
+            smoothed = np.convolve(counts, np.ones(3, dtype=np.int64), mode='same')
+            offset = int(smoothed.argmax() + shift)
+            votes = int(smoothed.max())
+            if best is None or votes > best[2]:
+                best = (int(lecture), offset, votes)
+
+        if best is None or best[2] < MIN_MATCH_HASHES:
+            return None
+        lecture, offset, votes = best
+
+        aligned = matches[(matches[:, 0] == lecture) & (np.abs(matches[:, 1] - offset) <= 1), 2]
+        intervals = _matched_intervals(np.sort(aligned) / FRAMES_PER_SECOND)
+        coverage = sum(end - start for start, end in intervals) / max(fingerprint.duration, 1e-9)
+        if coverage < MIN_MATCH_COVERAGE:
+            return None
+        return AudioMatch(lectures[lecture], offset / FRAMES_PER_SECOND, intervals, votes, min(coverage, 1.0))
+
+
+def get_fingerprint_index() -> FingerprintIndex:
+    """Get the process-wide fingerprint index, creating it on first use."""
+    global _default_index
+    if _default_index is None:
+        with _default_index_lock:
+            if _default_index is None:
+                _default_index = FingerprintIndex()
+    return _default_index
+
+
+def plan_reuse(cached_segments: List[Dict[str, Any]], match: AudioMatch,
+               duration: float) -> Tuple[List[Dict[str, Any]], List[Tuple[float, float]]]:
+    """
+    Work out which cached segments an upload can reuse and what is left to transcribe.
+
+    Args:
+        cached_segments: Transcript segments of the matched lecture
+        match: Result of find_match
+        duration: Length of the upload in seconds
+
+    Returns:
+        Tuple of (cached segments lying inside matched intervals, with
+        timestamps shifted to the upload's timeline; (start, end) regions of
+        the upload to transcribe)
+    """
+    tolerance = 1 / FRAMES_PER_SECOND + 0.5
+    shifted = [
+        dict(seg, start=round(seg["start"] - match.offset, 2), end=round(seg["end"] - match.offset, 2))
+        for seg in cached_segments
+    ]
+
+    def inside(seg):
+        return any(seg["start"] >= start - tolerance and seg["end"] <= end + tolerance for start, end in match.intervals)
+
+    # Everything outside the matched intervals, widened to cover cached
+    # segments that straddle an interval edge (those are transcribed afresh)
+    regions = []
+    cursor = 0.0
+    for start, end in match.intervals + [(duration, duration)]:
+        if start > cursor:
+            regions.append([cursor, start])
+        cursor = max(cursor, end)
+    kept = [inside(seg) for seg in shifted]
+    for seg, is_kept in zip(shifted, kept):
+        if is_kept or seg["end"] <= 0 or seg["start"] >= duration:
+            continue
+        for region in regions:
+            if seg["start"] < region[1] and seg["end"] > region[0]:
+                region[0] = max(0.0, min(region[0], seg["start"]))
+                region[1] = min(duration, max(region[1], seg["end"]))
+
+    reused = [
+        seg for seg, is_kept in zip(shifted, kept)
+        if is_kept and not any(seg["start"] < r[1] and seg["end"] > r[0] for r in regions)
+    ]
+    regions = [(round(s, 2), round(e, 2)) for s, e in regions if e - s >= MIN_REGION_SECONDS]
+    return reused, regions
@@ -0,0 +1,36 @@
+"""
+Gunicorn configuration for the multi-process serving mode.
+
+Each worker is a separate process with its own Whisper/Gemini clients, so
+transcription and request handling scale with cores. Chat histories and job
+status are shared through the state store (STATE_BACKEND, SQLite by default),
+so any worker can serve any session.
+
+Usage (from the backend directory):
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+
+# Whisper transcription is CPU-bound, so one worker per core
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Threads let a worker keep answering chat/health requests while one of its
+# threads is busy with a long upload
+worker_class = 'gthread'
+threads = int(os.getenv('WORKER_THREADS', 4))
+
+# Uploads run the whole pipeline in the request, which can take many minutes
+timeout = int(os.getenv('WORKER_TIMEOUT', 1800))
+graceful_timeout = 30
+
+# Video playback (/api/videos/<id>/stream) hands files to the server, which
+# sends them, or the requested byte range, with sendfile() (zero-copy)
+sendfile = True
+
+# Don't preload: torch and the Gemini client are not fork-safe
+preload_app = False
+
+accesslog = '-'
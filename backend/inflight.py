@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to per-process locking only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Used only when fcntl is unavailable
+_local_locks = {}
+_local_owners = {}
+_local_locks_guard = threading.Lock()
+
+
+@contextmanager
+def single_flight(key: str, owner_id: str, lock_dir: str = 'data/cache/inflight',
+                  on_wait: Optional[Callable[[str], None]] = None) -> Iterator[Optional[str]]:
+    """
+    Ensure only one pipeline runs at a time for a given content key.
+
+    The first caller takes an exclusive lock on <lock_dir>/<key>.lock and
+    records its owner_id in it. Callers arriving while the lock is held
+    (from any thread or worker process) block until the leader finishes, then
+    re-enter the block so they can pick up the leader's cached result.
+
+    Args:
+        key: Content hash identifying the work
+        owner_id: Identifier of this caller's job (e.g. the video_id)
+        lock_dir: Directory holding the lock files
+        on_wait: Called with the leader's owner_id before waiting for it,
+            e.g. to stop work the leader is already doing
+
+    Yields:
+        None if this caller is the leader, otherwise the owner_id of the
+        job it waited on.
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(key, threading.Lock())
+        leader_id = None
+        if not lock.acquire(blocking=False):
+            leader_id = _local_owners.get(key, 'unknown')
+            if on_wait is not None:
+                on_wait(leader_id)
+            lock.acquire()
+        _local_owners[key] = owner_id
+        try:
+            yield leader_id
+        finally:
+            lock.release()
+        return
+
+    # Lock files are never unlinked: removing one while another worker waits
+    # on it would let a third arrival lock a fresh inode and run in parallel.
+    fd = os.open(os.path.join(lock_dir, f"{key}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        leader_id = None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            leader_id = _read_owner(fd)
+            logger.info("Upload %s attached to in-flight job %s", owner_id, leader_id)
+            if on_wait is not None:
+                on_wait(leader_id)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+        # If the leader failed without caching anything, this caller now
+        # owns the work, so later arrivals should attach to it instead
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, owner_id.encode(), 0)
+
+        try:
+            yield leader_id
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def try_claim(key: str, owner_id: str, lock_dir: str = 'data/cache/inflight') -> Optional[Callable[[], None]]:
+    """
+    Take the lock single_flight() would take for a key, without waiting.
+
+    Args:
+        key: Identifies the work
+        owner_id: Identifier of this caller's job
+        lock_dir: Directory holding the lock files
+
+    Returns:
+        A function that releases the lock, or None if another caller holds it
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(key, threading.Lock())
+        if not lock.acquire(blocking=False):
+            return None
+        _local_owners[key] = owner_id
+        return lock.release
+
+    fd = os.open(os.path.join(lock_dir, f"{key}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logger.info("%s is already claimed by %s", key, _read_owner(fd))
+        os.close(fd)
+        return None
+    os.ftruncate(fd, 0)
+    os.pwrite(fd, owner_id.encode(), 0)
+
+    def release():
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+    return release
+
+
+def _read_owner(fd: int) -> str:
+    """Read the owner_id the current lock holder wrote into the lock file."""
+    try:
+        return os.pread(fd, 256, 0).decode() or 'unknown'
+    except OSError:
+        return 'unknown'
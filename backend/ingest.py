@@ -0,0 +1,438 @@
+"""
+Pipelined ingest: transcribe an upload while it is still arriving.
+
+Normally a video is transcribed only after the whole upload has been saved,
+so upload time and transcription time add up. With PIPELINED_INGEST on, the
+upload form parser writes the video into a PipelinedIngest instead of a
+temporary file. PipelinedIngest tees each chunk:
+
+- to the video file on disk,
+- into a SHA-256 of the content,
+- into an ffmpeg process that decodes the audio to 16 kHz PCM as it arrives.
+
+A background thread transcribes the decoded audio in windows of about
+INGEST_WINDOW_SECONDS, each cut in a pause where there is one, and drops
+each window's audio once it is transcribed. Decoded audio beyond
+INGEST_MAX_BUFFERED_SECONDS (e.g. while the upload waits for its slot)
+spills to a temporary file next to the video instead of staying in memory.
+Before the first window the upload joins the transcription queue as one
+job, costed at the duration ffprobe reads from the start of the file, and
+it keeps its slot until the last window is done. When the upload completes
+only the last window is left to transcribe.
+
+Each window is fingerprinted first. If its audio matches a cached lecture,
+or another upload with the same first bytes is already being transcribed,
+transcription stops and the normal pipeline takes over once the upload is
+saved, reusing the cached transcript or the other upload's result. So does
+a failure to transcribe a window.
+
+ffmpeg can only decode containers whose index comes first (e.g. MP4s written
+with +faststart, MKV). For anything else the decoder fails and the upload is
+transcribed from the saved file as usual.
+"""
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from flask import Request
+
+import metrics
+from fingerprint import Fingerprint, fingerprint_audio, get_fingerprint_index, join_fingerprints
+from inflight import try_claim
+from transcription_queue import FALLBACK_BYTES_PER_SECOND, SlotCancelled, get_transcription_scheduler, probe_duration
+from vad import speech_regions
+from video2transcript import SAMPLE_RATE, transcribe_regions
+
+logger = logging.getLogger(__name__)
+
+PIPELINED_INGEST = os.getenv('PIPELINED_INGEST', '1') != '0'
+# Seconds of decoded audio transcribed at a time while the upload arrives
+INGEST_WINDOW_SECONDS = float(os.getenv('INGEST_WINDOW_SECONDS', '300'))
+# Seconds of decoded audio held in memory per upload; the rest waits on disk
+INGEST_MAX_BUFFERED_SECONDS = float(os.getenv('INGEST_MAX_BUFFERED_SECONDS', '600'))
+
+# 16-bit mono PCM
+BYTES_PER_SECOND = 2 * SAMPLE_RATE
+READ_BYTES = 64 * 1024
+# Uploads that start with the same bytes are transcribed while arriving one at a time
+PREFIX_BYTES = 1024 * 1024
+
+INGEST_UPLOADS = metrics.counter(
+    "ingest_uploads_total",
+    "Uploads transcribed while arriving (pipelined) or from the saved file after the decoder failed (fallback)",
+    ["mode"]
+)
+INGEST_TRANSCRIBED_SECONDS = metrics.counter(
+    "ingest_transcribed_audio_seconds_total",
+    "Seconds of audio of pipelined uploads transcribed before or after the upload completed",
+    ["phase"]
+)
+
+
+def start_decoder() -> subprocess.Popen:
+    """Start ffmpeg decoding a video from stdin to 16 kHz mono 16-bit PCM on stdout."""
+    return subprocess.Popen(
+        ['ffmpeg', '-nostats', '-loglevel', 'error', '-threads', '0', '-i', 'pipe:0',
+         '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(SAMPLE_RATE), 'pipe:1'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+
+
+def _cut_point(audio: np.ndarray) -> float:
+    """Where to end a window of audio: in its last pause past the middle, else at its end."""
+    length = len(audio) / SAMPLE_RATE
+    regions = speech_regions(audio)
+    pauses = [(end + next_start) / 2 for (_, end), (next_start, _) in zip(regions, regions[1:])]
+    if regions and regions[-1][1] < length:
+        pauses.append((regions[-1][1] + length) / 2)
+    pauses = [t for t in pauses if t >= length / 2]
+    return pauses[-1] if pauses else length
+
+
+class PipelinedIngest:
+    """
+    Writable file for an upload that saves, hashes, decodes and transcribes
+    the video as it arrives.
+
+    Args:
+        video_path: Where to save the video
+        job_id: Upload job ID, also its transcription queue job ID
+        client: Who is uploading, for transcription queue fairness
+        size: Size of the upload in bytes if known, to estimate its duration
+            when ffprobe cannot
+        on_status: Called with the job's new status and fields to record
+            ('queued' with duration, then 'processing' with
+            queue_wait_seconds), e.g. app.update_job for this job
+    """
+
+    def __init__(self, video_path: str, job_id: str, client: str, size: Optional[int] = None,
+                 on_status: Optional[Callable[..., None]] = None):
+        self.video_path = video_path
+        self.job_id = job_id
+        self.client = client
+        self.size = size
+        self.on_status = on_status
+        self.window_seconds = INGEST_WINDOW_SECONDS
+        self.status = 'processing'
+        # Seconds the upload waited for its transcription slot
+        self.queue_wait: Optional[float] = None
+        self._file = open(video_path, 'w+b')
+        self._hash = hashlib.sha256()
+        self._prefix_hash = hashlib.sha256()
+        self._prefix_bytes = 0
+        # Hex digest of the first PREFIX_BYTES, set once they have arrived
+        self._prefix_digest: Optional[str] = None
+
+        self._cond = threading.Condition()
+        # Decoded audio that is not transcribed yet: the start in memory, the
+        # rest (past INGEST_MAX_BUFFERED_SECONDS) in _spill from _spill_read on
+        self._pcm = bytearray()
+        self._spill = None
+        self._spill_read = 0
+        self._spill_written = 0
+        self._decoded_bytes = 0
+        # Cleared when transcription stops; later audio is decoded but dropped
+        self._buffering = True
+        self._decoded = False
+        self._decode_failed = False
+        self._aborted = False
+        # Why the upload must be transcribed from the saved file instead
+        self._fallback: Optional[str] = None
+        self._segments: List[Dict[str, Any]] = []
+        self._fingerprints: List[Fingerprint] = []
+        self._transcribed_until = 0.0
+        self._uploaded_transcribed = 0.0
+        self._started_at: Optional[float] = None
+
+        try:
+            self._decoder = start_decoder()
+        except OSError as e:
+            logger.warning("Cannot decode %s while it uploads: %s", job_id, e)
+            self._decoder = None
+            self._decode_failed = self._decoded = True
+            self._threads = []
+            return
+        self._threads = [
+            threading.Thread(target=self._read_decoder, name=f"ingest-decode-{job_id}", daemon=True),
+            threading.Thread(target=self._transcribe_windows, name=f"ingest-transcribe-{job_id}", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # File interface used by the form parser
+
+    def write(self, data: bytes) -> int:
+        self._file.write(data)
+        self._hash.update(data)
+        if self._prefix_digest is None:
+            self._prefix_hash.update(data[:PREFIX_BYTES - self._prefix_bytes])
+            self._prefix_bytes += len(data)
+            if self._prefix_bytes >= PREFIX_BYTES:
+                self._publish_prefix()
+        if not self._decode_failed:
+            try:
+                self._decoder.stdin.write(data)
+            except (BrokenPipeError, ValueError, OSError):
+                # ffmpeg gave up (e.g. the container index is at the end);
+                # keep saving the upload, it will be transcribed from disk
+                self._decode_failed = True
+        return len(data)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._file.readline(size)
+
+    def close(self) -> None:
+        self.abort()
+        self._file.close()
+
+    # Decoding and transcription
+
+    def _publish_prefix(self) -> None:
+        with self._cond:
+            self._prefix_digest = self._prefix_hash.hexdigest()
+            self._cond.notify_all()
+
+    def _read_decoder(self) -> None:
+        for chunk in iter(lambda: self._decoder.stdout.read(READ_BYTES), b''):
+            with self._cond:
+                if self._buffering:
+                    self._buffer(chunk)
+                self._decoded_bytes += len(chunk)
+                self._cond.notify_all()
+        returncode = self._decoder.wait()
+        with self._cond:
+            self._decoded = True
+            self._decode_failed |= returncode != 0
+            self._cond.notify_all()
+
+    def _buffer(self, chunk: bytes) -> None:
+        """Keep decoded audio in memory, or on disk once INGEST_MAX_BUFFERED_SECONDS are held."""
+        if self._spill is None and len(self._pcm) + len(chunk) <= INGEST_MAX_BUFFERED_SECONDS * BYTES_PER_SECOND:
+            self._pcm += chunk
+            return
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(dir=os.path.dirname(self.video_path) or None)
+            self._spill_read = self._spill_written = 0
+        os.pwrite(self._spill.fileno(), chunk, self._spill_written)
+        self._spill_written += len(chunk)
+
+    def _buffered(self) -> int:
+        """Bytes of decoded audio not transcribed yet, in memory and on disk."""
+        return len(self._pcm) + self._spill_written - self._spill_read
+
+    def _window(self, seconds: Optional[float] = None) -> np.ndarray:
+        """The first seconds (or all) of the untranscribed audio as float32 samples."""
+        end = self._buffered() if seconds is None else int(seconds * SAMPLE_RATE) * 2
+        # Move spilled audio back into memory up to the end of the window
+        if self._spill is not None and end > len(self._pcm):
+            data = os.pread(self._spill.fileno(), end - len(self._pcm), self._spill_read)
+            self._pcm += data
+            self._spill_read += len(data)
+            if self._spill_read >= self._spill_written:
+                self._close_spill()
+        end = min(end, len(self._pcm))
+        end -= end % 2
+        return np.frombuffer(self._pcm[:end], np.int16).astype(np.float32) / 32768.0
+
+    def _close_spill(self) -> None:
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def _set_status(self, status: str, **fields: Any) -> None:
+        self.status = status
+        if self.on_status is not None:
+            self.on_status(status, **fields)
+
+    def _claim(self, stack: ExitStack) -> bool:
+        """
+        Make sure no other upload with the same first bytes (most likely the
+        same video) is being transcribed while it arrives, or only one of
+        them would be needed: the other waits for its result in
+        inflight.single_flight once both are uploaded.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._aborted or self._prefix_digest is not None)
+            if self._aborted:
+                return False
+        release = try_claim(f"ingest-{self._prefix_digest}", self.job_id)
+        if release is None:
+            self._fallback = "an identical upload is already being transcribed"
+            return False
+        stack.callback(release)
+        return True
+
+    def _matches_cached(self, fingerprint: Fingerprint) -> bool:
+        """
+        Whether audio of the upload matches a cached lecture, whose
+        transcript the normal pipeline reuses instead of running Whisper.
+        """
+        try:
+            match = get_fingerprint_index().find_match(fingerprint)
+        except Exception:
+            logger.exception("Error searching the audio fingerprint index")
+            return False
+        if match is None:
+            return False
+        self._fallback = f"its audio matches cached lecture {match.cache_key}"
+        return True
+
+    def _wait_for_slot(self, stack: ExitStack) -> None:
+        """Queue the whole upload as one transcription job, costed at its full duration."""
+        # A streamable container's index (and duration) is at the start of
+        # the file, which is already on disk
+        self._file.flush()
+        duration = probe_duration(self.video_path)
+        if duration is None:
+            duration = (self.size or os.path.getsize(self.video_path)) / FALLBACK_BYTES_PER_SECOND
+        self._set_status('queued', duration=round(duration, 2))
+        self.queue_wait = stack.enter_context(get_transcription_scheduler().slot(
+            self.job_id, self.client, duration, cancelled=lambda: self._aborted
+        ))
+        self._started_at = time.time()
+        self._set_status('processing', queue_wait_seconds=round(self.queue_wait, 2))
+
+    def _transcribe_windows(self) -> None:
+        cursor = 0.0
+        try:
+            with ExitStack() as stack:
+                while True:
+                    with self._cond:
+                        self._cond.wait_for(lambda: self._aborted or self._decoded or
+                                            self._buffered() >= self.window_seconds * BYTES_PER_SECOND)
+                        if self._aborted or self._decode_failed:
+                            return
+                        # Once decoding is done, the rest is still taken a window at a time
+                        done = self._decoded and self._buffered() <= self.window_seconds * BYTES_PER_SECOND
+                        audio = self._window(None if done else self.window_seconds)
+
+                    samples = len(audio) if done else int(_cut_point(audio) * SAMPLE_RATE)
+                    audio = audio[:samples]
+                    if samples:
+                        if self._started_at is None and not self._claim(stack):
+                            return
+                        fingerprint = fingerprint_audio(audio)
+                        if self._matches_cached(fingerprint):
+                            return
+                        self._fingerprints.append(fingerprint)
+                        if self._started_at is None:
+                            self._wait_for_slot(stack)
+
+                        segments = transcribe_regions(audio, [(0.0, samples / SAMPLE_RATE)])
+                        for segment in segments:
+                            segment["start"] = round(segment["start"] + cursor, 2)
+                            segment["end"] = round(segment["end"] + cursor, 2)
+                        self._segments += segments
+
+                    # Only audio that is not transcribed yet is kept in memory
+                    with self._cond:
+                        del self._pcm[:samples * 2]
+                    cursor += samples / SAMPLE_RATE
+                    self._transcribed_until = cursor
+                    if done:
+                        return
+        except SlotCancelled:
+            pass
+        except Exception:
+            logger.exception("Error transcribing %s while it uploads", self.job_id)
+            self._fallback = "transcribing it while it uploaded failed"
+        finally:
+            with self._cond:
+                self._buffering = False
+                self._pcm = bytearray()
+                self._close_spill()
+
+    def finish_upload(self) -> str:
+        """
+        Call once the whole upload has been written: flushes the video to
+        disk and lets the decoder finish.
+
+        Returns:
+            SHA-256 of the upload
+        """
+        self._file.flush()
+        if self._prefix_digest is None:
+            self._publish_prefix()
+        if self._decoder is not None:
+            try:
+                self._decoder.stdin.close()
+            except OSError:
+                pass
+        self._uploaded_transcribed = self._transcribed_until
+        INGEST_TRANSCRIBED_SECONDS.inc(self._uploaded_transcribed, phase="during_upload")
+        return self._hash.hexdigest()
+
+    def result(self) -> Tuple[Optional[Dict[str, Any]], Optional[Fingerprint]]:
+        """
+        Wait for the rest of the transcription.
+
+        Returns:
+            Tuple of (transcript with segments and full_text, audio
+            fingerprint), or (None, None) if the upload must be transcribed
+            from the saved file: it could not be decoded or transcribed
+            while it arrived, its audio matches a cached lecture, an
+            identical upload was already being transcribed, or it was aborted
+        """
+        for thread in self._threads:
+            thread.join()
+        if self._decode_failed or not self._fingerprints:
+            self._fallback = self._fallback or "it could not be decoded while it uploaded"
+        if self._aborted or self._fallback:
+            logger.info("Transcribing %s from the saved file: %s", self.job_id, self._fallback or "ingest was aborted")
+            INGEST_UPLOADS.inc(mode="fallback")
+            return None, None
+
+        INGEST_UPLOADS.inc(mode="pipelined")
+        INGEST_TRANSCRIBED_SECONDS.inc(self._decoded_bytes / BYTES_PER_SECOND - self._uploaded_transcribed,
+                                       phase="after_upload")
+        for i, segment in enumerate(self._segments):
+            segment["id"] = i
+        transcript = {
+            "segments": self._segments,
+            "full_text": " ".join(segment["text"] for segment in self._segments)
+        }
+        return transcript, join_fingerprints(self._fingerprints)
+
+    def abort(self) -> None:
+        """
+        Stop decoding and transcribing, e.g. when the upload turns out to be
+        cached or another upload of it is already being processed.
+        """
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+        if self._decoder is not None and self._decoder.poll() is None:
+            self._decoder.kill()
+
+
+class IngestRequest(Request):
+    """
+    Request whose uploaded file can go to a PipelinedIngest instead of a
+    temporary file: set ingest_factory(filename) before reading
+    request.files. Only the first file of the form is offered to it; it may
+    return None to use a temporary file.
+    """
+    ingest_factory: Optional[Callable[[str], Optional[PipelinedIngest]]] = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        factory, self.ingest_factory = self.ingest_factory, None
+        stream = factory(filename) if factory is not None and filename else None
+        if stream is not None:
+            return stream
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
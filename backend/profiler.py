@@ -0,0 +1,164 @@
+"""
+Low-overhead sampling profiler for individual requests.
+
+A background thread snapshots the profiled thread's Python stack every few
+milliseconds (sys._current_frames), so the profiled code runs unmodified.
+Profiles are written in the speedscope format (https://www.speedscope.app),
+which renders them as flame graphs.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+PROFILES_FOLDER = 'data/profiles'
+PROFILE_SUFFIX = '.speedscope.json'
+
+# Seconds between stack samples
+DEFAULT_INTERVAL = 0.005
+
+Frame = Tuple[str, str, int]
+
+
+class SamplingProfiler:
+    """
+    Sample one thread's stack on a background thread.
+
+    Consecutive identical stacks are merged into one weighted sample, so long
+    blocking calls (Whisper, Gemini requests) don't blow up the profile size.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = DEFAULT_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.frames: List[Frame] = []
+        self.samples: List[List[int]] = []
+        self.weights: List[float] = []
+        self.duration = 0.0
+        self._frame_index: Dict[Frame, int] = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def start(self) -> 'SamplingProfiler':
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> 'SamplingProfiler':
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self._start
+        return self
+
+    def _stack(self, frame) -> List[int]:
+        """Frame indices of a stack, outermost call first."""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self._frame_index.get(key)
+            if index is None:
+                index = self._frame_index[key] = len(self.frames)
+                self.frames.append(key)
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _run(self) -> None:
+        last = self._start
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            stack = self._stack(frame)
+            del frame
+
+            if self.samples and self.samples[-1] == stack:
+                self.weights[-1] += now - last
+            else:
+                self.samples.append(stack)
+                self.weights.append(now - last)
+            last = now
+
+    def to_speedscope(self, name: str) -> Dict[str, Any]:
+        """Build a speedscope document for this profile."""
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'backend.profiler',
+            'activeProfileIndex': 0,
+            'shared': {
+                'frames': [{'name': fn, 'file': path, 'line': line} for fn, path, line in self.frames]
+            },
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': self.duration,
+                'samples': self.samples,
+                'weights': self.weights
+            }]
+        }
+
+
+def save_profile(profiler: SamplingProfiler, name: str, profile_id: str, folder: str = PROFILES_FOLDER,
+                 keep: int = 50) -> str:
+    """
+    Write a profile to the profiles folder, removing the oldest ones beyond keep.
+
+    Args:
+        profiler: Stopped profiler
+        name: Human-readable profile name (e.g. "POST /api/upload")
+        profile_id: File name stem; must be unique
+        folder: Directory holding profiles
+        keep: Number of most recent profiles to keep
+
+    Returns:
+        File name of the saved profile
+    """
+    os.makedirs(folder, exist_ok=True)
+    filename = profile_id + PROFILE_SUFFIX
+    tmp_path = os.path.join(folder, f".{filename}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(profiler.to_speedscope(name), f)
+    os.replace(tmp_path, os.path.join(folder, filename))
+
+    for old in list_profiles(folder)[keep:]:
+        try:
+            os.remove(os.path.join(folder, old['filename']))
+        except OSError:
+            pass
+
+    return filename
+
+
+def list_profiles(folder: str = PROFILES_FOLDER) -> List[Dict[str, Any]]:
+    """
+    List saved profiles, newest first.
+
+    Returns:
+        Dicts with filename, size and created_at (UNIX time)
+    """
+    if not os.path.isdir(folder):
+        return []
+
+    profiles = []
+    for filename in os.listdir(folder):
+        if not filename.endswith(PROFILE_SUFFIX) or filename.startswith('.'):
+            continue
+        try:
+            stat = os.stat(os.path.join(folder, filename))
+        except OSError:
+            continue
+        profiles.append({'filename': filename, 'size': stat.st_size, 'created_at': stat.st_mtime})
+
+    profiles.sort(key=lambda p: p['created_at'], reverse=True)
+    return profiles
@@ -0,0 +1,309 @@
+"""
+Deadlines, hedged requests and a circuit breaker for LLM calls.
+
+- A deadline budget is set once per unit of work (an upload, a flashcard
+  job) with `deadline()`. Every LLM call made under it gets a timeout capped
+  by the time left, so one slow response cannot stall the whole upload.
+- Idempotent calls are hedged: if no response arrives within the call
+  site's recent p95 latency, a duplicate request is sent and the first
+  response wins.
+- A circuit breaker stops calling the API after repeated failures, so calls
+  go straight to their local fallback until a probe call succeeds again.
+"""
+import collections
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, List, Optional, TypeVar
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Longest a single LLM request may take, deadline permitting
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '60'))
+# Hedge delay used until a call site has enough latency samples
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', '10'))
+# Never hedge sooner than this
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.5'))
+LLM_HEDGING = os.getenv('LLM_HEDGING', '1') != '0'
+# Consecutive failures that open the circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', '30'))
+# Timeouts only count as circuit failures if the request was given at least
+# this long; shorter ones say more about the caller's deadline than about the API
+CIRCUIT_MIN_TIMEOUT_SECONDS = float(os.getenv('CIRCUIT_MIN_TIMEOUT_SECONDS', '5'))
+
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+LLM_HEDGES = metrics.counter(
+    'llm_hedged_requests_total',
+    'Duplicate LLM requests sent after the hedge delay, and how many of them won',
+    ['call_site', 'outcome']
+)
+LLM_FALLBACKS = metrics.counter(
+    'llm_fallbacks_total',
+    'LLM calls answered by a local fallback, by reason (circuit_open, deadline, error)',
+    ['call_site', 'reason']
+)
+CIRCUIT_STATE = metrics.gauge(
+    'llm_circuit_open',
+    'Whether the LLM circuit breaker is open (1), half-open (0.5) or closed (0)',
+    ['name']
+)
+
+# Runs LLM attempts so the caller can stop waiting at its deadline; an
+# abandoned attempt finishes (or times out) in the background
+_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='llm')
+
+_latencies: Dict[str, Deque[float]] = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+_latencies_lock = threading.Lock()
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the work's deadline budget has run out."""
+
+
+class LLMUnavailableError(RuntimeError):
+    """Raised when an LLM call fails and has no local fallback."""
+
+
+class Budget:
+    """Time budget of one unit of work, and the fallbacks used under it."""
+
+    def __init__(self, seconds: float, parent: Optional['Budget'] = None):
+        self.expires_at = time.monotonic() + seconds
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+        self.fallbacks: List[str] = []
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def extend(self, seconds: float) -> None:
+        """Push the deadline back, e.g. by time spent waiting for reasons outside the work's control."""
+        self.expires_at += seconds
+
+
+_budget: contextvars.ContextVar[Optional[Budget]] = contextvars.ContextVar('budget', default=None)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Run the with-block under a deadline budget (never longer than an
+    enclosing one). Yields the Budget.
+    """
+    budget = Budget(seconds, _budget.get())
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+
+
+def current_budget() -> Optional[Budget]:
+    return _budget.get()
+
+
+def bind_budget(fn: Callable[..., T]) -> Callable[..., T]:
+    """Wrap fn so it runs under the caller's budget, e.g. in a thread pool."""
+    budget = _budget.get()
+
+    def run(*args, **kwargs):
+        token = _budget.set(budget)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _budget.reset(token)
+
+    return run
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. After `failure_threshold` consecutive failures
+    the circuit opens and calls are refused for `reset_seconds`; then one
+    probe call is let through (half-open) and its outcome closes or re-opens
+    the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(0, name=name)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_seconds:
+                return False
+            self._probing = True
+            CIRCUIT_STATE.set(0.5, name=self.name)
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Circuit %s closed", self.name)
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+            CIRCUIT_STATE.set(0, name=self.name)
+
+    def record_abandoned(self) -> None:
+        """
+        Record a call that ended without saying anything about the API's
+        health (e.g. the client went away); a probe call may be retried.
+        """
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                CIRCUIT_STATE.set(1, name=self.name)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if not self._probing:
+                    logger.warning("Circuit %s opened after %d consecutive failures", self.name, self._failures)
+                self._opened_at = time.monotonic()
+                self._probing = False
+                CIRCUIT_STATE.set(1, name=self.name)
+
+
+# All Gemini calls share one breaker: they fail together when the API is unhealthy
+GEMINI_BREAKER = CircuitBreaker('gemini')
+
+
+def hedge_delay(call_site: str) -> float:
+    """The call site's recent p95 latency, or a default until there are enough samples."""
+    with _latencies_lock:
+        samples = sorted(_latencies[call_site])
+    if len(samples) < MIN_LATENCY_SAMPLES:
+        return LLM_HEDGE_DEFAULT_DELAY
+    return max(samples[int(0.95 * (len(samples) - 1))], LLM_HEDGE_MIN_DELAY)
+
+
+def _record_latency(call_site: str, seconds: float) -> None:
+    with _latencies_lock:
+        _latencies[call_site].append(seconds)
+
+
+def _attempt(fn: Callable[[float], T], timeout: float, call_site: str):
+    start = time.monotonic()
+    result = fn(timeout)
+    _record_latency(call_site, time.monotonic() - start)
+    return result
+
+
+def _run_hedged(call_site: str, fn: Callable[[float], T], timeout: float, hedge: bool) -> T:
+    """Run fn, sending one duplicate if it is slower than the hedge delay or fails."""
+    start = time.monotonic()
+    end = start + timeout
+    delay = hedge_delay(call_site) if hedge else None
+
+    pending = {_pool.submit(_attempt, fn, timeout, call_site)}
+    hedge_future = None
+    error = None
+
+    while pending:
+        now = time.monotonic()
+        wait_until = end
+        if delay is not None and hedge_future is None:
+            wait_until = min(end, start + delay)
+        done, pending = wait(pending, timeout=max(wait_until - now, 0), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            if future.exception() is None:
+                if future is hedge_future:
+                    LLM_HEDGES.inc(call_site=call_site, outcome='won')
+                return future.result()
+            error = future.exception()
+
+        now = time.monotonic()
+        if now >= end:
+            raise DeadlineExceeded(f"{call_site} did not respond within {timeout:.1f}s")
+
+        # Hedge once: when the first attempt is slow, or right away if it failed
+        if delay is not None and hedge_future is None and (error is not None or now >= start + delay):
+            hedge_future = _pool.submit(_attempt, fn, end - now, call_site)
+            pending.add(hedge_future)
+            LLM_HEDGES.inc(call_site=call_site, outcome='launched')
+
+    raise error
+
+
+def record_fallback(call_site: str, reason: str) -> None:
+    """Count a degraded local result and note it on the current budget."""
+    LLM_FALLBACKS.inc(call_site=call_site, reason=reason)
+    budget = _budget.get()
+    if budget is not None:
+        budget.fallbacks.append(call_site)
+
+
+def llm_timeout() -> float:
+    """Timeout for one LLM request: LLM_TIMEOUT_SECONDS, capped by the current deadline."""
+    budget = _budget.get()
+    if budget is None:
+        return LLM_TIMEOUT_SECONDS
+    return min(LLM_TIMEOUT_SECONDS, budget.remaining())
+
+
+def call_llm(call_site: str, fn: Callable[[float], T], hedge: bool = True,
+             fallback: Optional[Callable[[], T]] = None) -> T:
+    """
+    Call the LLM under the current deadline, with hedging and the circuit breaker.
+
+    Args:
+        call_site: Name of the calling feature, for metrics and hedge delays
+        fn: Makes one request; receives its timeout in seconds
+        hedge: Whether duplicate requests are safe (the call is idempotent)
+        fallback: Local, degraded replacement for the response
+
+    Returns:
+        fn's result, or fallback's if the call could not be made or failed
+
+    Raises:
+        LLMUnavailableError: If the call failed and there is no fallback
+    """
+    timeout = llm_timeout()
+    if timeout <= 0:
+        reason, error = 'deadline', DeadlineExceeded(f"No time left for {call_site}: the deadline budget has run out")
+    elif not GEMINI_BREAKER.allow():
+        reason, error = 'circuit_open', LLMUnavailableError(f"Gemini circuit is open, skipping {call_site}")
+    else:
+        try:
+            result = _run_hedged(call_site, fn, timeout, hedge and LLM_HEDGING)
+            GEMINI_BREAKER.record_success()
+            return result
+        except Exception as e:
+            if isinstance(e, DeadlineExceeded) and timeout < CIRCUIT_MIN_TIMEOUT_SECONDS:
+                GEMINI_BREAKER.record_abandoned()
+            else:
+                GEMINI_BREAKER.record_failure()
+            reason = 'deadline' if isinstance(e, DeadlineExceeded) else 'error'
+            error = e
+
+    if fallback is None:
+        if isinstance(error, LLMUnavailableError):
+            raise error
+        raise LLMUnavailableError(f"{call_site} failed: {error}") from error
+
+    logger.warning("Using local fallback for %s (%s): %s", call_site, reason, error)
+    record_fallback(call_site, reason)
+    return fallback()
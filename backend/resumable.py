@@ -0,0 +1,315 @@
+"""
+Resumable, parallel uploads of large videos.
+
+A client creates an upload session for a file of known size, sends its
+fixed-size parts (in any order, in parallel, each with a SHA-256 checksum),
+can ask which parts have arrived after a dropped connection, and finalizes
+the session once every part is in. Finalizing assembles the parts into one
+file, hashing it on the way, ready for the normal processing pipeline.
+
+Sessions live on disk under UPLOAD_SESSIONS_FOLDER so any worker process
+can receive any part:
+    <upload_id>/session.json    filename, size, part size, creation time
+    <upload_id>/<n>.part        part n, written to a temp file and renamed
+                                into place once its checksum matches
+    <upload_id>/<n>.json        size and checksum of part n
+
+Finalizing renames <upload_id> to <upload_id>.assembling while the parts
+are joined; cleanup_expired() also removes claimed sessions left behind by
+a worker that died mid-assembly.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Any, BinaryIO, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SESSIONS_FOLDER = 'data/uploads'
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+MIN_PART_SIZE = 1024 * 1024
+MAX_PART_SIZE = 64 * 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_RESUMABLE_UPLOAD_BYTES', 10 * 1024 ** 3))
+# Unfinished sessions are deleted after this long
+SESSION_TTL_SECONDS = 24 * 60 * 60
+
+COPY_BUFFER_BYTES = 1024 * 1024
+_UPLOAD_ID_REGEX = re.compile(r'^[0-9a-f]{32}$')
+_SHA256_REGEX = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadSessionError(Exception):
+    """A request the upload session cannot accept; status is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def _session_dir(upload_id: str) -> str:
+    if not _UPLOAD_ID_REGEX.match(upload_id):
+        raise UploadSessionError('Upload session not found', 404)
+    return os.path.join(UPLOAD_SESSIONS_FOLDER, upload_id)
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    """Write JSON so readers in other workers never see a half-written file."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _remove(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def create_session(filename: str, size: int, part_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Start an upload session.
+
+    Args:
+        filename: Original filename of the video
+        size: Total size in bytes
+        part_size: Requested part size; clamped to MIN_PART_SIZE..MAX_PART_SIZE
+
+    Returns:
+        The session: upload_id, filename, size, part_size, part_count, created_at
+    """
+    if size <= 0:
+        raise UploadSessionError('size must be positive')
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadSessionError(f'File too large (max {MAX_UPLOAD_BYTES} bytes)', 413)
+
+    cleanup_expired()
+
+    part_size = min(max(part_size or DEFAULT_PART_SIZE, MIN_PART_SIZE), MAX_PART_SIZE)
+    session = {
+        'upload_id': uuid.uuid4().hex,
+        'filename': filename,
+        'size': size,
+        'part_size': part_size,
+        'part_count': -(-size // part_size),
+        'created_at': time.time(),
+    }
+    session_dir = _session_dir(session['upload_id'])
+    os.makedirs(session_dir)
+    _write_json(os.path.join(session_dir, 'session.json'), session)
+    logger.info("Upload session %s created for %s (%d bytes, %d parts)",
+                session['upload_id'], filename, size, session['part_count'])
+    return session
+
+
+def load_session(upload_id: str) -> Dict[str, Any]:
+    """Get an upload session; raises UploadSessionError (404) if there is none."""
+    try:
+        with open(os.path.join(_session_dir(upload_id), 'session.json'), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadSessionError('Upload session not found', 404)
+
+
+def part_length(session: Dict[str, Any], index: int) -> int:
+    """Expected size of part `index` (only the last part may be short)."""
+    if not 0 <= index < session['part_count']:
+        raise UploadSessionError(f"Part number must be between 0 and {session['part_count'] - 1}")
+    return min(session['part_size'], session['size'] - index * session['part_size'])
+
+
+def write_part(session: Dict[str, Any], index: int, stream: BinaryIO, sha256: str) -> Dict[str, Any]:
+    """
+    Store one part of an upload, verifying its size and checksum.
+
+    Sending a part again replaces it, so retries after a dropped connection
+    are safe.
+
+    Args:
+        session: Session from load_session()
+        index: Part number (0-based)
+        stream: Request body
+        sha256: Hex SHA-256 of the part, as computed by the client
+
+    Returns:
+        The part's number, size and checksum
+    """
+    sha256 = (sha256 or '').strip().lower()
+    if not _SHA256_REGEX.match(sha256):
+        raise UploadSessionError('A hex SHA-256 checksum of the part is required')
+    expected = part_length(session, index)
+
+    session_dir = _session_dir(session['upload_id'])
+    tmp_path = os.path.join(session_dir, f"{index}.{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(COPY_BUFFER_BYTES)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > expected:
+                    raise UploadSessionError(f"Part {index} is larger than {expected} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+        if received != expected:
+            raise UploadSessionError(f"Part {index} has {received} bytes, expected {expected}")
+        if digest.hexdigest() != sha256:
+            raise UploadSessionError(f"Checksum mismatch for part {index}", 422)
+        os.replace(tmp_path, os.path.join(session_dir, f"{index}.part"))
+        part = {'part': index, 'size': received, 'sha256': sha256}
+        _write_json(os.path.join(session_dir, f"{index}.json"), part)
+    except FileNotFoundError:
+        # The session directory went away while the part arrived
+        _remove(tmp_path)
+        raise UploadSessionError('Upload session is being finalized or no longer exists', 409)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+    return part
+
+
+def received_parts(session: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    """Parts stored so far, by part number."""
+    session_dir = _session_dir(session['upload_id'])
+    try:
+        names = os.listdir(session_dir)
+    except FileNotFoundError:
+        raise UploadSessionError('Upload session is being finalized or no longer exists', 409)
+    parts = {}
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        if ext == '.json' and stem.isdigit():
+            try:
+                with open(os.path.join(session_dir, name), 'r') as f:
+                    parts[int(stem)] = json.load(f)
+            except (OSError, ValueError):
+                continue
+    return parts
+
+
+def _ranges(indices: List[int], session: Dict[str, Any]) -> List[List[int]]:
+    """Byte ranges [start, end) covered by sorted part numbers."""
+    ranges = []
+    for index in indices:
+        start = index * session['part_size']
+        end = start + part_length(session, index)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def session_status(session: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Describe an upload's progress.
+
+    Returns:
+        The session plus received byte ranges, missing part numbers, the
+        number of bytes received and whether every part is in
+    """
+    parts = received_parts(session)
+    missing = [i for i in range(session['part_count']) if i not in parts]
+    return {
+        **session,
+        'received_ranges': _ranges(sorted(parts), session),
+        'received_bytes': sum(part['size'] for part in parts.values()),
+        'missing_parts': missing,
+        'complete': not missing,
+    }
+
+
+def assemble(session: Dict[str, Any], dest_path: str, sha256: Optional[str] = None) -> str:
+    """
+    Join an upload's parts into one file and delete the session.
+
+    Args:
+        session: Session from load_session()
+        dest_path: Where to write the assembled file
+        sha256: Optional hex SHA-256 of the whole file to verify
+
+    Returns:
+        The SHA-256 of the assembled file (its content hash)
+    """
+    missing = session_status(session)['missing_parts']
+    if missing:
+        raise UploadSessionError(f"Missing parts: {missing[:20]}", 409)
+
+    # Claim the session so a concurrent finalize of the same upload cannot
+    # assemble it a second time
+    session_dir = _session_dir(session['upload_id'])
+    claimed_dir = f"{session_dir}.assembling"
+    try:
+        os.rename(session_dir, claimed_dir)
+    except FileNotFoundError:
+        raise UploadSessionError('Upload session is already being finalized', 409)
+    # Marks when assembly started, for cleanup_expired()
+    os.utime(claimed_dir)
+
+    digest = hashlib.sha256()
+    try:
+        with open(dest_path, 'wb') as out:
+            for index in range(session['part_count']):
+                with open(os.path.join(claimed_dir, f"{index}.part"), 'rb') as part:
+                    for chunk in iter(lambda: part.read(COPY_BUFFER_BYTES), b''):
+                        digest.update(chunk)
+                        out.write(chunk)
+        content_hash = digest.hexdigest()
+        if sha256 and content_hash != sha256.strip().lower():
+            raise UploadSessionError('Checksum mismatch for the assembled file', 422)
+    except BaseException:
+        # Put the session back so the client can retry or resend parts
+        _remove(dest_path)
+        os.rename(claimed_dir, session_dir)
+        raise
+
+    shutil.rmtree(claimed_dir, ignore_errors=True)
+    logger.info("Upload session %s assembled into %s", session['upload_id'], dest_path)
+    return content_hash
+
+
+def delete_session(upload_id: str) -> None:
+    """Abort an upload and delete its parts."""
+    session_dir = _session_dir(upload_id)
+    if not os.path.isdir(session_dir):
+        raise UploadSessionError('Upload session not found', 404)
+    shutil.rmtree(session_dir, ignore_errors=True)
+
+
+def cleanup_expired(now: Optional[float] = None) -> int:
+    """
+    Delete sessions older than SESSION_TTL_SECONDS, and sessions whose
+    assembly started that long ago (their worker died before finishing).
+
+    Returns:
+        Number of sessions deleted
+    """
+    now = now or time.time()
+    if not os.path.isdir(UPLOAD_SESSIONS_FOLDER):
+        return 0
+    deleted = 0
+    for name in os.listdir(UPLOAD_SESSIONS_FOLDER):
+        path = os.path.join(UPLOAD_SESSIONS_FOLDER, name)
+        try:
+            if name.endswith('.assembling') and _UPLOAD_ID_REGEX.match(name[:-len('.assembling')]):
+                started_at = os.path.getmtime(path)
+            elif _UPLOAD_ID_REGEX.match(name):
+                with open(os.path.join(path, 'session.json'), 'r') as f:
+                    started_at = json.load(f)['created_at']
+            else:
+                continue
+        except (OSError, ValueError, KeyError):
+            continue
+        if now - started_at > SESSION_TTL_SECONDS:
+            shutil.rmtree(path, ignore_errors=True)
+            deleted += 1
+    if deleted:
+        logger.info("Deleted %d expired upload sessions", deleted)
+    return deleted
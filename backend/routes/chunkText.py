@@ -1,54 +1,92 @@
 import os
 import json
+import logging
+import uuid
 from pathlib import Path
 from dotenv import load_dotenv
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_core.documents import Document
 
+try:
+    from .localChunker import chunk_segments, chunk_text
+    from .embeddingCache import CachedEmbeddings, EmbeddingStore
+    from cache import get_cache_dir, get_video_cache_key
+    from telemetry import record_cache_lookup
+except ImportError:
+    import sys
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from routes.localChunker import chunk_segments, chunk_text
+    from routes.embeddingCache import CachedEmbeddings, EmbeddingStore
+    from cache import get_cache_dir, get_video_cache_key
+    from telemetry import record_cache_lookup
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Get the backend directory (parent of routes directory)
 BACKEND_DIR = Path(__file__).parent.parent
 DEFAULT_TRANSCRIPT_PATH = BACKEND_DIR / "transcription_text.txt"
 DEFAULT_SEGMENTS_PATH = BACKEND_DIR / "transcription_segments.json"
-LOG_PATH = "/Users/stephaniechen/nwhacks26/.cursor/debug.log"
+EMBEDDING_MODEL = "models/embedding-001"
+EMBEDDING_CACHE_DIR = BACKEND_DIR / "data" / "cache" / "embeddings"
+# Chunk boundaries cached beside a video's other artifacts
+CHUNKS_FILENAME = "chunks.json"
 
-def _log(hypothesis_id, location, message, data):
-    try:
-        import time
-        log_entry = {
-            "sessionId": "debug-session",
-            "runId": "run1",
-            "hypothesisId": hypothesis_id,
-            "location": location,
-            "message": message,
-            "data": data,
-            "timestamp": int(time.time() * 1000)
-        }
-        with open(LOG_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(log_entry) + "\n")
-    except:
-        pass
-# #endregion
+
+def get_video_cache_dir(video_id):
+    """
+    Get the cache directory holding an uploaded video's artifacts.
+    
+    Raises:
+        FileNotFoundError: If the video has no cached artifacts
+    """
+    cache_key = get_video_cache_key(video_id)
+    if cache_key is None:
+        raise FileNotFoundError(f"No cached artifacts for video {video_id}")
+    
+    # Relative to the working directory, like every path in cache.py
+    return Path(get_cache_dir(cache_key))
+
+
+def group_segments(segments, chunk_size=15):
+    """
+    Group consecutive transcript segments into fixed-size chunks.
+    
+    Args:
+        segments: List of transcript segments.
+        chunk_size: Number of segments to group together per chunk.
+        
+    Returns:
+        List of LangChain Document objects.
+    """
+    docs = []
+    for i in range(0, len(segments), chunk_size):
+        group = segments[i:i+chunk_size]
+        
+        docs.append(Document(
+            page_content=" ".join(seg["text"] for seg in group),
+            metadata={"start": group[0]["start"], "end": group[-1]["end"], "segment_ids": [s["id"] for s in group]}
+        ))
+    return docs
 
 
-def get_chunks_from_segments(segments_path=None, chunk_size=15):
+def get_chunks_from_segments(segments_path=None, chunk_size=15, video_id=None):
     """
     Load pre-chunked transcript segments from JSON and group them into larger chunks.
     
     Args:
         segments_path: Path to segments JSON file. If None, uses default.
         chunk_size: Number of segments to group together per chunk.
+        video_id: Read this uploaded video's cached segments instead of segments_path.
         
     Returns:
         List of LangChain Document objects.
     """
-    # #region agent log
-    _log("C", "chunkText.py:get_chunks_from_segments", "Fallback: loading pre-chunked segments", {"segments_path": str(segments_path) if segments_path else "default"})
-    # #endregion
+    logger.debug("Fallback: loading pre-chunked segments from %s", segments_path or "default path")
     
-    if segments_path is None:
+    if video_id is not None:
+        segments_path = get_video_cache_dir(video_id) / "transcript_segments.json"
+    elif segments_path is None:
         segments_path = DEFAULT_SEGMENTS_PATH
     else:
         segments_path = Path(segments_path)
@@ -61,31 +99,16 @@ def get_chunks_from_segments(segments_path=None, chunk_size=15):
     with open(segments_path, "r", encoding="utf-8") as f:
         segments = json.load(f)
     
-    # #region agent log
-    _log("C", "chunkText.py:get_chunks_from_segments", "Loaded segments from JSON", {"segment_count": len(segments)})
-    # #endregion
+    logger.debug("Loaded %d segments from JSON", len(segments))
     
-    # Group segments into chunks
-    docs = []
-    for i in range(0, len(segments), chunk_size):
-        chunk_segments = segments[i:i+chunk_size]
-        chunk_text = " ".join(seg["text"] for seg in chunk_segments)
-        start_time = chunk_segments[0]["start"]
-        end_time = chunk_segments[-1]["end"]
-        
-        docs.append(Document(
-            page_content=chunk_text,
-            metadata={"start": start_time, "end": end_time, "segment_ids": [s["id"] for s in chunk_segments]}
-        ))
+    docs = group_segments(segments, chunk_size)
     
-    # #region agent log
-    _log("C", "chunkText.py:get_chunks_from_segments", "Created chunks from segments", {"chunk_count": len(docs), "chunk_size": chunk_size})
-    # #endregion
+    logger.debug("Created %d chunks of %d segments", len(docs), chunk_size)
     
     return docs
 
 
-def get_chunks_from_text_simple(transcript_path=None, chunk_size_words: int = 200):
+def get_chunks_from_text_simple(transcript_path=None, chunk_size_words: int = 200, video_id=None):
     """
     Fallback: Create simple text chunks by splitting transcript into word-based chunks.
     Used when semantic chunking fails and segments file doesn't exist.
@@ -93,11 +116,14 @@ def get_chunks_from_text_simple(transcript_path=None, chunk_size_words: int = 20
     Args:
         transcript_path: Path to transcript text file. If None, uses default.
         chunk_size_words: Approximate number of words per chunk.
+        video_id: Read this uploaded video's cached transcript instead of transcript_path.
         
     Returns:
         List of LangChain Document objects.
     """
-    if transcript_path is None:
+    if video_id is not None:
+        transcript_path = get_video_cache_dir(video_id) / "transcript_text.txt"
+    elif transcript_path is None:
         transcript_path = DEFAULT_TRANSCRIPT_PATH
     else:
         transcript_path = Path(transcript_path)
@@ -123,24 +149,36 @@ def get_chunks_from_text_simple(transcript_path=None, chunk_size_words: int = 20
             metadata={"chunk_index": i // chunk_size_words, "word_start": i, "word_end": min(i + chunk_size_words, len(words))}
         ))
     
-    print(f"✓ Created {len(docs)} simple text chunks from transcript")
+    logger.info("Created %d simple text chunks from transcript", len(docs))
     return docs
 
 
-def get_chunks(transcript_path=None):
+def get_chunks(transcript_path=None, segments_path=None, use_remote_embeddings=False, video_id=None):
     """
-    Chunk a transcript file into semantic sections.
-    Falls back to pre-chunked segments if semantic chunking fails due to quota limits.
+    Chunk a transcript into semantic sections.
+    
+    By default chunks are found locally (see localChunker), using the
+    timestamped segments when available so each chunk carries start, end and
+    segment_ids metadata. With use_remote_embeddings=True, LangChain's
+    SemanticChunker with Gemini embeddings is used instead, falling back to
+    pre-chunked segments if it fails due to quota limits.
+    
+    With a video_id, the video's cached segments are chunked instead and the
+    chunk boundaries are cached beside them (see get_chunks_for_video).
     
     Args:
         transcript_path: Path to transcript text file. If None, uses default.
+        segments_path: Path to segments JSON file. If None, uses default.
+        use_remote_embeddings: Use Gemini embeddings instead of the local chunker.
+        video_id: Chunk this uploaded video's cached transcript.
         
     Returns:
         List of LangChain Document objects containing chunked text.
     """
-    # #region agent log
-    _log("A", "chunkText.py:get_chunks", "Starting chunking", {"transcript_path": str(transcript_path) if transcript_path else "default"})
-    # #endregion
+    if video_id is not None:
+        return get_chunks_for_video(video_id, use_remote_embeddings)
+    
+    logger.debug("Starting chunking of %s", transcript_path or "default transcript")
     
     if transcript_path is None:
         transcript_path = DEFAULT_TRANSCRIPT_PATH
@@ -150,18 +188,175 @@ def get_chunks(transcript_path=None):
         if not transcript_path.is_absolute():
             transcript_path = BACKEND_DIR / transcript_path
     
+    if not use_remote_embeddings:
+        return get_chunks_local(transcript_path, segments_path)
+    
+    return get_chunks_remote(transcript_path)
+
+
+def get_chunks_for_video(video_id, use_remote_embeddings=False):
+    """
+    Chunk an uploaded video's cached transcript segments.
+    
+    Chunk boundaries (segment id ranges and timestamps) are saved as
+    chunks.json in the video's cache directory, and later calls rebuild the
+    chunks from them instead of re-chunking.
+    
+    Args:
+        video_id: ID of an uploaded video
+        use_remote_embeddings: Use Gemini embeddings instead of the local chunker.
+        
+    Returns:
+        List of LangChain Document objects with start, end and segment_ids metadata.
+    """
+    cache_dir = get_video_cache_dir(video_id)
+    chunks_path = cache_dir / CHUNKS_FILENAME
+    method = "remote" if use_remote_embeddings else "local"
+    
+    with open(cache_dir / "transcript_segments.json", "r", encoding="utf-8") as f:
+        segments = json.load(f)
+    
+    if chunks_path.exists():
+        with open(chunks_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        # Remote chunks are preferred but local ones are still usable
+        if cached["method"] == method or cached["method"] == "remote":
+            record_cache_lookup("chunks", hits=1)
+            return docs_from_boundaries(segments, cached["chunks"])
+    record_cache_lookup("chunks", misses=1)
+    
+    docs = None
+    if use_remote_embeddings:
+        try:
+            docs = chunk_segments(segments, embeddings=_get_remote_embeddings())
+        except Exception as e:
+            logger.warning("Remote semantic chunking failed (%s). Falling back to local chunking.", type(e).__name__)
+            method = "local"
+    if docs is None:
+        docs = chunk_segments(segments)
+    
+    save_chunk_boundaries(chunks_path, method, docs)
+    return docs
+
+
+def save_chunk_boundaries(chunks_path, method, docs):
+    """
+    Save the boundaries of segment-based chunks.
+    
+    Args:
+        chunks_path: Path of the chunks JSON file
+        method: How the chunks were computed ("local" or "remote")
+        docs: Chunks with start, end and segment_ids metadata
+    """
+    chunks = [
+        {
+            "start_segment": doc.metadata["segment_ids"][0],
+            "end_segment": doc.metadata["segment_ids"][-1],
+            "start": doc.metadata["start"],
+            "end": doc.metadata["end"]
+        }
+        for doc in docs
+    ]
+    # Write to a temp file and rename it into place, so a reader in another
+    # worker never sees a half-written file
+    tmp_path = f"{chunks_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"method": method, "chunks": chunks}, f, indent=2)
+        os.replace(tmp_path, chunks_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def docs_from_boundaries(segments, chunks):
+    """
+    Rebuild chunk Documents from saved boundaries.
+    
+    Args:
+        segments: Transcript segments the boundaries refer to
+        chunks: Boundaries saved by save_chunk_boundaries()
+        
+    Returns:
+        List of LangChain Document objects.
+    """
+    index_by_id = {seg["id"]: i for i, seg in enumerate(segments)}
+    docs = []
+    for chunk in chunks:
+        members = segments[index_by_id[chunk["start_segment"]]:index_by_id[chunk["end_segment"]] + 1]
+        docs.append(Document(
+            page_content=" ".join(seg["text"] for seg in members),
+            metadata={"start": chunk["start"], "end": chunk["end"], "segment_ids": [s["id"] for s in members]}
+        ))
+    return docs
+
+
+def get_chunks_local(transcript_path, segments_path=None):
+    """
+    Chunk a transcript in-process, without any network calls.
+    
+    Args:
+        transcript_path: Path to transcript text file, used if there are no segments.
+        segments_path: Path to segments JSON file. If None, uses default.
+        
+    Returns:
+        List of LangChain Document objects.
+    """
+    if segments_path is None:
+        segments_path = DEFAULT_SEGMENTS_PATH
+    else:
+        segments_path = Path(segments_path)
+        if not segments_path.is_absolute():
+            segments_path = BACKEND_DIR / segments_path
+    
+    if segments_path.exists():
+        with open(segments_path, "r", encoding="utf-8") as f:
+            segments = json.load(f)
+        docs = chunk_segments(segments)
+    else:
+        if not transcript_path.exists():
+            raise FileNotFoundError(f"Transcript file not found: {transcript_path}")
+        with open(transcript_path, "r", encoding="utf-8") as f:
+            docs = chunk_text(f.read())
+    
+    logger.debug("Local chunking produced %d chunks", len(docs))
+    
+    return docs
+
+
+def _get_remote_embeddings():
+    """Create Gemini embeddings backed by the persistent embedding cache."""
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    
     GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
     if not GEMINI_API_KEY:
         raise RuntimeError("Missing GEMINI_API_KEY in .env")
     
-    # #region agent log
-    _log("A", "chunkText.py:get_chunks", "API key found, attempting semantic chunking", {})
-    # #endregion
-    
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model="models/embedding-001", 
-        google_api_key=GEMINI_API_KEY
+    return CachedEmbeddings(
+        GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=GEMINI_API_KEY),
+        EmbeddingStore(str(EMBEDDING_CACHE_DIR / EMBEDDING_MODEL.split("/")[-1]))
     )
+
+
+def get_chunks_remote(transcript_path):
+    """
+    Chunk a transcript file with LangChain's SemanticChunker and Gemini embeddings.
+    Embeddings are read from and saved to a persistent cache, so re-chunking a
+    known transcript makes no API calls. Falls back to pre-chunked segments if semantic chunking fails due to quota limits.
+    
+    Args:
+        transcript_path: Path to transcript text file.
+        
+    Returns:
+        List of LangChain Document objects containing chunked text.
+    """
+    from langchain_experimental.text_splitter import SemanticChunker
+    
+    embeddings = _get_remote_embeddings()
+    
+    logger.debug("API key found, attempting semantic chunking")
+    
     text_splitter = SemanticChunker(embeddings, breakpoint_threshold_type="percentile")
     
     if not transcript_path.exists():
@@ -170,50 +365,32 @@ def get_chunks(transcript_path=None):
     with open(transcript_path, "r", encoding="utf-8") as f:
         transcript = f.read()
     
-    # #region agent log
-    _log("A", "chunkText.py:get_chunks", "Transcript loaded", {"transcript_length": len(transcript)})
-    # #endregion
+    logger.debug("Transcript loaded (%d chars)", len(transcript))
     
     try:
-        # #region agent log
-        _log("B", "chunkText.py:get_chunks", "Attempting semantic chunking", {})
-        # #endregion
+        logger.debug("Attempting semantic chunking")
         
         docs = text_splitter.create_documents([transcript])
         
-        # #region agent log
-        _log("A", "chunkText.py:get_chunks", "Semantic chunking succeeded", {"chunk_count": len(docs)})
-        # #endregion
+        logger.debug("Semantic chunking produced %d chunks", len(docs))
         
         return docs
         
     except Exception as e:
         error_str = str(e)
         
-        # #region agent log
-        _log("B", "chunkText.py:get_chunks", "Semantic chunking failed", {"error_type": type(e).__name__, "error_message": error_str[:200]})
-        # #endregion
+        logger.debug("Semantic chunking failed: %s: %s", type(e).__name__, error_str[:200])
         
         # Check if it's a quota/resource exhausted error
         is_quota_error = "RESOURCE_EXHAUSTED" in error_str or "429" in error_str or "quota" in error_str.lower()
         
-        # #region agent log
-        _log("C", "chunkText.py:get_chunks", "Error analysis", {"is_quota_error": is_quota_error})
-        # #endregion
-        
         if is_quota_error:
-            # #region agent log
-            _log("C", "chunkText.py:get_chunks", "Quota error detected, using fallback", {})
-            # #endregion
-            print("⚠️  Semantic chunking failed due to API quota limits. Falling back to pre-chunked segments.")
+            logger.warning("Semantic chunking failed due to API quota limits. Falling back to pre-chunked segments.")
             try:
                 return get_chunks_from_segments()
             except FileNotFoundError:
-                print("⚠️  Segments file not found. Falling back to simple text chunking.")
+                logger.warning("Segments file not found. Falling back to simple text chunking.")
                 return get_chunks_from_text_simple(transcript_path)
         else:
-            # #region agent log
-            _log("D", "chunkText.py:get_chunks", "Non-quota error, re-raising", {})
-            # #endregion
             # Re-raise if it's not a quota error
             raise
\ No newline at end of file
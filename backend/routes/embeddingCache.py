@@ -0,0 +1,183 @@
+"""
+Persistent, content-addressed cache for text embeddings.
+
+Vectors are appended to a float32 matrix file that is memory-mapped for
+reads, with a parallel file holding one SHA-1 text hash per row. Any text
+already embedded (by this or an earlier run, for any lecture) is served from
+disk; only misses are sent to the embedding API, in batches.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from telemetry import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    On-disk embedding store for one embedding model.
+
+    Layout of the store directory:
+        meta.json     {"dim": <vector size>}
+        vectors.f32   row-major float32 matrix, one row per text
+        hashes.txt    SHA-1 of each row's text, one per line
+
+    Appends are serialized across processes with a lock file, and each
+    reader picks up rows appended by other processes on its next lookup.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._hashes_path = os.path.join(directory, "hashes.txt")
+        self._lock_path = os.path.join(directory, ".lock")
+
+        self.dim = None
+        self._rows: Dict[str, int] = {}
+        self._hashes_offset = 0
+        self._n_lines = 0
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        """Load hashes and remap vectors appended since the last refresh."""
+        if self.dim is None:
+            if not os.path.exists(self._meta_path):
+                return
+            with open(self._meta_path, "r") as f:
+                self.dim = json.load(f)["dim"]
+
+        if not os.path.exists(self._hashes_path):
+            return
+        if os.path.getsize(self._hashes_path) == self._hashes_offset:
+            return
+
+        with open(self._hashes_path, "r") as f:
+            f.seek(self._hashes_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # partially written by another process
+                self._rows.setdefault(line.strip(), self._n_lines)
+                self._n_lines += 1
+                self._hashes_offset += len(line)
+
+        # Rows past the last hash (left by a crash between the two appends
+        # in add_many) are never read, and the next add_many drops them
+        n_rows = os.path.getsize(self._vectors_path) // (4 * self.dim)
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim))
+
+    def get_many(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up cached vectors.
+
+        Args:
+            hashes: Text hashes to look up
+
+        Returns:
+            Mapping of hash to vector, for the hashes that were found
+        """
+        with self._lock:
+            self._refresh()
+            found = {}
+            for h in hashes:
+                row = self._rows.get(h)
+                if row is not None and row < len(self._matrix):
+                    found[h] = np.array(self._matrix[row])
+            return found
+
+    def add_many(self, hashes: List[str], vectors: np.ndarray) -> None:
+        """
+        Append vectors to the store.
+
+        Args:
+            hashes: Text hash for each row of vectors
+            vectors: Matrix of shape (len(hashes), dim)
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, open(self._lock_path, "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            if not os.path.exists(self._meta_path):
+                with open(self._meta_path, "w") as f:
+                    json.dump({"dim": int(vectors.shape[1])}, f)
+            self._refresh()
+
+            # Skip texts another process embedded in the meantime
+            new = [i for i, h in enumerate(hashes) if h not in self._rows]
+            if not new:
+                return
+
+            # Row i belongs to hash line i, so drop anything a crash between
+            # the two appends left behind: vector rows without a hash would
+            # shift every later row, and a partial hash line would corrupt the next
+            row_bytes = 4 * int(vectors.shape[1])
+            if os.path.exists(self._vectors_path) and os.path.getsize(self._vectors_path) > self._n_lines * row_bytes:
+                logger.warning("Dropping embedding rows without a hash in %s", self.directory)
+                os.truncate(self._vectors_path, self._n_lines * row_bytes)
+            if os.path.exists(self._hashes_path) and os.path.getsize(self._hashes_path) > self._hashes_offset:
+                os.truncate(self._hashes_path, self._hashes_offset)
+
+            # Vectors first, then hashes, so a hash never points past the matrix
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors[new].tobytes())
+            with open(self._hashes_path, "a") as f:
+                f.write("".join(hashes[i] + "\n" for i in new))
+
+            self._refresh()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain Embeddings wrapper that checks an EmbeddingStore first and
+    only sends cache misses to the underlying model, in maximal batches.
+    """
+
+    def __init__(self, embeddings: Embeddings, store: EmbeddingStore, batch_size: int = 100):
+        self.embeddings = embeddings
+        self.store = store
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        cached = self.store.get_many(hashes)
+
+        # Embed each distinct missing text once
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+
+        record_cache_lookup("embeddings", hits=len(cached), misses=len(missing))
+        if missing:
+            logger.info("Embedding cache: %d hits, %d misses", len(cached), len(missing))
+            miss_hashes = list(missing)
+            for i in range(0, len(miss_hashes), self.batch_size):
+                batch = miss_hashes[i:i + self.batch_size]
+                vectors = np.asarray(self.embeddings.embed_documents([missing[h] for h in batch]), dtype=np.float32)
+                self.store.add_many(batch, vectors)
+                cached.update(zip(batch, vectors))
+
+        return [cached[h].tolist() for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
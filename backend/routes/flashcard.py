@@ -1,23 +1,66 @@
 from dotenv import load_dotenv
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from flask import Blueprint, request, jsonify
 import json
+import logging
 import os
 import requests
 import time
+import uuid
 
 try:
-    from .chunkText import get_chunks
+    from cache import get_cache_dir, get_video_cache_key
+    from resilience import LLMUnavailableError, call_llm, deadline
+    from state_store import get_state_store
+    from structured_output import generate_structured, StructuredOutputError
+    from telemetry import configure_logging, llm_call, stage
+    import metrics
 except ImportError:
     import sys
-    from pathlib import Path
     sys.path.insert(0, str(Path(__file__).parent.parent))
-    from routes.chunkText import get_chunks
+    from cache import get_cache_dir, get_video_cache_key
+    from resilience import LLMUnavailableError, call_llm, deadline
+    from state_store import get_state_store
+    from structured_output import generate_structured, StructuredOutputError
+    from telemetry import configure_logging, llm_call, stage
+    import metrics
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 GEMINI_API_URL = os.environ.get("GEMINI_API_URL")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
+FLASHCARDS_FILENAME = "flashcards.json"
+# A "generating" status older than this is assumed to belong to a dead worker
+GENERATION_STALE_SECONDS = 15 * 60
+# Time budget of one generation job; kept under the stale limit above
+GENERATION_DEADLINE_SECONDS = 10 * 60
+# Most chunks one request may ask to generate cards for
+MAX_CHUNKS_PER_REQUEST = 20
+
+flashcard_bp = Blueprint("flashcards", __name__)
+
+FLASHCARD_QUEUE_DEPTH = metrics.gauge(
+    "flashcard_jobs_pending",
+    "Flashcard generation jobs queued or running in this worker"
+)
+
+# Background deck generation, so uploads and requests never wait on it
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="flashcards")
+
+
+def get_chunks(*args, **kwargs):
+    """Chunk a transcript (see chunkText.get_chunks), importing the chunker on first use."""
+    try:
+        from .chunkText import get_chunks as _get_chunks
+    except ImportError:
+        from routes.chunkText import get_chunks as _get_chunks
+    return _get_chunks(*args, **kwargs)
+
 
 def _require_env() -> None:
     if not GEMINI_API_URL:
@@ -26,55 +69,64 @@ def _require_env() -> None:
         raise RuntimeError("Missing GEMINI_API_KEY in .env")
 
 
-def generate_flashcards(text: str, count: int = 2) -> List[Dict[str, str]]:
-    _require_env()
+FLASHCARDS_SCHEMA: Dict[str, Any] = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "question": {"type": "STRING"},
+            "answer": {"type": "STRING"}
+        },
+        "required": ["question", "answer"]
+    }
+}
 
-    prompt = (
-        f"Generate exactly {count} flashcards in JSON format from the transcript chunk below.\n"
-        "Rules:\n"
-        "- Use ONLY the chunk content, do not add outside knowledge\n"
-        "- Each flashcard must have keys: question, answer\n"
-        "- Return ONLY a JSON array (no markdown, no extra text)\n"
-        "- Questions should be exam-style and answerable from the provided content\n"
-        "- Answers should be concise and directly grounded in the transcript\n\n"
-        f"TRANSCRIPT CHUNK:\n{text}\n"
-    )
 
+def _post_gemini(prompt: str, schema: Dict[str, Any]) -> str:
+    """Send a prompt to the Gemini REST API with JSON output constrained to schema."""
     headers = {"Content-Type": "application/json"}
 
     data: Dict[str, Any] = {
         "contents": [
             {"parts": [{"text": prompt}]}
-        ]
+        ],
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": schema
+        }
     }
 
     max_retries = 3
-    retry_delay = 2 
-    
-    for attempt in range(max_retries):
-        try:
+    retry_delay = 2
+
+    def send(timeout):
+        with llm_call("flashcards") as call:
             response = requests.post(
                 f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
                 headers=headers,
                 json=data,
-                timeout=60
+                timeout=timeout
             )
-            
-            if response.status_code == 429:
-                if attempt < max_retries - 1:
-                    wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
-                    print(f"⚠️  Rate limit hit (429). Waiting {wait_time}s before retry {attempt + 1}/{max_retries}...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    response.raise_for_status()
-            else:
-                response.raise_for_status()
-                break
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429 and attempt < max_retries - 1:
-                wait_time = retry_delay * (2 ** attempt)
-                print(f"⚠️  Rate limit hit (429). Waiting {wait_time}s before retry {attempt + 1}/{max_retries}...")
+            if response.ok:
+                call["usage"] = response.json().get("usageMetadata")
+        # Rate limits and server errors both count against the circuit breaker
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    for attempt in range(max_retries):
+        try:
+            # Not hedged: a duplicate request would double the load exactly
+            # when the API is throttling
+            response = call_llm("flashcards", send, hedge=False)
+            response.raise_for_status()
+            break
+        except LLMUnavailableError as e:
+            error = e.__cause__
+            rate_limited = isinstance(error, requests.exceptions.HTTPError) and error.response.status_code == 429
+            if rate_limited and attempt < max_retries - 1:
+                wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
+                logger.warning("Rate limit hit (429). Waiting %ds before retry %d/%d", wait_time, attempt + 1, max_retries)
                 time.sleep(wait_time)
                 continue
             raise
@@ -82,49 +134,272 @@ def generate_flashcards(text: str, count: int = 2) -> List[Dict[str, str]]:
     result = response.json()
 
     try:
-        output_text = result["candidates"][0]["content"]["parts"][0]["text"]
+        return result["candidates"][0]["content"]["parts"][0]["text"]
     except Exception as e:
-        print("=== Unexpected Gemini response shape ===")
-        print(json.dumps(result, indent=2))
-        print("=======================================")
+        logger.error("Unexpected Gemini response shape")
+        logger.debug("Gemini response: %s", json.dumps(result, indent=2))
         raise RuntimeError("Could not parse Gemini response") from e
 
-    # Strip markdown code blocks if present (e.g., ```json ... ```)
-    output_text = output_text.strip()
-    if output_text.startswith("```"):
-        lines = output_text.split("\n")
-        if lines[0].startswith("```"):
-            lines = lines[1:]
-        if lines and lines[-1].strip() == "```":
-            lines = lines[:-1]
-        output_text = "\n".join(lines)
+
+def generate_flashcards(text: str, count: int = 2) -> List[Dict[str, str]]:
+    _require_env()
+
+    prompt = (
+        f"Generate exactly {count} flashcards in JSON format from the transcript chunk below.\n"
+        "Rules:\n"
+        "- Use ONLY the chunk content, do not add outside knowledge\n"
+        "- Each flashcard must have keys: question, answer\n"
+        "- Return ONLY a JSON array (no markdown, no extra text)\n"
+        "- Questions should be exam-style and answerable from the provided content\n"
+        "- Answers should be concise and directly grounded in the transcript\n\n"
+        f"TRANSCRIPT CHUNK:\n{text}\n"
+    )
 
     try:
-        cards = json.loads(output_text)
-        if not isinstance(cards, list):
-            raise ValueError("Model did not return a JSON list.")
-        cleaned: List[Dict[str, str]] = []
-        for c in cards:
-            if isinstance(c, dict) and "question" in c and "answer" in c:
-                cleaned.append({"question": str(c["question"]), "answer": str(c["answer"])})
-        return cleaned
-    except Exception:
-        print("=== RAW MODEL OUTPUT (not valid JSON) ===")
-        print(output_text)
-        print("========================================")
+        cards = generate_structured(
+            lambda request_prompt: _post_gemini(request_prompt, FLASHCARDS_SCHEMA),
+            prompt, FLASHCARDS_SCHEMA, call_site="flashcards"
+        )
+    except StructuredOutputError as e:
+        logger.debug("Raw model output (not valid JSON): %s", e.text)
         raise
 
+    return [{"question": c["question"], "answer": c["answer"]} for c in cards]
+
+
+def select_chunks(total_chunks: int, processed: List[int], max_chunks: int) -> List[int]:
+    """
+    Pick up to max_chunks chunks not processed yet, spread evenly over the lecture.
+    
+    Args:
+        total_chunks: Number of chunks in the lecture
+        processed: Indices of chunks that already have cards
+        max_chunks: Maximum number of chunks to pick
+        
+    Returns:
+        Sorted chunk indices
+    """
+    done = set(processed)
+    remaining = [i for i in range(total_chunks) if i not in done]
+    if len(remaining) <= max_chunks:
+        return remaining
+    if max_chunks == 1:
+        return [remaining[0]]
+    return [remaining[int(i * (len(remaining) - 1) / (max_chunks - 1))] for i in range(max_chunks)]
+
+
+def _deck_path(cache_key: str) -> Path:
+    return Path(get_cache_dir(cache_key)) / FLASHCARDS_FILENAME
+
+
+def load_deck(cache_key: str) -> Optional[Dict[str, Any]]:
+    """Load a lecture's cached flashcard deck, or None if there isn't one yet."""
+    path = _deck_path(cache_key)
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_deck(cache_key: str, deck: Dict[str, Any]) -> None:
+    path = _deck_path(cache_key)
+    tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(deck, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def build_deck(video_id: str, cache_key: str, max_chunks: int = 5, cards_per_chunk: int = 2, delay_between_chunks: float = 1.0) -> Dict[str, Any]:
+    """
+    Generate cards for chunks of a video that don't have any yet and add them
+    to its cached deck.
+    
+    Chunks come from the video's cached chunk boundaries, and the deck is
+    saved after every chunk so partial progress is visible to readers.
+    
+    Args:
+        video_id: ID of an uploaded video
+        cache_key: Cache key of the video's artifacts
+        max_chunks: Maximum number of new chunks to process
+        cards_per_chunk: Number of flashcards per chunk
+        delay_between_chunks: Delay in seconds between chunks, to avoid rate limits
+        
+    Returns:
+        The updated deck
+    """
+    docs = get_chunks(video_id=video_id)
+    deck = load_deck(cache_key) or {"flashcards": [], "processed_chunks": []}
+    deck["total_chunks"] = len(docs)
+    
+    indices = select_chunks(len(docs), deck["processed_chunks"], max_chunks)
+    for n, i in enumerate(indices):
+        cards = generate_flashcards(docs[i].page_content, count=cards_per_chunk)
+        for card in cards:
+            card["chunk"] = i
+            card["start"] = docs[i].metadata.get("start")
+        deck["flashcards"].extend(cards)
+        deck["processed_chunks"].append(i)
+        _save_deck(cache_key, deck)
+        logger.info("%s: chunk %d -> %d cards", video_id, i, len(cards))
+        
+        if n < len(indices) - 1:
+            time.sleep(delay_between_chunks)
+    
+    _save_deck(cache_key, deck)
+    return deck
+
+
+def _run_generation(video_id: str, cache_key: str, max_chunks: int) -> None:
+    store = get_state_store()
+    try:
+        with stage("flashcards"), deadline(GENERATION_DEADLINE_SECONDS):
+            build_deck(video_id, cache_key, max_chunks=max_chunks)
+        store.set("flashcard_jobs", cache_key, {"status": "ready", "finished_at": time.time()})
+    except Exception as e:
+        logger.exception("Error generating flashcards for %s", video_id)
+        store.set("flashcard_jobs", cache_key, {"status": "failed", "error": str(e), "finished_at": time.time()})
+    finally:
+        FLASHCARD_QUEUE_DEPTH.dec()
+
+
+def _is_generating(job: Optional[Dict[str, Any]]) -> bool:
+    return bool(job) and job["status"] == "generating" and time.time() - job["started_at"] < GENERATION_STALE_SECONDS
+
+
+def schedule_flashcards(video_id: str, more: bool = False, max_chunks: int = 5) -> bool:
+    """
+    Start generating a video's flashcards in the background.
+    
+    Does nothing if a deck is already cached (unless more=True) or if
+    generation for the same lecture is already running in any worker.
+    
+    Args:
+        video_id: ID of an uploaded video
+        more: Add cards for chunks not processed yet, even if a deck exists
+        max_chunks: Maximum number of new chunks to process
+        
+    Returns:
+        True if generation was started
+    """
+    cache_key = get_video_cache_key(video_id)
+    if cache_key is None:
+        return False
+    
+    store = get_state_store()
+    job = store.get("flashcard_jobs", cache_key)
+    if _is_generating(job):
+        return False
+    if not more and load_deck(cache_key) is not None:
+        return False
+    
+    # Claim the job only if nobody else changed it since we looked, so two
+    # workers never generate the same deck at once
+    if not store.compare_and_set("flashcard_jobs", cache_key, job, {"status": "generating", "started_at": time.time()}):
+        return False
+    FLASHCARD_QUEUE_DEPTH.inc()
+    _executor.submit(_run_generation, video_id, cache_key, max_chunks)
+    return True
+
+
+def _deck_response(video_id: str, cache_key: str, status_code: int = 200):
+    deck = load_deck(cache_key) or {"flashcards": [], "processed_chunks": []}
+    job = get_state_store().get("flashcard_jobs", cache_key) or {}
+    
+    if _is_generating(job):
+        status = "generating"
+    elif job.get("status") == "failed" and not deck["flashcards"]:
+        status = "failed"
+    else:
+        status = "ready"
+    
+    body = {
+        "video_id": video_id,
+        "status": status,
+        "flashcards": deck["flashcards"],
+        "processed_chunks": len(deck["processed_chunks"]),
+        "total_chunks": deck.get("total_chunks"),
+    }
+    if status == "failed":
+        body["error"] = job.get("error")
+    return jsonify(body), status_code
+
+
+@flashcard_bp.route("/api/flashcards", methods=["GET"])
+def get_flashcards():
+    """
+    Get a video's flashcards.
+    
+    Query parameters:
+        video_id: ID of an uploaded video
+    
+    Returns the cached deck immediately. If there is none yet, generation is
+    started in the background and the response has status "generating" (202);
+    poll again to get the cards.
+    """
+    video_id = request.args.get("video_id")
+    if not video_id:
+        return jsonify({"error": "video_id is required"}), 400
+    
+    cache_key = get_video_cache_key(video_id)
+    if cache_key is None:
+        return jsonify({"error": "Video not found. Please upload the video first."}), 404
+    
+    if load_deck(cache_key) is None:
+        schedule_flashcards(video_id)
+        return _deck_response(video_id, cache_key, 202)
+    
+    return _deck_response(video_id, cache_key)
+
+
+@flashcard_bp.route("/api/flashcards/more", methods=["POST"])
+def more_flashcards():
+    """
+    Generate more flashcards for a video, from chunks that don't have cards yet.
+    
+    Request body:
+    {
+        "video_id": "uuid",
+        "max_chunks": 5        (optional, at most MAX_CHUNKS_PER_REQUEST)
+    }
+    
+    Returns 202 while the new cards are generated in the background, or 200
+    with the full deck if every chunk already has cards.
+    """
+    data = request.get_json(silent=True) or {}
+    video_id = data.get("video_id")
+    if not video_id:
+        return jsonify({"error": "video_id is required"}), 400
+    
+    cache_key = get_video_cache_key(video_id)
+    if cache_key is None:
+        return jsonify({"error": "Video not found. Please upload the video first."}), 404
+    
+    deck = load_deck(cache_key)
+    if deck and deck.get("total_chunks") is not None and len(deck["processed_chunks"]) >= deck["total_chunks"]:
+        return _deck_response(video_id, cache_key)
+    
+    try:
+        max_chunks = int(data.get("max_chunks", 5))
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_chunks must be an integer"}), 400
+    if max_chunks < 1:
+        return jsonify({"error": "max_chunks must be at least 1"}), 400
+    
+    schedule_flashcards(video_id, more=True, max_chunks=min(max_chunks, MAX_CHUNKS_PER_REQUEST))
+    return _deck_response(video_id, cache_key, 202)
+
 
-def generate_flashcards_from_docs(max_chunks: int = 5, cards_per_chunk: int = 2, delay_between_chunks: float = 1.0) -> List[Dict[str, str]]:
+def generate_flashcards_from_docs(max_chunks: int = 5, cards_per_chunk: int = 2, delay_between_chunks: float = 1.0, video_id: str = None) -> List[Dict[str, str]]:
     """
     Generate flashcards from document chunks.
     
     Args:
+        video_id: Uploaded video to use; its cached chunks are reused (default: the local transcript files)
         max_chunks: Maximum number of chunks to process (default: 5 to avoid rate limits)
         cards_per_chunk: Number of flashcards per chunk
         delay_between_chunks: Delay in seconds between processing chunks (default: 1.0)
     """
-    docs = get_chunks()
+    docs = get_chunks(video_id=video_id)
     
     if len(docs) <= max_chunks:
         selected_docs = docs
@@ -137,7 +412,7 @@ def generate_flashcards_from_docs(max_chunks: int = 5, cards_per_chunk: int = 2,
         chunk_text = doc.page_content
         cards = generate_flashcards(chunk_text, count=cards_per_chunk)
         flashcards.extend(cards)
-        print(f"[OK] chunk {i+1}/{len(selected_docs)} -> {len(cards)} cards")
+        logger.info("chunk %d/%d -> %d cards", i + 1, len(selected_docs), len(cards))
         
         # Add delay between chunks to avoid rate limiting (except for last chunk)
         if i < len(selected_docs) - 1:
@@ -151,6 +426,7 @@ def flashcards_to_json(flashcards: List[Dict[str, str]]) -> str:
 
 
 if __name__ == "__main__":
+    configure_logging()
     flashcards = generate_flashcards_from_docs()
     print(flashcards_to_json(flashcards))
 
@@ -0,0 +1,129 @@
+"""
+In-process semantic chunker.
+
+Same idea as LangChain's SemanticChunker with the "percentile" breakpoint
+rule, but sentences are embedded locally with hashed TF-IDF vectors instead
+of one remote embedding call per sentence, so chunking a lecture takes
+milliseconds and needs no network access.
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+try:
+    from .localVectors import adjacent_cosine_distances, combine_sentences
+except ImportError:
+    import sys
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from routes.localVectors import adjacent_cosine_distances, combine_sentences
+
+# Same sentence split rule as SemanticChunker
+SENTENCE_SPLIT_REGEX = r"(?<=[.?!])\s+"
+
+
+def adjacent_embedding_distances(texts: List[str], embeddings: Embeddings) -> np.ndarray:
+    """
+    Compute adjacent cosine distances using an embedding model.
+
+    Args:
+        texts: Texts to compare
+        embeddings: LangChain embeddings model (e.g. CachedEmbeddings)
+
+    Returns:
+        Array of len(texts) - 1 distances
+    """
+    if len(texts) < 2:
+        return np.empty(0, dtype=np.float32)
+
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return 1.0 - np.einsum("ij,ij->i", vectors[:-1], vectors[1:])
+
+
+def find_breakpoints(distances: np.ndarray, breakpoint_percentile: float = 95) -> List[int]:
+    """
+    Find the positions where a new chunk should start.
+
+    Args:
+        distances: Distances between consecutive sentences
+        breakpoint_percentile: Distances above this percentile start a new chunk
+
+    Returns:
+        Sorted indices i such that a chunk ends after sentence i
+    """
+    if len(distances) == 0:
+        return []
+    threshold = np.percentile(distances, breakpoint_percentile)
+    return np.flatnonzero(distances > threshold).tolist()
+
+
+def chunk_segments(segments: List[Dict[str, Any]], breakpoint_percentile: float = 95, buffer_size: int = 1,
+                   embeddings: Optional[Embeddings] = None) -> List[Document]:
+    """
+    Split transcript segments into semantic chunks.
+
+    Args:
+        segments: Transcript segments with id, start, end and text
+        breakpoint_percentile: Distances above this percentile start a new chunk
+        buffer_size: Neighbouring segments included when embedding each segment
+        embeddings: Optional embedding model to use instead of local hashed TF-IDF
+
+    Returns:
+        List of LangChain Document objects with start, end and segment_ids metadata
+    """
+    if not segments:
+        return []
+
+    combined = combine_sentences([seg["text"] for seg in segments], buffer_size)
+    if embeddings is not None:
+        distances = adjacent_embedding_distances(combined, embeddings)
+    else:
+        distances = adjacent_cosine_distances(combined)
+    breakpoints = find_breakpoints(distances, breakpoint_percentile)
+
+    docs = []
+    start_idx = 0
+    for end_idx in breakpoints + [len(segments) - 1]:
+        chunk = segments[start_idx:end_idx + 1]
+        docs.append(Document(
+            page_content=" ".join(seg["text"] for seg in chunk),
+            metadata={"start": chunk[0]["start"], "end": chunk[-1]["end"], "segment_ids": [s["id"] for s in chunk]}
+        ))
+        start_idx = end_idx + 1
+
+    return docs
+
+
+def chunk_text(text: str, breakpoint_percentile: float = 95, buffer_size: int = 1) -> List[Document]:
+    """
+    Split plain transcript text into semantic chunks.
+
+    Used when no timestamped segments are available, so the documents
+    carry no timestamp metadata.
+
+    Args:
+        text: Transcript text
+        breakpoint_percentile: Distances above this percentile start a new chunk
+        buffer_size: Neighbouring sentences included when embedding each sentence
+
+    Returns:
+        List of LangChain Document objects
+    """
+    sentences = [s for s in re.split(SENTENCE_SPLIT_REGEX, text) if s.strip()]
+    if not sentences:
+        return []
+
+    distances = adjacent_cosine_distances(combine_sentences(sentences, buffer_size))
+    breakpoints = find_breakpoints(distances, breakpoint_percentile)
+
+    docs = []
+    start_idx = 0
+    for end_idx in breakpoints + [len(sentences) - 1]:
+        docs.append(Document(page_content=" ".join(sentences[start_idx:end_idx + 1])))
+        start_idx = end_idx + 1
+
+    return docs
@@ -0,0 +1,104 @@
+"""
+Hashed TF-IDF sentence vectors.
+
+Needs only NumPy, so modules that compare text (chapterize, answer_cache)
+can use it without loading LangChain at import time.
+"""
+import re
+import zlib
+from typing import List
+
+import numpy as np
+
+# Number of hashed feature buckets per embedding
+N_FEATURES = 1 << 18
+
+TOKEN_REGEX = re.compile(r"[a-z0-9']+")
+
+
+def combine_sentences(sentences: List[str], buffer_size: int = 1) -> List[str]:
+    """
+    Join each sentence with its neighbours so embeddings carry some context.
+
+    Args:
+        sentences: List of sentences
+        buffer_size: Number of sentences to include on each side
+
+    Returns:
+        One combined string per input sentence
+    """
+    combined = []
+    for i in range(len(sentences)):
+        window = sentences[max(0, i - buffer_size):i + buffer_size + 1]
+        combined.append(" ".join(window))
+    return combined
+
+
+def _hashed_tfidf(texts: List[str]):
+    """
+    Build L2-normalised hashed TF-IDF vectors in sparse (row, col, value) form.
+
+    Args:
+        texts: Texts to embed
+
+    Returns:
+        Tuple of (rows, cols, values) arrays, sorted by row then col
+    """
+    rows = []
+    cols = []
+    features = {}
+    for row, text in enumerate(texts):
+        for token in TOKEN_REGEX.findall(text.lower()):
+            col = features.get(token)
+            if col is None:
+                col = features[token] = zlib.crc32(token.encode()) % N_FEATURES
+            rows.append(row)
+            cols.append(col)
+
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+
+    # Term frequencies: count each (row, col) pair
+    keys = np.asarray(rows, dtype=np.int64) * N_FEATURES + np.asarray(cols, dtype=np.int64)
+    keys, tf = np.unique(keys, return_counts=True)
+    rows = keys // N_FEATURES
+    cols = keys % N_FEATURES
+
+    # Smoothed inverse document frequency, as in scikit-learn
+    n_docs = len(texts)
+    df = np.bincount(cols, minlength=N_FEATURES)
+    idf = np.log((1 + n_docs) / (1 + df[cols])) + 1
+    values = (tf * idf).astype(np.float32)
+
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=n_docs))
+    values /= np.maximum(norms[rows], 1e-12).astype(np.float32)
+
+    return rows, cols, values
+
+
+def adjacent_cosine_distances(texts: List[str]) -> np.ndarray:
+    """
+    Compute the cosine distance between each text and the next one.
+
+    Args:
+        texts: Texts to compare
+
+    Returns:
+        Array of len(texts) - 1 distances
+    """
+    n = len(texts)
+    if n < 2:
+        return np.empty(0, dtype=np.float32)
+
+    rows, cols, values = _hashed_tfidf(texts)
+
+    # Shift every vector down one row so vector i+1 lines up with vector i;
+    # the features they share are then the intersection of the two key sets
+    keys = rows * N_FEATURES + cols
+    shifted = keys - N_FEATURES
+    _, idx, idx_shifted = np.intersect1d(keys, shifted, assume_unique=True, return_indices=True)
+
+    products = values[idx] * values[idx_shifted]
+    similarities = np.bincount(rows[idx], weights=products, minlength=n)[:n - 1]
+
+    return (1.0 - similarities).astype(np.float32)
@@ -0,0 +1,128 @@
+import hmac
+import logging
+import os
+import random
+import re
+import time
+import uuid
+
+from flask import Blueprint, g, jsonify, request, send_from_directory
+
+try:
+    from profiler import PROFILES_FOLDER, PROFILE_SUFFIX, SamplingProfiler, list_profiles, save_profile
+except ImportError:
+    import sys
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from profiler import PROFILES_FOLDER, PROFILE_SUFFIX, SamplingProfiler, list_profiles, save_profile
+
+logger = logging.getLogger(__name__)
+
+# Profiling is off unless enabled: X-Profile is ignored and /api/profiles answers 404
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") != "0"
+# If set, X-Profile and /api/profiles also need this token in the X-Profile-Token header
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# Send "X-Profile: 1" with a request to profile it
+PROFILE_HEADER = "X-Profile"
+PROFILE_TOKEN_HEADER = "X-Profile-Token"
+# Fraction of requests profiled without the header (0 = off)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Milliseconds between stack samples
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Number of most recent profiles kept on disk
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+
+# Never profiled by sampling: scraping and profile downloads would crowd out real requests
+UNSAMPLED_PATHS = ("/api/metrics", "/api/health", "/api/profiles")
+
+profiles_bp = Blueprint("profiles", __name__)
+
+
+def _has_token() -> bool:
+    """Whether the request carries PROFILE_TOKEN, or none is required."""
+    if not PROFILE_TOKEN:
+        return True
+    return hmac.compare_digest(request.headers.get(PROFILE_TOKEN_HEADER, ""), PROFILE_TOKEN)
+
+
+def _should_profile() -> bool:
+    if not PROFILING_ENABLED:
+        return False
+    if request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes") and _has_token():
+        return True
+    if PROFILE_SAMPLE_RATE <= 0 or request.path.startswith(UNSAMPLED_PATHS):
+        return False
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+def _profile_id() -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", request.path).strip("-") or "root"
+    return f"{int(time.time() * 1000)}-{request.method}-{slug[:60]}-{uuid.uuid4().hex[:8]}"
+
+
+@profiles_bp.before_app_request
+def start_profiling():
+    if _should_profile():
+        g.profiler = SamplingProfiler(interval=PROFILE_INTERVAL_MS / 1000).start()
+        g.profile_id = _profile_id()
+
+
+@profiles_bp.after_app_request
+def finish_profiling(response):
+    """
+    Stop the profiler once the response has been sent and save the profile.
+
+    Waiting for the response to close means streamed responses (chat) are
+    profiled until their last event.
+    """
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+
+    name = f"{request.method} {request.path}"
+    profile_id = g.profile_id
+
+    def save():
+        profiler.stop()
+        try:
+            filename = save_profile(profiler, name, profile_id, keep=PROFILE_KEEP)
+            logger.info("Saved profile of %s (%.2fs) to %s", name, profiler.duration, filename)
+        except OSError:
+            logger.exception("Could not save profile of %s", name)
+
+    response.call_on_close(save)
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+
+@profiles_bp.before_request
+def check_access():
+    """Profiles expose code paths and timings, so only serve them when profiling is enabled."""
+    if not PROFILING_ENABLED:
+        return jsonify({"error": "Not found"}), 404
+    if not _has_token():
+        return jsonify({"error": f"Missing or invalid {PROFILE_TOKEN_HEADER} header"}), 403
+
+
+@profiles_bp.route("/api/profiles", methods=["GET"])
+def get_profiles():
+    """List recent request profiles, newest first."""
+    profiles = list_profiles()
+    for profile in profiles:
+        profile["url"] = f"/api/profiles/{profile['filename']}"
+    return jsonify({"profiles": profiles}), 200
+
+
+@profiles_bp.route("/api/profiles/<path:filename>", methods=["GET"])
+def download_profile(filename):
+    """
+    Download a profile in speedscope format.
+
+    filename may also be a profile ID, as returned in the X-Profile-Id
+    response header. Open the file at https://www.speedscope.app to view the
+    flame graph.
+    """
+    if not filename.endswith(PROFILE_SUFFIX):
+        filename += PROFILE_SUFFIX
+    return send_from_directory(os.path.abspath(PROFILES_FOLDER), filename, as_attachment=True,
+                               mimetype="application/json")
@@ -0,0 +1,90 @@
+import logging
+import sqlite3
+import time
+
+from flask import Blueprint, jsonify, request
+
+try:
+    from cache import get_lecture_video_id, get_video_cache_key
+    from search_index import get_search_index
+    import metrics
+except ImportError:
+    import sys
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from cache import get_lecture_video_id, get_video_cache_key
+    from search_index import get_search_index
+    import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+SEARCH_DURATION = metrics.histogram(
+    "search_query_duration_seconds",
+    "Time to run a transcript search query"
+)
+
+search_bp = Blueprint("search", __name__)
+
+
+@search_bp.route("/api/search", methods=["GET"])
+def search():
+    """
+    Search the transcripts of all cached lectures.
+
+    Query parameters:
+        q: Words to search for; hits contain every word ("word*" matches prefixes)
+        video_id: Optional, only search this uploaded video's lecture
+        limit: Hits per page (default 20, max 100)
+        offset: Hits to skip
+
+    Returns hits ordered by relevance, each with the lecture's cache_key and
+    filename, the video_id to play it from (the given one, else the
+    lecture's latest upload; null if none is known), the segment's id, start
+    and end time, and a snippet with the matched words in <mark> tags.
+    """
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+
+    try:
+        limit = min(max(int(request.args.get("limit", DEFAULT_SEARCH_LIMIT)), 1), MAX_SEARCH_LIMIT)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+
+    cache_key = None
+    video_id = request.args.get("video_id")
+    if video_id:
+        cache_key = get_video_cache_key(video_id)
+        if cache_key is None:
+            return jsonify({"error": "Video not found"}), 404
+
+    start = time.perf_counter()
+    try:
+        # One extra hit tells whether there is another page
+        hits = get_search_index().search(query, limit=limit + 1, offset=offset, cache_key=cache_key)
+        has_more = len(hits) > limit
+    except sqlite3.OperationalError as e:
+        logger.warning("Search for %r failed: %s", query, e)
+        return jsonify({"error": "Invalid search query"}), 400
+    took = time.perf_counter() - start
+    SEARCH_DURATION.observe(took)
+
+    # Hits are per lecture; point each at a video that can be played
+    hits = hits[:limit]
+    video_ids = {cache_key: video_id} if cache_key else {
+        key: get_lecture_video_id(key) for key in {hit["cache_key"] for hit in hits}
+    }
+    for hit in hits:
+        hit["video_id"] = video_ids[hit["cache_key"]]
+
+    return jsonify({
+        "query": query,
+        "results": hits,
+        "offset": offset,
+        "has_more": has_more,
+        "took_ms": round(took * 1000, 2)
+    }), 200
@@ -0,0 +1,271 @@
+"""
+Full-text search over the transcripts of all cached lectures.
+
+Transcript segments are stored in a SQLite table with an FTS5 index over
+their text, updated incrementally whenever a lecture is cached (see
+cache.save_to_cache). Queries return segments ranked by BM25 with a
+highlighted snippet, without opening any cached transcript file.
+
+Lectures cached before the index existed can be added with:
+    python search_index.py --rebuild
+"""
+import html
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', 'data/search/index.db')
+
+# Words of context around the matched terms in a snippet
+SNIPPET_WORDS = 16
+# Markers FTS5 puts around matched terms; replaced by <mark> tags once the
+# rest of the snippet is HTML-escaped
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+_TOKEN_REGEX = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lectures (
+    cache_key TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    segment_count INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    cache_key TEXT NOT NULL,
+    segment_id INTEGER NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_cache_key ON segments (cache_key);
+CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+    text, content='segments', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS segments_ai AFTER INSERT ON segments BEGIN
+    INSERT INTO segments_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_ad AFTER DELETE ON segments BEGIN
+    INSERT INTO segments_fts (segments_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def to_fts_query(query: str) -> Optional[str]:
+    """
+    Turn free text into an FTS5 query matching segments that contain every word.
+
+    Words are quoted so punctuation and FTS5 operators in user input are
+    matched literally; a trailing "*" on a word keeps prefix matching.
+
+    Returns:
+        The FTS5 query, or None if the text has no searchable words
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith('*')
+        tokens = _TOKEN_REGEX.findall(word)
+        if tokens:
+            phrase = '"' + ' '.join(tokens) + '"'
+            terms.append(phrase + ('*' if prefix else ''))
+    return ' '.join(terms) or None
+
+
+def _highlight(snippet: str) -> str:
+    """HTML-escape a snippet and wrap matched terms in <mark> tags."""
+    return html.escape(snippet).replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+
+
+class SearchIndex:
+    """
+    FTS5 index of transcript segments in a local SQLite database (WAL mode),
+    shared by all worker processes on the same host.
+    """
+
+    def __init__(self, path: str = SEARCH_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def index_lecture(self, cache_key: str, filename: str, segments: List[Dict[str, Any]]) -> None:
+        """
+        Add a lecture's segments to the index, replacing any earlier version.
+
+        Args:
+            cache_key: Cache key of the lecture
+            filename: Original filename, returned with hits
+            segments: Transcript segments with id, start, end and text
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM segments WHERE cache_key = ?', (cache_key,))
+            conn.executemany(
+                'INSERT INTO segments (cache_key, segment_id, start, end, text) VALUES (?, ?, ?, ?, ?)',
+                (
+                    (cache_key, seg.get('id', i), seg['start'], seg['end'], seg['text'].strip())
+                    for i, seg in enumerate(segments)
+                )
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO lectures (cache_key, filename, segment_count, indexed_at) VALUES (?, ?, ?, ?)',
+                (cache_key, filename, len(segments), time.time())
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def remove_lecture(self, cache_key: str) -> None:
+        """Remove a lecture from the index."""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM segments WHERE cache_key = ?', (cache_key,))
+            conn.execute('DELETE FROM lectures WHERE cache_key = ?', (cache_key,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def is_indexed(self, cache_key: str) -> bool:
+        row = self._connect().execute('SELECT 1 FROM lectures WHERE cache_key = ?', (cache_key,)).fetchone()
+        return row is not None
+
+    def search(self, query: str, limit: int = 20, offset: int = 0,
+               cache_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Find the transcript segments best matching a query.
+
+        Args:
+            query: Free-text query; segments must contain every word
+            limit: Maximum number of hits
+            offset: Number of hits to skip, for paging
+            cache_key: Only search this lecture
+
+        Returns:
+            Hits ordered by relevance, each with cache_key, filename,
+            segment_id, start, end, an HTML snippet with the matched terms
+            in <mark> tags, and its BM25 score (lower is better)
+        """
+        fts_query = to_fts_query(query)
+        if fts_query is None:
+            return []
+
+        sql = f"""
+            SELECT s.cache_key, l.filename, s.segment_id, s.start, s.end,
+                   snippet(segments_fts, 0, ?, ?, '...', {SNIPPET_WORDS}) AS snippet,
+                   bm25(segments_fts) AS score
+            FROM segments_fts
+            JOIN segments s ON s.id = segments_fts.rowid
+            JOIN lectures l ON l.cache_key = s.cache_key
+            WHERE segments_fts MATCH ?
+        """
+        params: List[Any] = [_MATCH_START, _MATCH_END, fts_query]
+        if cache_key:
+            sql += ' AND s.cache_key = ?'
+            params.append(cache_key)
+        sql += ' ORDER BY score LIMIT ? OFFSET ?'
+        params += [limit, offset]
+
+        rows = self._connect().execute(sql, params).fetchall()
+        return [
+            {
+                'cache_key': key,
+                'filename': filename,
+                'segment_id': segment_id,
+                'start': start,
+                'end': end,
+                'snippet': _highlight(snippet),
+                'score': score,
+            }
+            for key, filename, segment_id, start, end, snippet, score in rows
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        lectures = conn.execute('SELECT COUNT(*) FROM lectures').fetchone()[0]
+        segments = conn.execute('SELECT COUNT(*) FROM segments').fetchone()[0]
+        return {'lectures': lectures, 'segments': segments}
+
+
+def get_search_index() -> SearchIndex:
+    """Get the process-wide search index, creating it on first use."""
+    global _default_index
+    if _default_index is None:
+        with _default_index_lock:
+            if _default_index is None:
+                _default_index = SearchIndex()
+    return _default_index
+
+
+def rebuild(missing_only: bool = False) -> int:
+    """
+    Index every lecture in the cache.
+
+    Args:
+        missing_only: Skip lectures that are already indexed
+
+    Returns:
+        Number of lectures indexed
+    """
+    import json
+    from cache import CACHE_FOLDER, cache_exists, get_cache_index
+
+    index = get_search_index()
+    filenames = {key: name for name, key in get_cache_index().items() if not name.startswith('sha256:')}
+    count = 0
+    for cache_key in sorted(os.listdir(CACHE_FOLDER)) if os.path.isdir(CACHE_FOLDER) else []:
+        if not cache_exists(cache_key) or (missing_only and index.is_indexed(cache_key)):
+            continue
+        with open(os.path.join(CACHE_FOLDER, cache_key, 'transcript_segments.json'), 'r') as f:
+            segments = json.load(f)
+        index.index_lecture(cache_key, filenames.get(cache_key, cache_key), segments)
+        count += 1
+    return count
+
+
+def main():
+    import argparse
+    import json
+    from telemetry import configure_logging
+
+    configure_logging()
+    parser = argparse.ArgumentParser(description='Build or query the transcript search index.')
+    parser.add_argument('--rebuild', action='store_true', help='Index every cached lecture')
+    parser.add_argument('--missing-only', action='store_true', help='With --rebuild, skip lectures already indexed')
+    parser.add_argument('query', nargs='?', help='Search the index')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        print(f"Indexed {rebuild(args.missing_only)} lectures")
+    if args.query:
+        print(json.dumps(get_search_index().search(args.query), indent=2))
+    if not args.rebuild and not args.query:
+        print(json.dumps(get_search_index().stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Lazy access to heavy third-party dependencies.
+
+Whisper (and with it torch) and the Gemini SDK take seconds to import, so
+they are only loaded the first time a request actually needs them. This keeps
+process start-up, test collection and lightweight endpoints like /api/health
+fast.
+"""
+import os
+import threading
+
+_lock = threading.Lock()
+_genai = None
+_whisper = None
+
+
+def get_genai():
+    """
+    Get the google.generativeai module, configured with GEMINI_API_KEY.
+    
+    The .env file is loaded and the API key configured on first use only.
+    """
+    global _genai
+    if _genai is None:
+        with _lock:
+            if _genai is None:
+                from dotenv import load_dotenv
+                import google.generativeai as genai
+                
+                load_dotenv()
+                genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+                _genai = genai
+    return _genai
+
+
+def get_whisper():
+    """Get the whisper module, importing it (and torch) on first use."""
+    global _whisper
+    if _whisper is None:
+        with _lock:
+            if _whisper is None:
+                import whisper
+                _whisper = whisper
+    return _whisper
+
+
+def override(genai=None, whisper=None) -> None:
+    """
+    Replace the Gemini SDK and/or Whisper with stand-ins implementing the
+    same calls (used by the offline benchmarks, see benchmarks/fakes.py).
+    
+    Must be called before the first model is created.
+    """
+    global _genai, _whisper
+    with _lock:
+        if genai is not None:
+            _genai = genai
+        if whisper is not None:
+            _whisper = whisper
@@ -0,0 +1,360 @@
+import abc
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+DEFAULT_STATE_URL = 'sqlite:///data/state/state.db'
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+class StateStore(abc.ABC):
+    """
+    Key-value store for state that must be shared between server workers
+    (chat histories, job status). Values are JSON-serializable objects grouped
+    by namespace.
+
+    Values set with a ttl expire that many seconds later: they are no longer
+    returned or counted, and cleanup() deletes them. Lists built with append()
+    are kept apart from plain values, so concurrent appends never lose items.
+    """
+
+    @abc.abstractmethod
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        """Get a value, or default if it is missing or expired."""
+
+    @abc.abstractmethod
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Set a value, expiring after ttl seconds if given."""
+
+    @abc.abstractmethod
+    def compare_and_set(self, namespace: str, key: str, expected: Any, value: Any,
+                        ttl: Optional[float] = None) -> bool:
+        """
+        Set a value only if the current one equals expected (None: the key
+        is missing or expired), e.g. to claim work exactly once.
+
+        Returns:
+            True if the value was set
+        """
+
+    @abc.abstractmethod
+    def delete(self, namespace: str, key: str) -> None:
+        """Delete a value and the list under the same key."""
+
+    @abc.abstractmethod
+    def count(self, namespace: str) -> int:
+        """Number of values in a namespace that have not expired."""
+
+    @abc.abstractmethod
+    def scan(self, namespace: str, prefix: str = '') -> Dict[str, Any]:
+        """Values in a namespace whose key starts with prefix, by key (expired ones left out)."""
+
+    @abc.abstractmethod
+    def append(self, namespace: str, key: str, items: List[Any], ttl: Optional[float] = None) -> None:
+        """
+        Atomically add items to the end of a list. With a ttl, the whole list
+        expires ttl seconds after this append.
+        """
+
+    @abc.abstractmethod
+    def get_list(self, namespace: str, key: str) -> List[Any]:
+        """Items of a list in the order they were appended ([] if missing or expired)."""
+
+    @abc.abstractmethod
+    def cleanup(self) -> int:
+        """Delete expired values and lists. Returns how many were deleted."""
+
+
+def _expires_at(ttl: Optional[float]) -> Optional[float]:
+    return time.time() + ttl if ttl is not None else None
+
+
+def _live(expires_at: Optional[float], now: float) -> bool:
+    return expires_at is None or expires_at > now
+
+
+class MemoryStateStore(StateStore):
+    """In-process store. Only suitable for a single worker (e.g. the dev server)."""
+
+    def __init__(self):
+        # namespace -> key -> (JSON value, expires_at)
+        self._data = {}
+        # namespace -> key -> ([JSON item, ...], expires_at)
+        self._lists = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            value, expires_at = self._data.get(namespace, {}).get(key, (None, None))
+        # Round-trip through JSON so callers never share mutable state,
+        # matching the behaviour of the persistent backends
+        return json.loads(value) if value is not None and _live(expires_at, time.time()) else default
+
+    def set(self, namespace, key, value, ttl=None):
+        encoded = json.dumps(value)
+        with self._lock:
+            self._data.setdefault(namespace, {})[key] = (encoded, _expires_at(ttl))
+
+    def compare_and_set(self, namespace, key, expected, value, ttl=None):
+        expected_encoded = json.dumps(expected) if expected is not None else None
+        encoded = json.dumps(value)
+        with self._lock:
+            entries = self._data.setdefault(namespace, {})
+            current, expires_at = entries.get(key, (None, None))
+            if current is not None and not _live(expires_at, time.time()):
+                current = None
+            if current != expected_encoded:
+                return False
+            entries[key] = (encoded, _expires_at(ttl))
+            return True
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.get(namespace, {}).pop(key, None)
+            self._lists.get(namespace, {}).pop(key, None)
+
+    def count(self, namespace):
+        now = time.time()
+        with self._lock:
+            return sum(_live(expires_at, now) for _, expires_at in self._data.get(namespace, {}).values())
+
+    def scan(self, namespace, prefix=''):
+        now = time.time()
+        with self._lock:
+            found = [(key, value) for key, (value, expires_at) in self._data.get(namespace, {}).items()
+                     if key.startswith(prefix) and _live(expires_at, now)]
+        return {key: json.loads(value) for key, value in found}
+
+    def append(self, namespace, key, items, ttl=None):
+        encoded = [json.dumps(item) for item in items]
+        now = time.time()
+        with self._lock:
+            lists = self._lists.setdefault(namespace, {})
+            current, expires_at = lists.get(key, ([], None))
+            if not _live(expires_at, now):
+                current = []
+            lists[key] = (current + encoded, _expires_at(ttl))
+
+    def get_list(self, namespace, key):
+        with self._lock:
+            items, expires_at = self._lists.get(namespace, {}).get(key, ([], None))
+        return [json.loads(item) for item in items] if _live(expires_at, time.time()) else []
+
+    def cleanup(self):
+        now = time.time()
+        deleted = 0
+        with self._lock:
+            for entries in list(self._data.values()) + list(self._lists.values()):
+                for key in [key for key, (_, expires_at) in entries.items() if not _live(expires_at, now)]:
+                    del entries[key]
+                    deleted += 1
+        return deleted
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Store backed by a local SQLite database in WAL mode, shared by all worker
+    processes on the same host.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS state (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        # Databases created before values could expire
+        if 'expires_at' not in [row[1] for row in conn.execute('PRAGMA table_info(state)')]:
+            conn.execute('ALTER TABLE state ADD COLUMN expires_at REAL')
+        conn.execute('CREATE INDEX IF NOT EXISTS state_expires_at ON state (expires_at)')
+        # One row per list item; seq keeps them in append order
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS state_lists (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL
+            )
+            """
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS state_lists_key ON state_lists (namespace, key, seq)')
+        conn.execute('CREATE INDEX IF NOT EXISTS state_lists_expires_at ON state_lists (expires_at)')
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace, key, default=None):
+        row = self._connect().execute(
+            'SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (namespace, key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, namespace, key, value, ttl=None):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO state (namespace, key, value, updated_at, expires_at) VALUES (?, ?, ?, ?, ?)',
+            (namespace, key, json.dumps(value), time.time(), _expires_at(ttl))
+        )
+
+    def compare_and_set(self, namespace, key, expected, value, ttl=None):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)',
+                (namespace, key, now)
+            ).fetchone()
+            if (row[0] if row else None) != (json.dumps(expected) if expected is not None else None):
+                conn.execute('COMMIT')
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO state (namespace, key, value, updated_at, expires_at) VALUES (?, ?, ?, ?, ?)',
+                (namespace, key, json.dumps(value), now, _expires_at(ttl))
+            )
+            conn.execute('COMMIT')
+            return True
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, namespace, key):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM state WHERE namespace = ? AND key = ?', (namespace, key))
+            conn.execute('DELETE FROM state_lists WHERE namespace = ? AND key = ?', (namespace, key))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def count(self, namespace):
+        row = self._connect().execute(
+            'SELECT COUNT(*) FROM state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (namespace, time.time())
+        ).fetchone()
+        return row[0]
+
+    def scan(self, namespace, prefix=''):
+        rows = self._connect().execute(
+            """
+            SELECT key, value FROM state
+            WHERE namespace = ? AND key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)
+            """,
+            # A key range rather than LIKE, so the primary key index is used
+            (namespace, prefix, prefix + '\U0010ffff', time.time())
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def append(self, namespace, key, items, ttl=None):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # An expired list starts over instead of coming back to life
+            conn.execute(
+                'DELETE FROM state_lists WHERE namespace = ? AND key = ? AND expires_at <= ?',
+                (namespace, key, now)
+            )
+            conn.executemany(
+                'INSERT INTO state_lists (namespace, key, value) VALUES (?, ?, ?)',
+                [(namespace, key, json.dumps(item)) for item in items]
+            )
+            conn.execute(
+                'UPDATE state_lists SET expires_at = ? WHERE namespace = ? AND key = ?',
+                (_expires_at(ttl), namespace, key)
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get_list(self, namespace, key):
+        rows = self._connect().execute(
+            """
+            SELECT value FROM state_lists
+            WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)
+            ORDER BY seq
+            """,
+            (namespace, key, time.time())
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def cleanup(self):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            deleted = conn.execute('DELETE FROM state WHERE expires_at <= ?', (now,)).rowcount
+            deleted += conn.execute(
+                'SELECT COUNT(*) FROM (SELECT DISTINCT namespace, key FROM state_lists WHERE expires_at <= ?)', (now,)
+            ).fetchone()[0]
+            conn.execute('DELETE FROM state_lists WHERE expires_at <= ?', (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return deleted
+
+
+def create_state_store(url: Optional[str] = None) -> StateStore:
+    """
+    Create a state store from a URL.
+
+    Supported URLs:
+        memory://                 In-process dict (single worker only)
+        sqlite:///relative/path   SQLite database file (relative to the working dir)
+        sqlite:////absolute/path  SQLite database file
+
+    Args:
+        url: Store URL. Defaults to the STATE_BACKEND environment variable,
+             then to a SQLite database under data/state.
+
+    Returns:
+        StateStore instance
+    """
+    url = url or os.getenv('STATE_BACKEND') or DEFAULT_STATE_URL
+
+    if url == 'memory://':
+        return MemoryStateStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStateStore(url[len('sqlite:///'):])
+
+    raise ValueError(f"Unsupported state backend: {url}")
+
+
+def get_state_store() -> StateStore:
+    """Get the process-wide state store, creating it from STATE_BACKEND on first use."""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = create_state_store()
+    return _default_store
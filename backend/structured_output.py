@@ -0,0 +1,269 @@
+"""
+Schema-constrained JSON output for LLM calls.
+
+Schemas use the OpenAPI subset Gemini accepts as a response schema
+(OBJECT / ARRAY / STRING / NUMBER / INTEGER with properties, required and
+items), so the same schema both constrains generation and validates the
+result locally. Invalid output is first repaired locally (code fences,
+surrounding prose, trailing commas, numbers sent as strings, wrapped or
+unwrapped lists); only if that fails is the model re-asked, a bounded number
+of times.
+"""
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+Schema = Dict[str, Any]
+
+STRUCTURED_OUTPUT = metrics.counter(
+    'llm_structured_output_total',
+    'Structured LLM responses by outcome (valid, repaired, reasked, failed)',
+    ['call_site', 'outcome']
+)
+PARSE_FAILURES = metrics.counter(
+    'llm_parse_failures_total',
+    'LLM responses that were not valid JSON for their schema, even after local repair',
+    ['call_site']
+)
+
+
+class StructuredOutputError(ValueError):
+    """Raised when an LLM response could not be turned into schema-valid JSON."""
+
+    def __init__(self, errors: List[str], text: str):
+        super().__init__("; ".join(errors[:5]))
+        self.errors = errors
+        self.text = text
+
+
+def validate(data: Any, schema: Schema, path: str = "$") -> List[str]:
+    """
+    Validate data against a schema.
+
+    Args:
+        data: Parsed JSON value
+        schema: Schema to validate against
+        path: Location of data in the document, for error messages
+
+    Returns:
+        List of error messages (empty if valid)
+    """
+    kind = schema["type"]
+
+    if kind == "OBJECT":
+        if not isinstance(data, dict):
+            return [f"{path}: expected object"]
+        errors = [f"{path}: missing '{key}'" for key in schema.get("required", []) if key not in data]
+        for key, prop_schema in schema.get("properties", {}).items():
+            if key in data:
+                errors.extend(validate(data[key], prop_schema, f"{path}.{key}"))
+        return errors
+
+    if kind == "ARRAY":
+        if not isinstance(data, list):
+            return [f"{path}: expected array"]
+        errors = []
+        for i, item in enumerate(data):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+        return errors
+
+    if kind == "STRING":
+        return [] if isinstance(data, str) else [f"{path}: expected string"]
+    if kind == "INTEGER":
+        return [] if isinstance(data, int) and not isinstance(data, bool) else [f"{path}: expected integer"]
+    if kind == "NUMBER":
+        return [] if isinstance(data, (int, float)) and not isinstance(data, bool) else [f"{path}: expected number"]
+
+    raise ValueError(f"Unsupported schema type: {kind}")
+
+
+def _parse_number(value: str) -> float:
+    """Parse "12.5", "75s" or "1:15" / "1:01:15" timestamps as a number of seconds."""
+    value = value.strip().rstrip("s")
+    if ":" in value:
+        seconds = 0.0
+        for part in value.split(":"):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    return float(value)
+
+
+def coerce(data: Any, schema: Schema) -> Any:
+    """
+    Fix common near-misses so data matches the schema.
+
+    Converts numbers sent as strings, wraps a bare list in the object that
+    should contain it (or unwraps a list the model wrapped in an object), and
+    drops array items that are still invalid, as long as some remain.
+    """
+    kind = schema["type"]
+
+    if kind == "OBJECT":
+        properties = schema.get("properties", {})
+        if isinstance(data, list):
+            array_keys = [k for k, p in properties.items() if p["type"] == "ARRAY"]
+            if len(array_keys) == 1:
+                data = {array_keys[0]: data}
+        if isinstance(data, dict):
+            data = {
+                key: coerce(value, properties[key]) if key in properties else value
+                for key, value in data.items()
+            }
+        return data
+
+    if kind == "ARRAY":
+        if isinstance(data, dict):
+            lists = [v for v in data.values() if isinstance(v, list)]
+            if len(lists) == 1:
+                data = lists[0]
+        if isinstance(data, list):
+            items = [coerce(item, schema["items"]) for item in data]
+            valid = [item for item in items if not validate(item, schema["items"])]
+            data = valid or items
+        return data
+
+    try:
+        if kind == "NUMBER" and isinstance(data, str):
+            return _parse_number(data)
+        if kind == "INTEGER" and isinstance(data, str):
+            return int(round(_parse_number(data)))
+        if kind == "INTEGER" and isinstance(data, float) and data.is_integer():
+            return int(data)
+    except ValueError:
+        return data
+    if kind == "STRING" and isinstance(data, (int, float)) and not isinstance(data, bool):
+        return str(data)
+    return data
+
+
+def _extract_json(text: str) -> Optional[str]:
+    """
+    Find the first complete JSON object or array in text, skipping any prose
+    or code fences around it.
+    """
+    start = next((i for i, c in enumerate(text) if c in "{["), None)
+    if start is None:
+        return None
+
+    stack = []
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+        elif c in "}]":
+            if not stack or stack.pop() != c:
+                return None
+            if not stack:
+                return text[start:i + 1]
+
+    # Truncated output: close whatever is still open
+    if in_string:
+        return None
+    return text[start:] + "".join(reversed(stack))
+
+
+def repair_json(text: str) -> Optional[Any]:
+    """
+    Try to recover a JSON value from malformed model output.
+
+    Returns:
+        The parsed value, or None if nothing could be recovered
+    """
+    candidate = _extract_json(text.replace("“", '"').replace("”", '"'))
+    if candidate is None:
+        return None
+    candidate = re.sub(r",\s*([}\]])", r"\1", candidate)
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        return None
+
+
+def parse_structured(text: str, schema: Schema) -> Tuple[Any, List[str], bool]:
+    """
+    Parse and validate a model response, repairing it locally if needed.
+
+    Args:
+        text: Raw response text
+        schema: Expected schema
+
+    Returns:
+        Tuple of (data, errors, repaired). errors is empty on success.
+    """
+    try:
+        data = json.loads(text)
+        errors = validate(data, schema)
+        if not errors:
+            return data, [], False
+    except json.JSONDecodeError as e:
+        data, errors = None, [f"invalid JSON: {e}"]
+
+    repaired = repair_json(text) if data is None else data
+    if repaired is None:
+        return None, errors, False
+
+    repaired = coerce(repaired, schema)
+    repaired_errors = validate(repaired, schema)
+    if repaired_errors:
+        return None, repaired_errors, False
+    return repaired, [], True
+
+
+def generate_structured(generate: Callable[[str], str], prompt: str, schema: Schema, call_site: str, max_reasks: int = 1) -> Any:
+    """
+    Run an LLM call that must return JSON matching a schema.
+
+    The response is validated and, if needed, repaired locally. If it is
+    still invalid, the model is re-asked with the validation errors, up to
+    max_reasks times.
+
+    Args:
+        generate: Function sending a prompt to the model (with schema-constrained
+                  output enabled) and returning the response text
+        prompt: Prompt to send
+        schema: Expected schema
+        call_site: Name of the calling feature, for metrics
+        max_reasks: Maximum number of follow-up requests after invalid output
+
+    Returns:
+        Schema-valid data
+
+    Raises:
+        StructuredOutputError: If no valid response was obtained
+    """
+    current_prompt = prompt
+    for attempt in range(max_reasks + 1):
+        text = generate(current_prompt)
+        data, errors, repaired = parse_structured(text, schema)
+
+        if not errors:
+            outcome = "reasked" if attempt else ("repaired" if repaired else "valid")
+            STRUCTURED_OUTPUT.inc(call_site=call_site, outcome=outcome)
+            return data
+
+        PARSE_FAILURES.inc(call_site=call_site)
+        logger.warning("Invalid structured output from %s (attempt %d): %s", call_site, attempt + 1, errors[:3])
+        current_prompt = (
+            f"{prompt}\n\n"
+            f"Your previous response was not valid: {'; '.join(errors[:5])}.\n"
+            f"Respond ONLY with JSON matching this schema:\n{json.dumps(schema)}"
+        )
+
+    STRUCTURED_OUTPUT.inc(call_site=call_site, outcome="failed")
+    raise StructuredOutputError(errors, text)
@@ -1,10 +1,20 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
-# Setup and Configuration
-load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+from resilience import GEMINI_BREAKER, DeadlineExceeded, LLMUnavailableError, bind_budget, call_llm, llm_timeout
+from services import get_genai
+from telemetry import configure_logging, llm_call
+
+logger = logging.getLogger(__name__)
+
+# Concurrent Gemini calls when summarizing chapters
+SUMMARY_MAX_WORKERS = 4
+# Span length used to split the transcript when there are no chapters
+FALLBACK_SPAN_SECONDS = 600
+# Window size used to split plain text that has no timestamps
+TEXT_WINDOW_WORDS = 3000
 
 # Use a model appropriate for text (Gemini 1.5 Flash is fast and efficient)
 _model = None
@@ -13,26 +23,203 @@ def get_model():
     """Get or initialize the Gemini model (cached)."""
     global _model
     if _model is None:
-        _model = genai.GenerativeModel('gemini-2.5-flash')
+        _model = get_genai().GenerativeModel('gemini-2.5-flash')
     return _model
 
-def initialize_chat(transcript_text: str):
+def _generate_text(prompt: str, call_site: str, fallback=None) -> str:
+    """Run a single-turn prompt and return the response text (or fallback()'s when Gemini is unavailable)."""
+    def attempt(timeout):
+        with llm_call(call_site) as call:
+            response = get_model().generate_content(prompt, request_options={"timeout": timeout})
+            call["usage"] = getattr(response, "usage_metadata", None)
+        return response.text.strip()
+    return call_llm(call_site, attempt, fallback=fallback)
+
+def extractive_summary(text: str, max_sentences: int = 2, max_chars: int = 300) -> str:
     """
-    Initialize a chat session with transcript context.
+    Summarize text locally by taking its first sentences, as a degraded
+    fallback when Gemini is unavailable.
     
     Args:
-        transcript_text: Full transcript text to use as context
+        text: Text to summarize
+        max_sentences: Number of leading sentences to keep
+        max_chars: Maximum length of the result
         
     Returns:
-        ChatSession object
+        The leading sentences, truncated at a word boundary if too long
+    """
+    sentences = re.split(r"(?<=[.?!])\s+", text.strip())
+    summary = " ".join(sentences[:max_sentences])
+    if len(summary) > max_chars:
+        summary = summary[:max_chars].rsplit(" ", 1)[0] + "..."
+    return summary
+
+def summarize_section(text: str, title: Optional[str] = None) -> str:
     """
-    print(f"[DEBUG] initialize_chat called with transcript_text length: {len(transcript_text) if transcript_text else 0}")
-    print(f"[DEBUG] transcript_text preview (first 200 chars): {transcript_text[:200] if transcript_text else 'EMPTY OR NONE'}")
+    Summarize one section (e.g. a chapter) of a lecture.
     
-    model = get_model()
-    chat = model.start_chat(history=[])
+    Args:
+        text: Transcript text of the section
+        title: Optional section title, for context
+        
+    Returns:
+        One or two sentence description of the section
+    """
+    heading = f'titled "{title}" ' if title else ''
+    prompt = f"""
+    Below is one section {heading}of a lecture transcript.
+    Describe what this section covers in 1-2 short sentences. Respond with the description only.
+    
+    SECTION:
+    {text}
+    """
+    return _generate_text(prompt, "summary_section", fallback=lambda: extractive_summary(text))
+
+def summarize_sections(texts: List[str], titles: Optional[List[str]] = None, max_workers: int = SUMMARY_MAX_WORKERS) -> List[str]:
+    """
+    Summarize lecture sections in parallel (the "map" step).
+    
+    Args:
+        texts: Transcript text of each section
+        titles: Optional title of each section
+        max_workers: Maximum number of concurrent Gemini calls
+        
+    Returns:
+        Summary of each section, in order. Sections Gemini cannot summarize get
+        an extractive summary (see extractive_summary), or an empty one on other errors.
+    """
+    titles = titles or [None] * len(texts)
+    
+    def summarize(args):
+        text, title = args
+        if not text.strip():
+            return ""
+        try:
+            return summarize_section(text, title)
+        except Exception as e:
+            logger.warning("Error summarizing section %r: %s", title, e)
+            return ""
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(bind_budget(summarize), zip(texts, titles)))
+
+def reduce_summaries(section_summaries: List[str], titles: Optional[List[str]] = None) -> str:
+    """
+    Combine section summaries into one lecture summary (the "reduce" step).
+    
+    Args:
+        section_summaries: Summary of each section, in lecture order
+        titles: Optional title of each section
+        
+    Returns:
+        Lecture summary text
+    """
+    titles = titles or [f"Part {i + 1}" for i in range(len(section_summaries))]
+    outline = "\n".join(
+        f"{i + 1}. {title}: {summary}"
+        for i, (title, summary) in enumerate(zip(titles, section_summaries))
+        if summary
+    )
+    
+    prompt = f"""
+    Below are summaries of the consecutive sections of a lecture.
+    Please summarize this lecture for me. Please keep it short and simple while still capturing a big picture.
+    
+    SECTION SUMMARIES:
+    {outline}
+    """
+    def fallback():
+        return " ".join(extractive_summary(summary, max_sentences=1) for summary in section_summaries if summary)
+    
+    return _generate_text(prompt, "summary_reduce", fallback=fallback)
+
+def section_texts(segments: List[Dict[str, Any]], spans: List[Dict[str, Any]]) -> List[str]:
+    """
+    Get the transcript text of each span (chapter).
+    
+    Args:
+        segments: Transcript segments
+        spans: Dicts with start_time and end_time
+        
+    Returns:
+        Text of the segments starting inside each span
+    """
+    texts = []
+    for i, span in enumerate(spans):
+        is_last = i == len(spans) - 1
+        texts.append(" ".join(
+            seg["text"] for seg in segments
+            if seg["start"] >= span["start_time"] and (seg["start"] < span["end_time"] or is_last)
+        ))
+    return texts
+
+def summarize_lecture(segments: List[Dict[str, Any]], chapters: List[Dict[str, Any]],
+                      max_workers: int = SUMMARY_MAX_WORKERS) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Summarize a lecture hierarchically: each chapter is summarized in
+    parallel, then the chapter summaries are combined into the lecture summary.
+    
+    If there are no chapters, fixed-length spans of the transcript are used instead.
+    
+    Args:
+        segments: Transcript segments
+        chapters: Chapters from generate_chapters()
+        max_workers: Maximum number of concurrent Gemini calls
+        
+    Returns:
+        Tuple of (chapters with a "description" added to each, lecture summary)
+    """
+    if not segments:
+        return chapters, "Error: No summary available"
+    
+    spans = chapters
+    if not spans:
+        end = segments[-1]["end"]
+        spans = [
+            {"chapter_name": None, "start_time": t, "end_time": min(t + FALLBACK_SPAN_SECONDS, end)}
+            for t in range(0, int(end) + 1, FALLBACK_SPAN_SECONDS)
+        ]
+    
+    titles = [span.get("chapter_name") for span in spans]
+    descriptions = summarize_sections(section_texts(segments, spans), titles, max_workers)
+    
+    for chapter, description in zip(chapters, descriptions):
+        chapter["description"] = description
+    
+    summary = reduce_summaries(descriptions, titles if chapters else None)
+    return chapters, summary
+
+def summarize_text(transcript_text: str, max_workers: int = SUMMARY_MAX_WORKERS) -> str:
+    """
+    Summarize plain transcript text, map-reducing over fixed-size windows
+    when it is too long for one short prompt.
     
-    initial_prompt = f"""
+    Args:
+        transcript_text: Full transcript text
+        max_workers: Maximum number of concurrent Gemini calls
+        
+    Returns:
+        Lecture summary text
+    """
+    words = transcript_text.split()
+    windows = [" ".join(words[i:i + TEXT_WINDOW_WORDS]) for i in range(0, len(words), TEXT_WINDOW_WORDS)]
+    if len(windows) <= 1:
+        return reduce_summaries([transcript_text])
+    return reduce_summaries(summarize_sections(windows, max_workers=max_workers))
+
+def chat_context(transcript_text: str, summary: str) -> list:
+    """
+    The first two turns of every chat about a lecture: the transcript as
+    context, and the lecture summary as the model's reply.
+    
+    Args:
+        transcript_text: Full transcript text to use as context
+        summary: Lecture summary
+        
+    Returns:
+        Serialized history, as produced by serialize_history()
+    """
+    context_prompt = f"""
     I am going to provide you with a text file of a lecture for context. 
     First, please summarize this lecture for me. Please keep it short and simple while still capturing a big picture.
     Then, use this text as the source of truth for our conversation.
@@ -41,12 +228,33 @@ def initialize_chat(transcript_text: str):
     {transcript_text}
     """
     
-    # Send the initial prompt to store the transcript in chat history
-    print(f"[DEBUG] Sending initial prompt to chat...")
-    chat.send_message(initial_prompt)
-    print(f"[DEBUG] Chat history length after sending prompt: {len(chat.history)}")
+    # history[0] = transcript context, history[1] = summary (see generate_summary)
+    return [
+        {"role": "user", "parts": [context_prompt]},
+        {"role": "model", "parts": [summary]}
+    ]
+
+def initialize_chat(transcript_text: str, summary: Optional[str] = None):
+    """
+    Initialize a chat session with transcript context.
+    
+    The transcript and the lecture summary are placed in the chat history
+    directly, so no Gemini call is made here when a summary is given.
+    
+    Args:
+        transcript_text: Full transcript text to use as context
+        summary: Lecture summary (from summarize_lecture() or the cache).
+                 If None, one is generated from the text.
+        
+    Returns:
+        ChatSession object
+    """
+    logger.debug("initialize_chat called with transcript_text length: %d", len(transcript_text) if transcript_text else 0)
+    
+    if summary is None:
+        summary = summarize_text(transcript_text)
     
-    return chat
+    return restore_chat(chat_context(transcript_text, summary))
 
 def generate_summary(chat_session) -> str:
     """
@@ -58,22 +266,48 @@ def generate_summary(chat_session) -> str:
     Returns:
         Summary text
     """
-    print(f"[DEBUG] generate_summary called")
-    print(f"[DEBUG] Chat history length: {len(chat_session.history)}")
-    
-    # The summary was already generated in initialize_chat()
+    # The summary was placed in the history by initialize_chat()
     # In Gemini chat history: history[0] = user message, history[1] = model response
     if len(chat_session.history) >= 2:
-        print(f"[DEBUG] Returning summary from history[1] (model response)")
         summary = chat_session.history[1].parts[0].text
-        print(f"[DEBUG] Summary length: {len(summary)}")
-        print(f"[DEBUG] Summary preview (first 200 chars): {summary[:200]}")
+        logger.debug("Summary preview (first 200 chars): %s", summary[:200])
         return summary
     else:
-        print(f"[DEBUG] ERROR: Chat history doesn't have enough messages!")
-        print(f"[DEBUG] History length: {len(chat_session.history)}")
+        logger.error("Chat history has %d messages, expected at least 2", len(chat_session.history))
         return "Error: No summary available"
 
+def serialize_history(chat_session) -> list:
+    """
+    Convert a chat session's history into plain JSON-serializable data so it
+    can be stored outside the process.
+    
+    Args:
+        chat_session: ChatSession object
+        
+    Returns:
+        List of {"role": ..., "parts": [text, ...]} dicts
+    """
+    return [
+        {
+            "role": content.role,
+            "parts": [part.text for part in content.parts]
+        }
+        for content in chat_session.history
+    ]
+
+def restore_chat(history: list):
+    """
+    Recreate a chat session from history produced by serialize_history().
+    
+    Args:
+        history: Serialized chat history
+        
+    Returns:
+        ChatSession object
+    """
+    model = get_model()
+    return model.start_chat(history=history)
+
 def send_chat_message(chat_session, message: str) -> str:
     """
     Send a message to the chat session and get a response.
@@ -85,13 +319,59 @@ def send_chat_message(chat_session, message: str) -> str:
     Returns:
         AI response text
     """
-    try:
-        response = chat_session.send_message(message)
+    def attempt(timeout):
+        with llm_call("chat") as call:
+            response = chat_session.send_message(message, request_options={"timeout": timeout})
+            call["usage"] = getattr(response, "usage_metadata", None)
         return response.text
+    
+    try:
+        # Not hedged: a duplicate message would be added to the chat history twice
+        return call_llm("chat", attempt, hedge=False)
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.exception("Error sending chat message")
         return f"Error: {str(e)}"
 
+def stream_chat_message(chat_session, message: str):
+    """
+    Send a message to the chat session and stream the response as it is generated.
+    
+    The chat session's history is updated once the stream has been fully consumed.
+    
+    Args:
+        chat_session: ChatSession object with transcript context
+        message: User's message
+        
+    Yields:
+        Chunks of the AI response text
+    """
+    timeout = llm_timeout()
+    if timeout <= 0:
+        raise DeadlineExceeded("No time left for chat_stream")
+    if not GEMINI_BREAKER.allow():
+        raise LLMUnavailableError("Gemini circuit is open, try again shortly")
+    succeeded = None
+    try:
+        with llm_call("chat_stream") as call:
+            response = chat_session.send_message(message, stream=True, request_options={"timeout": timeout})
+            for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+            call["usage"] = getattr(response, "usage_metadata", None)
+        succeeded = True
+    except Exception:
+        succeeded = False
+        raise
+    finally:
+        # A client that disconnects mid-stream (GeneratorExit) says nothing
+        # about Gemini, but must not leave a half-open circuit probing forever
+        if succeeded is None:
+            GEMINI_BREAKER.record_abandoned()
+        elif succeeded:
+            GEMINI_BREAKER.record_success()
+        else:
+            GEMINI_BREAKER.record_failure()
+
 def get_file_content(filename):
     """Reads the content of the local text file."""
     try:
@@ -104,6 +384,8 @@ def get_file_content(filename):
 def main():
     import sys
     
+    configure_logging()
+    
     # Default transcript file path
     default_file_path = "data/transcripts/cs50transcription_text.txt"
     
@@ -0,0 +1,144 @@
+"""
+Logging setup and metrics shared across the pipeline.
+
+Log records are handed to a queue and written by a background thread, so
+request threads never block on stderr. The level comes from LOG_LEVEL
+(default INFO); large payloads such as raw model output are only logged at
+DEBUG.
+
+Metrics defined here are exported at /api/metrics along with the rest of the
+registry (see metrics.py).
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import metrics
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'
+
+_listener = None
+_listener_lock = threading.Lock()
+
+PIPELINE_STAGE_DURATION = metrics.histogram(
+    'pipeline_stage_duration_seconds',
+    'Time spent in each stage of video processing',
+    ['stage']
+)
+LLM_REQUEST_DURATION = metrics.histogram(
+    'llm_request_duration_seconds',
+    'Latency of LLM API calls by call site',
+    ['call_site']
+)
+LLM_TOKENS = metrics.counter(
+    'llm_tokens_total',
+    'Tokens sent to (prompt) and received from (output) the LLM, by call site',
+    ['call_site', 'direction']
+)
+LLM_ERRORS = metrics.counter(
+    'llm_errors_total',
+    'LLM API calls that raised an error, by call site',
+    ['call_site']
+)
+CACHE_LOOKUPS = metrics.counter(
+    'cache_lookups_total',
+    'Cache lookups by cache and result (hit or miss)',
+    ['cache', 'result']
+)
+CACHE_HIT_RATIO = metrics.gauge(
+    'cache_hit_ratio',
+    'Fraction of lookups served from each cache since the worker started',
+    ['cache']
+)
+
+
+def configure_logging(level: Optional[str] = None) -> None:
+    """
+    Route all logging through a queue drained by a background thread.
+
+    Safe to call more than once; only the first call has an effect.
+
+    Args:
+        level: Log level name. Defaults to the LOG_LEVEL environment variable, then INFO.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        # Flush whatever is still queued when the process exits
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger()
+        root.handlers = [logging.handlers.QueueHandler(log_queue)]
+        root.setLevel((level or os.getenv('LOG_LEVEL') or 'INFO').upper())
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage."""
+    with PIPELINE_STAGE_DURATION.time(stage=name):
+        yield
+
+
+@contextmanager
+def llm_call(call_site: str):
+    """
+    Time an LLM API call and count its errors.
+
+    Yields a dict; set its "usage" entry to the response's usage metadata
+    (an SDK usage_metadata object or a REST usageMetadata dict) to count tokens.
+    """
+    call = {}
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        LLM_ERRORS.inc(call_site=call_site)
+        raise
+    finally:
+        LLM_REQUEST_DURATION.observe(time.perf_counter() - start, call_site=call_site)
+
+    usage = call.get('usage')
+    if usage:
+        record_llm_tokens(call_site, usage)
+
+
+def record_llm_tokens(call_site: str, usage) -> None:
+    """Count prompt and output tokens from a response's usage metadata."""
+    if isinstance(usage, dict):
+        prompt_tokens = usage.get('promptTokenCount')
+        output_tokens = usage.get('candidatesTokenCount')
+    else:
+        prompt_tokens = getattr(usage, 'prompt_token_count', None)
+        output_tokens = getattr(usage, 'candidates_token_count', None)
+
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, call_site=call_site, direction='prompt')
+    if output_tokens:
+        LLM_TOKENS.inc(output_tokens, call_site=call_site, direction='output')
+
+
+def record_cache_lookup(cache: str, hits: int = 0, misses: int = 0) -> None:
+    """Count cache hits and misses and update the cache's hit ratio."""
+    if hits:
+        CACHE_LOOKUPS.inc(hits, cache=cache, result='hit')
+    if misses:
+        CACHE_LOOKUPS.inc(misses, cache=cache, result='miss')
+
+    total_hits = CACHE_LOOKUPS.value(cache=cache, result='hit')
+    total = total_hits + CACHE_LOOKUPS.value(cache=cache, result='miss')
+    if total:
+        CACHE_HIT_RATIO.set(total_hits / total, cache=cache)
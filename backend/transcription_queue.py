@@ -0,0 +1,246 @@
+"""
+Host-wide scheduling of transcription work.
+
+Whisper is the shared bottleneck: without a queue a 5-minute clip uploaded
+just after a 3-hour recording waits for the long one (or competes with it
+for the CPU). Uploads that need transcribing therefore take a slot from a
+scheduler shared by all worker processes through a SQLite database, and free
+slots go to the cheapest waiting job:
+
+- A job's cost is its media duration, probed with ffprobe.
+- Each client's queued jobs are charged the cost of its own jobs ahead of
+  them, so one client's batch of clips interleaves with other clients'
+  uploads instead of all going first.
+- Waiting earns credit (TRANSCRIPTION_AGING_RATE seconds of media per second
+  waited) so long recordings are never starved.
+- A client runs at most TRANSCRIPTION_MAX_PER_CLIENT jobs at once while other
+  clients are waiting.
+
+TRANSCRIPTION_SLOTS jobs run at once: by default as many as there are
+gunicorn workers (WEB_CONCURRENCY) or, failing that, CPU cores. Set it to 1
+to run one transcription at a time, e.g. when Whisper runs on a single GPU.
+"""
+import collections
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPTION_QUEUE_PATH = os.getenv('TRANSCRIPTION_QUEUE_PATH', 'data/state/transcription_queue.db')
+# Transcriptions run at once on this host; by default one per gunicorn
+# worker (WEB_CONCURRENCY), else one per core, like the workers themselves
+TRANSCRIPTION_SLOTS = int(os.getenv('TRANSCRIPTION_SLOTS') or os.getenv('WEB_CONCURRENCY') or os.cpu_count() or 1)
+# Transcriptions one client may run at once while others are waiting
+TRANSCRIPTION_MAX_PER_CLIENT = int(os.getenv('TRANSCRIPTION_MAX_PER_CLIENT', '1'))
+# Seconds of media a job's cost drops by for every second it waits
+TRANSCRIPTION_AGING_RATE = float(os.getenv('TRANSCRIPTION_AGING_RATE', '10'))
+POLL_SECONDS = 0.25
+
+FFPROBE_TIMEOUT_SECONDS = 30
+# Used to estimate duration from file size when ffprobe is unavailable (about 2 Mbit/s)
+FALLBACK_BYTES_PER_SECOND = 250_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    client TEXT NOT NULL,
+    cost REAL NOT NULL,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    pid INTEGER NOT NULL
+)
+"""
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+class SlotCancelled(Exception):
+    """The caller of TranscriptionScheduler.slot() gave up waiting."""
+
+
+class QueuedJob(NamedTuple):
+    job_id: str
+    client: str
+    cost: float
+    enqueued_at: float
+    started_at: Optional[float]
+    pid: int
+
+
+def probe_duration(path: str) -> Optional[float]:
+    """
+    Get a media file's duration with ffprobe.
+
+    Returns:
+        Duration in seconds, or None if ffprobe is missing or fails
+    """
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', path],
+            capture_output=True, text=True, timeout=FFPROBE_TIMEOUT_SECONDS, check=True
+        )
+        return float(json.loads(result.stdout)['format']['duration'])
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError) as e:
+        logger.warning("Could not probe the duration of %s: %s", path, e)
+        return None
+
+
+def estimate_duration(path: str) -> float:
+    """Media duration in seconds from ffprobe, or estimated from the file size."""
+    duration = probe_duration(path)
+    if duration is None:
+        duration = os.path.getsize(path) / FALLBACK_BYTES_PER_SECOND
+    return duration
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TranscriptionScheduler:
+    """
+    Shortest-job-first scheduler with aging and per-client fairness, shared
+    by all worker processes on the host through a SQLite database (WAL mode).
+    """
+
+    def __init__(self, path: str = TRANSCRIPTION_QUEUE_PATH, slots: int = TRANSCRIPTION_SLOTS,
+                 max_per_client: int = TRANSCRIPTION_MAX_PER_CLIENT, aging_rate: float = TRANSCRIPTION_AGING_RATE):
+        self.path = path
+        self.slots = slots
+        self.max_per_client = max_per_client
+        self.aging_rate = aging_rate
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connect().execute(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _jobs(self, conn: sqlite3.Connection) -> List[QueuedJob]:
+        return [QueuedJob(*row) for row in conn.execute(
+            'SELECT job_id, client, cost, enqueued_at, started_at, pid FROM jobs'
+        )]
+
+    def _reap(self, conn: sqlite3.Connection, jobs: List[QueuedJob]) -> List[QueuedJob]:
+        """Drop jobs whose worker process has died."""
+        alive = {pid: _is_alive(pid) for pid in {job.pid for job in jobs}}
+        dead = [job for job in jobs if not alive[job.pid]]
+        for job in dead:
+            logger.warning("Dropping transcription job %s of dead process %d", job.job_id, job.pid)
+            conn.execute('DELETE FROM jobs WHERE job_id = ?', (job.job_id,))
+        return [job for job in jobs if alive[job.pid]]
+
+    def _ranked(self, jobs: List[QueuedJob], now: float) -> List[QueuedJob]:
+        """
+        Waiting jobs in the order they should start: eligible jobs (client
+        under its cap) first, then by cost plus the cost of the client's
+        earlier jobs, minus aging credit.
+        """
+        running = collections.Counter(job.client for job in jobs if job.started_at is not None)
+        ahead = collections.Counter()
+        charged = {}
+        for job in sorted(jobs, key=lambda j: (j.started_at is None, j.enqueued_at)):
+            charged[job.job_id] = ahead[job.client] + job.cost - self.aging_rate * (now - job.enqueued_at)
+            ahead[job.client] += job.cost
+
+        waiting = [job for job in jobs if job.started_at is None]
+        return sorted(waiting, key=lambda job: (
+            running[job.client] >= self.max_per_client, charged[job.job_id], job.enqueued_at
+        ))
+
+    def _try_start(self, job_id: str) -> bool:
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            jobs = self._reap(conn, self._jobs(conn))
+            started = False
+            if sum(job.started_at is not None for job in jobs) < self.slots:
+                ranked = self._ranked(jobs, time.time())
+                if ranked and ranked[0].job_id == job_id:
+                    conn.execute('UPDATE jobs SET started_at = ? WHERE job_id = ?', (time.time(), job_id))
+                    started = True
+            conn.execute('COMMIT')
+            return started
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    @contextmanager
+    def slot(self, job_id: str, client: str, cost: float,
+             cancelled: Optional[Callable[[], bool]] = None) -> Iterator[float]:
+        """
+        Wait for a transcription slot and hold it for the with-block.
+
+        Args:
+            job_id: Unique job identifier (the upload's video_id)
+            client: Who submitted the job, for fairness
+            cost: Estimated cost, in seconds of media
+            cancelled: Polled while waiting; once it returns True the job
+                leaves the queue and SlotCancelled is raised
+
+        Yields:
+            Seconds spent waiting in the queue
+        """
+        conn = self._connect()
+        enqueued_at = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO jobs (job_id, client, cost, enqueued_at, started_at, pid) VALUES (?, ?, ?, ?, NULL, ?)',
+            (job_id, client, cost, enqueued_at, os.getpid())
+        )
+        try:
+            while not self._try_start(job_id):
+                if cancelled is not None and cancelled():
+                    raise SlotCancelled(job_id)
+                time.sleep(POLL_SECONDS)
+            yield time.time() - enqueued_at
+        finally:
+            conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+
+    def position(self, job_id: str) -> Optional[int]:
+        """
+        A waiting job's place in the queue (0 = next to start), or None if it
+        is not waiting. Positions can change as other jobs arrive.
+        """
+        ranked = self._ranked(self._jobs(self._connect()), time.time())
+        for i, job in enumerate(ranked):
+            if job.job_id == job_id:
+                return i
+        return None
+
+    def counts(self) -> dict:
+        """Number of running and waiting jobs on the host."""
+        jobs = self._jobs(self._connect())
+        running = sum(job.started_at is not None for job in jobs)
+        return {'running': running, 'waiting': len(jobs) - running}
+
+
+def get_transcription_scheduler() -> TranscriptionScheduler:
+    """Get the process-wide scheduler, creating it on first use."""
+    global _default_scheduler
+    if _default_scheduler is None:
+        with _default_scheduler_lock:
+            if _default_scheduler is None:
+                _default_scheduler = TranscriptionScheduler()
+    return _default_scheduler
@@ -0,0 +1,146 @@
+"""
+Fast voice activity detection on decoded 16 kHz audio, so Whisper only runs
+over speech.
+
+A frame counts as speech when it is well above the recording's noise floor
+and its loudness fluctuates the way speech does (syllables and short pauses
+make the energy envelope swing by several dB within a second, while silence,
+room noise and sustained music stay flat). Speech frames are grouped into
+padded regions; short pauses stay inside a region so Whisper keeps its
+context.
+
+compact() joins the speech regions into one shorter track and returns a
+Timeline that maps times on it back to the original recording.
+"""
+import bisect
+import os
+from typing import List, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+# Frames this far above the noise floor (at most) are loud enough for speech
+VAD_MARGIN_DB = float(os.getenv('VAD_MARGIN_DB', '12'))
+# Frames quieter than this are always silence
+SILENCE_DBFS = -60.0
+# Loudness must vary by at least this much (std, in dB) over MODULATION_SECONDS
+MIN_MODULATION_DB = float(os.getenv('VAD_MIN_MODULATION_DB', '3'))
+MODULATION_SECONDS = 1.0
+# Pauses shorter than this do not split a speech region
+MIN_SILENCE_SECONDS = 1.0
+# Speech regions shorter than this are dropped
+MIN_SPEECH_SECONDS = 0.25
+# Audio kept either side of every speech region
+PAD_SECONDS = 0.3
+# Silence placed between joined regions so words do not run together
+JOIN_SILENCE_SECONDS = 0.5
+
+
+def frame_energies(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Loudness of consecutive FRAME_SECONDS frames, in dBFS."""
+    frame = int(FRAME_SECONDS * sample_rate)
+    n_frames = len(audio) // frame
+    frames = audio[:n_frames * frame].reshape(n_frames, frame).astype(np.float32)
+    return 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+
+def _runs(mask: np.ndarray) -> List[Tuple[int, int]]:
+    """(start, end) frame ranges where mask is True (end exclusive)."""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return list(zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()))
+
+
+def speech_regions(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> List[Tuple[float, float]]:
+    """
+    Find the parts of a recording that contain speech.
+
+    Args:
+        audio: Mono float32 samples
+        sample_rate: Sample rate of audio
+
+    Returns:
+        Sorted, non-overlapping (start, end) times in seconds
+    """
+    energy = frame_energies(audio, sample_rate)
+    if len(energy) == 0:
+        return []
+
+    floor = np.percentile(energy, 5)
+    loud = np.percentile(energy, 95)
+    threshold = max(floor + min(VAD_MARGIN_DB, 0.5 * (loud - floor)), SILENCE_DBFS)
+    speech = energy > threshold
+
+    # Loudness swings of speech, measured over a window centred on each frame
+    half = int(MODULATION_SECONDS / FRAME_SECONDS) // 2
+    if len(energy) > 2 * half:
+        padded = np.pad(energy, half, mode='edge')
+        modulation = sliding_window_view(padded, 2 * half + 1).std(axis=-1)
+        speech &= modulation > MIN_MODULATION_DB
+
+    # Close short pauses, then drop blips
+    for start, end in _runs(~speech):
+        if 0 < start and end < len(speech) and (end - start) * FRAME_SECONDS < MIN_SILENCE_SECONDS:
+            speech[start:end] = True
+
+    duration = len(audio) / sample_rate
+    regions = []
+    for start, end in _runs(speech):
+        if (end - start) * FRAME_SECONDS < MIN_SPEECH_SECONDS:
+            continue
+        region = (max(0.0, start * FRAME_SECONDS - PAD_SECONDS), min(duration, end * FRAME_SECONDS + PAD_SECONDS))
+        if regions and region[0] <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], region[1])
+        else:
+            regions.append(region)
+    return regions
+
+
+class Timeline:
+    """Maps times on a compacted track back to the original recording."""
+
+    def __init__(self):
+        self._compact_starts: List[float] = []
+        self._pieces: List[Tuple[float, float, float]] = []   # (compact start, original start, length)
+
+    def add(self, compact_start: float, original_start: float, length: float) -> None:
+        self._compact_starts.append(compact_start)
+        self._pieces.append((compact_start, original_start, length))
+
+    def to_original(self, t: float) -> float:
+        """Original time of compacted time t (times in a join gap map to the next piece's start)."""
+        i = max(bisect.bisect_right(self._compact_starts, t) - 1, 0)
+        compact_start, original_start, length = self._pieces[i]
+        if t - compact_start > length and i + 1 < len(self._pieces):
+            return self._pieces[i + 1][1]
+        return original_start + min(max(t - compact_start, 0.0), length)
+
+
+def compact(audio: np.ndarray, regions: List[Tuple[float, float]],
+            sample_rate: int = SAMPLE_RATE) -> Tuple[np.ndarray, Timeline]:
+    """
+    Join the given regions of a recording into one track.
+
+    Args:
+        audio: Mono float32 samples
+        regions: Sorted (start, end) times in seconds, e.g. from speech_regions()
+        sample_rate: Sample rate of audio
+
+    Returns:
+        Tuple of (compacted samples, Timeline mapping them back)
+    """
+    gap = np.zeros(int(JOIN_SILENCE_SECONDS * sample_rate), dtype=audio.dtype)
+    pieces = []
+    timeline = Timeline()
+    position = 0
+    for start, end in regions:
+        if pieces:
+            pieces.append(gap)
+            position += len(gap)
+        piece = audio[int(start * sample_rate):int(end * sample_rate)]
+        timeline.add(position / sample_rate, start, len(piece) / sample_rate)
+        pieces.append(piece)
+        position += len(piece)
+    compacted = np.concatenate(pieces) if pieces else np.empty(0, dtype=audio.dtype)
+    return compacted, timeline
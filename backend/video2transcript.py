@@ -1,7 +1,28 @@
-import whisper
 import json
+import logging
 import os
-from typing import Dict, Any
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+import metrics
+from fingerprint import AudioMatch, plan_reuse
+from services import get_whisper
+from telemetry import configure_logging
+from vad import compact, speech_regions
+
+logger = logging.getLogger(__name__)
+
+# Whisper's input: 16 kHz mono float32 samples
+SAMPLE_RATE = 16000
+# Only run Whisper over the speech found by the VAD pre-pass (see vad.py)
+VAD_ENABLED = os.getenv("VAD_ENABLED", "1") != "0"
+
+TRANSCRIPTION_AUDIO = metrics.counter(
+    "transcription_audio_seconds_total",
+    "Seconds of audio passed to Whisper (speech) or skipped by the VAD pre-pass (skipped)",
+    ["kind"]
+)
 
 # Global model cache
 _model = None
@@ -10,44 +31,129 @@ def get_model():
     """Get or initialize the Whisper model (cached)."""
     global _model
     if _model is None:
-        _model = whisper.load_model("base")
+        _model = get_whisper().load_model("base")
     return _model
 
-def transcribe_video(video_path: str, output_dir: str = "data/transcripts") -> Dict[str, Any]:
+def load_audio(video_path: str) -> np.ndarray:
+    """Decode a video's audio track to 16 kHz mono float32 samples (needs ffmpeg)."""
+    return get_whisper().load_audio(video_path)
+
+def _transcribe_spans(audio: np.ndarray, spans: List[Tuple[float, float]]) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Transcribe spans of an audio track in one Whisper pass.
+    
+    Unless VAD_ENABLED is off, only the speech inside the spans is passed to
+    Whisper: it is joined into one shorter track and segment times are mapped
+    back to the original timeline.
+    
+    Returns:
+        Tuple of (segments with id, start, end and text; full text)
+    """
+    total = sum(end - start for start, end in spans)
+    regions = spans
+    if VAD_ENABLED:
+        regions = [
+            (start + a, start + b)
+            for start, end in spans
+            for a, b in speech_regions(audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)])
+        ]
+        # Rather transcribe everything than nothing if no speech was found
+        regions = regions or spans
+    
+    speech = sum(end - start for start, end in regions)
+    TRANSCRIPTION_AUDIO.inc(speech, kind="speech")
+    TRANSCRIPTION_AUDIO.inc(total - speech, kind="skipped")
+    if total - speech > 0:
+        logger.info("Skipping %.1fs of %.1fs of audio as non-speech (%.0f%%)",
+                    total - speech, total, 100 * (total - speech) / total)
+    
+    if regions == [(0.0, len(audio) / SAMPLE_RATE)]:
+        track, to_original = audio, lambda t: t
+    else:
+        track, timeline = compact(audio, regions, SAMPLE_RATE)
+        to_original = timeline.to_original
+    
+    result = get_model().transcribe(track, verbose=False)
+    segments = [
+        {
+            "id": i,
+            "start": round(to_original(segment["start"]), 2),
+            "end": round(to_original(segment["end"]), 2),
+            "text": segment["text"].strip()
+        }
+        for i, segment in enumerate(result["segments"])
+    ]
+    return segments, result["text"]
+
+def transcribe_video(video_path: str, output_dir: str = "data/transcripts", audio: np.ndarray = None) -> Dict[str, Any]:
     """
-    Transcribe a video file using Whisper.
+    Transcribe a video file using Whisper, skipping silence and other non-speech.
     
     Args:
         video_path: Path to the video file
         output_dir: Directory to save transcript files
+        audio: The video's audio from load_audio(), if already decoded
         
     Returns:
         Dictionary containing:
         - segments: List of transcript segments with timestamps
         - full_text: Complete transcript text
     """
-    model = get_model()
-    
-    print("Starting transcription...")
+    logger.info("Starting transcription of %s", video_path)
     
-    result = model.transcribe(video_path, verbose=False)
-    
-    # Create simplified segments
-    simplified_segments = []
-    for segment in result["segments"]:
-        simplified_segments.append({
-            "id": segment["id"],
-            "start": round(segment["start"], 2),
-            "end": round(segment["end"], 2),
-            "text": segment["text"].strip()
-        })
+    if audio is None:
+        audio = load_audio(video_path)
+    segments, full_text = _transcribe_spans(audio, [(0.0, len(audio) / SAMPLE_RATE)])
     
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
     return {
-        "segments": simplified_segments,
-        "full_text": result["text"]
+        "segments": segments,
+        "full_text": full_text
+    }
+
+def transcribe_regions(audio: np.ndarray, regions: List[Tuple[float, float]]) -> List[Dict[str, Any]]:
+    """
+    Transcribe parts of an audio track.
+    
+    Args:
+        audio: Audio from load_audio()
+        regions: (start, end) times in seconds
+        
+    Returns:
+        Segments of all regions, with timestamps on the full track's timeline
+    """
+    if not regions:
+        return []
+    logger.info("Transcribing %d regions: %s", len(regions), ", ".join(f"{s:.1f}s - {e:.1f}s" for s, e in regions))
+    segments, _ = _transcribe_spans(audio, regions)
+    return segments
+
+def reuse_transcript(audio: np.ndarray, cached_segments: List[Dict[str, Any]], match: AudioMatch) -> Dict[str, Any]:
+    """
+    Build a transcript from a matching cached lecture's segments, transcribing
+    only the parts of the audio the match does not cover.
+    
+    Args:
+        audio: Audio of the upload from load_audio()
+        cached_segments: Transcript segments of the matched lecture
+        match: Audio match from fingerprint.FingerprintIndex.find_match
+        
+    Returns:
+        Dictionary with segments and full_text, as from transcribe_video
+    """
+    reused, regions = plan_reuse(cached_segments, match, len(audio) / SAMPLE_RATE)
+    logger.info("Reusing %d segments of %s (offset %.2fs), transcribing %d regions (%.1fs)",
+                len(reused), match.cache_key, match.offset, len(regions), sum(e - s for s, e in regions))
+    
+    segments = sorted(reused + transcribe_regions(audio, regions), key=lambda seg: seg["start"])
+    for i, segment in enumerate(segments):
+        segment["id"] = i
+    
+    return {
+        "segments": segments,
+        "full_text": " ".join(segment["text"] for segment in segments)
     }
 
 def save_transcript(transcript_data: Dict[str, Any], video_id: str, output_dir: str = "data/transcripts") -> None:
@@ -75,6 +181,8 @@ def save_transcript(transcript_data: Dict[str, Any], video_id: str, output_dir:
 def main():
     import sys
     
+    configure_logging()
+    
     if len(sys.argv) > 1:
         filename = sys.argv[1]
     else:
@@ -0,0 +1,7 @@
+"""WSGI entry point for running the backend under a production server.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import app
+
+__all__ = ['app']